@@ -0,0 +1,248 @@
+"""Agreement between two markups of the same image.
+
+Minutiae of a reference markup and a second markup are paired one to one by
+optimal assignment: among all pairings within the distance and angle
+tolerance, the one pairing the most minutiae with the smallest total
+deviation wins. Unpaired reference minutiae are missing from the second
+markup, unpaired minutiae of the second markup are extra. Run as a script
+it compares every annotated image of a dataset folder against the markups
+of a second annotator in parallel and prints the aggregated statistics.
+"""
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from annotations import find_annotation, read_template
+from thumbnails import scan_folder
+
+MATCH_DISTANCE = 12.0  # Pixels between minutiae counting as the same point
+MATCH_ANGLE = 30.0  # Degrees between their angles
+
+
+def linear_assignment(cost):
+    """Returns (rows, cols) of the minimum cost assignment of a cost matrix.
+
+    Hungarian algorithm with potentials, O(n^2 m) for n <= m with the inner
+    loop over the columns vectorized. Every row of the smaller side is
+    assigned.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = linear_assignment(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # Row (1-based) assigned to each column
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        # Grow an alternating path from row i until it reaches a free column
+        owner[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(candidates.argmin()) + 1
+            delta = candidates[j1 - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        # Flip the path
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    cols = np.flatnonzero(owner[1:])
+    return owner[1:][cols] - 1, cols
+
+
+class Agreement:
+    """Pairs, missing and extra minutiae of a markup against a reference."""
+
+    def __init__(self, pairs, missing, extra, counts):
+        self.pairs = pairs  # [(index in reference, index in other)]
+        self.missing = missing  # Reference indices without a partner
+        self.extra = extra  # Other indices without a partner
+        self.counts = counts  # {type: [same type pairs, in reference, in other]}
+
+    def precision(self, m_type=None):
+        """Share of the other minutiae paired with the same type, or None if
+        the other markup has none."""
+        return self._ratio(m_type, 2)
+
+    def recall(self, m_type=None):
+        """Share of the reference minutiae paired with the same type, or None
+        if the reference has none."""
+        return self._ratio(m_type, 1)
+
+    def _ratio(self, m_type, column):
+        types = [m_type] if m_type is not None else list(self.counts)
+        found = sum(self.counts[t][0] for t in types if t in self.counts)
+        total = sum(self.counts[t][column] for t in types if t in self.counts)
+        return found / total if total else None
+
+    def add(self, other):
+        """Accumulates the counts of another Agreement, for dataset totals."""
+        self.pairs = self.pairs + other.pairs
+        self.missing = self.missing + other.missing
+        self.extra = self.extra + other.extra
+        for m_type, counts in other.counts.items():
+            total = self.counts.setdefault(m_type, [0, 0, 0])
+            for k in range(3):
+                total[k] += counts[k]
+        return self
+
+    def report(self):
+        lines = [
+            f"Matched: {len(self.pairs)}  Missing: {len(self.missing)}  "
+            f"Extra: {len(self.extra)}",
+            f"Precision: {format_ratio(self.precision())}  "
+            f"Recall: {format_ratio(self.recall())}",
+        ]
+        for m_type in sorted(self.counts):
+            lines.append(
+                f"  {m_type}: precision {format_ratio(self.precision(m_type))}, "
+                f"recall {format_ratio(self.recall(m_type))}"
+            )
+        return "\n".join(lines)
+
+
+def format_ratio(value, digits=3):
+    """Formats a precision or recall, "n/a" when there was nothing to count."""
+    return "n/a" if value is None else f"{value:.{digits}f}"
+
+
+def compare(reference, other):
+    """Pairs two lists of (x, y, angle, quality, type) records. Returns an Agreement.
+
+    A pair counts towards the per-type figures only if both minutiae have
+    the same type.
+    """
+    ref = np.array([r[:3] for r in reference], dtype=np.float64).reshape(-1, 3)
+    oth = np.array([r[:3] for r in other], dtype=np.float64).reshape(-1, 3)
+    distance = np.hypot(
+        ref[:, None, 0] - oth[None, :, 0], ref[:, None, 1] - oth[None, :, 1]
+    )
+    angle = np.abs((ref[:, None, 2] - oth[None, :, 2] + 180) % 360 - 180)
+    feasible = (distance <= MATCH_DISTANCE) & (angle <= MATCH_ANGLE)
+
+    # Only minutiae with some partner in tolerance take part in the assignment
+    rows = np.flatnonzero(feasible.any(axis=1))
+    cols = np.flatnonzero(feasible.any(axis=0))
+    pairs = []
+    if len(rows):
+        sub = feasible[np.ix_(rows, cols)]
+        cost = (
+            distance[np.ix_(rows, cols)] / MATCH_DISTANCE
+            + angle[np.ix_(rows, cols)] / MATCH_ANGLE
+        )
+        # Any infeasible pair costs more than all feasible ones together, so
+        # the number of pairs is maximized before their deviation is minimized
+        cost[~sub] = 2 * min(sub.shape) + 1
+        ia, ib = linear_assignment(cost)
+        keep = sub[ia, ib]
+        pairs = list(zip(rows[ia[keep]].tolist(), cols[ib[keep]].tolist()))
+
+    paired_ref = {i for i, _ in pairs}
+    paired_oth = {j for _, j in pairs}
+    counts = {}
+    for record in reference:
+        counts.setdefault(record[4], [0, 0, 0])[1] += 1
+    for record in other:
+        counts.setdefault(record[4], [0, 0, 0])[2] += 1
+    for i, j in pairs:
+        if reference[i][4] == other[j][4]:
+            counts[reference[i][4]][0] += 1
+    return Agreement(
+        pairs,
+        [i for i in range(len(reference)) if i not in paired_ref],
+        [j for j in range(len(other)) if j not in paired_oth],
+        counts,
+    )
+
+
+def compare_files(image_path, other_folder):
+    """Compares the markup of an image with the one in `other_folder`.
+
+    Runs inside a worker process. Returns (image path, Agreement), or
+    (image path, None) when either markup is missing.
+    """
+    reference_path = find_annotation(image_path)
+    other_path = find_annotation(
+        os.path.join(other_folder, os.path.basename(image_path))
+    )
+    if reference_path is None or other_path is None:
+        return image_path, None
+    return image_path, compare(read_template(reference_path), read_template(other_path))
+
+
+def compare_dataset(folder, other_folder, workers=None):
+    """Returns [(image path, Agreement or None)] for every image of a folder."""
+    image_paths = scan_folder(folder)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                compare_files,
+                image_paths,
+                [other_folder] * len(image_paths),
+                chunksize=16,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the markups of a dataset against a second annotator."
+    )
+    parser.add_argument("dataset", help="Folder with images and reference markups")
+    parser.add_argument("other", help="Folder with the second markups, same names")
+    parser.add_argument("--csv", help="Write per-image figures to this file")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    results = compare_dataset(args.dataset, args.other, args.workers)
+    compared = [(path, a) for path, a in results if a is not None]
+    total = Agreement([], [], [], {})
+    for _, agreement in compared:
+        total.add(agreement)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["image", "matched", "missing", "extra", "precision", "recall"]
+            )
+            for path, a in compared:
+                writer.writerow(
+                    [
+                        os.path.basename(path),
+                        len(a.pairs),
+                        len(a.missing),
+                        len(a.extra),
+                        format_ratio(a.precision(), 4),
+                        format_ratio(a.recall(), 4),
+                    ]
+                )
+
+    print(f"Compared {len(compared)} of {len(results)} images")
+    print(total.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import os
+
+from tracing import traced
+
+# Extensions of annotation files stored next to an image, in lookup order
+ANNOTATION_EXTENSIONS = (".txt", ".iso", ".ist")
+ISO_EXTENSIONS = (".iso", ".ist", ".dat")
+
+# Extended data area types of ISO 19794-2:2005
+RIDGE_COUNT_AREA = 0x0001
+CORE_DELTA_AREA = 0x0002
+
+# Kinds of the singular points of a markup
+CORE, DELTA = 1, -1
+
+# Quality dropdown values and the ISO quality byte written for them
+QUALITY_VALUES = {
+    "not set": 0,
+    "poor": 20,
+    "fair": 40,
+    "good": 60,
+    "very good": 80,
+    "excellent": 100,
+}
+
+
+class Minutiae:
+    def __init__(self, type, x, y, angle, quality):
+        self.type = type
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.quality = quality
+
+
+@traced(category="codec")
+def parse_iso19794(t):
+    """Parses the minutiae of an ISO 19794-2:2005 template held in memory."""
+    minutiae_num = int.from_bytes(t[27:28], "big")
+    minutiaes = []
+    for i in range(minutiae_num):
+        x = 28 + 6 * i
+        min_type = (t[x] >> 6) & 0x3
+        min_x = int.from_bytes([t[x] & 0x3F, t[x + 1]], "big")
+        min_y = int.from_bytes(t[x + 2 : x + 4], "big")
+        angle = round((t[x + 4] / 256 * 360)) % 360
+        min_quality = t[x + 5]
+        minutiaes.append(Minutiae(min_type, min_x, min_y, angle, min_quality))
+    return minutiaes
+
+
+def parse_iso_size(t):
+    """Returns the (width, height) of the image of a template header in memory."""
+    return int.from_bytes(t[14:16], "big"), int.from_bytes(t[16:18], "big")
+
+
+def parse_extended_data(t):
+    """Returns {type id: data} of the extended data areas of a template in memory."""
+    offset = 28 + 6 * t[27]
+    end = offset + 2 + int.from_bytes(t[offset : offset + 2], "big")
+    areas = {}
+    pos = offset + 2
+    while pos + 4 <= min(end, len(t)):
+        type_id = int.from_bytes(t[pos : pos + 2], "big")
+        length = int.from_bytes(t[pos + 2 : pos + 4], "big")
+        if length < 4:
+            break
+        areas[type_id] = bytes(t[pos + 4 : pos + length])
+        pos += length
+    return areas
+
+
+def extended_data_area(type_id, data):
+    """Encodes an extended data area; its length includes the 4 header bytes."""
+    return type_id.to_bytes(2, "big") + (len(data) + 4).to_bytes(2, "big") + data
+
+
+def ridge_count_area(counts):
+    """Encodes (i, j, count) ridge counts with 0-based minutia indices.
+
+    Indices are written 1-based, in the order of the minutiae in the record.
+    """
+    data = bytearray([0])  # Extraction method: non-specific (nearest neighbours)
+    for i, j, count in counts:
+        data += bytes([i + 1, j + 1, min(count, 255)])
+    return extended_data_area(RIDGE_COUNT_AREA, bytes(data))
+
+
+def parse_ridge_counts(data):
+    """Decodes a ridge count area into (i, j, count) with 0-based indices."""
+    return [
+        (data[k] - 1, data[k + 1] - 1, data[k + 2]) for k in range(1, len(data) - 2, 3)
+    ]
+
+
+def core_delta_area(cores, deltas):
+    """Encodes (x, y) cores and deltas, without angles, at most 15 of each."""
+    data = bytearray()
+    for points in (cores[:15], deltas[:15]):
+        data.append(len(points))  # Information type 0 (no angles) and count
+        for x, y in points:
+            data += (x & 0x3FFF).to_bytes(2, "big") + (y & 0x3FFF).to_bytes(2, "big")
+    return extended_data_area(CORE_DELTA_AREA, bytes(data))
+
+
+def parse_core_delta(data):
+    """Decodes a core and delta area into ([(x, y)] cores, [(x, y)] deltas)."""
+    result, pos = [], 0
+    for angle_bytes in (1, 3):  # A core has one angle, a delta three
+        header = data[pos]
+        angular = (header >> 6) == 1
+        pos += 1
+        points = []
+        for _ in range(header & 0x0F):
+            x = int.from_bytes(data[pos : pos + 2], "big") & 0x3FFF
+            y = int.from_bytes(data[pos + 2 : pos + 4], "big") & 0x3FFF
+            points.append((x, y))
+            pos += 4 + (angle_bytes if angular else 0)
+        result.append(points)
+    return result[0], result[1]
+
+
+def read_iso19794(path):
+    with open(path, "rb") as f:
+        return parse_iso19794(f.read())
+
+
+def iso_type_name(min_type):
+    if min_type == 0:
+        return "other"
+    elif min_type == 1:
+        return "ending"
+    return "bifurcation"
+
+
+def iso_type_code(m_type):
+    if m_type == "ending":
+        return 1
+    elif m_type == "bifurcation":
+        return 2
+    return 0
+
+
+def iso_quality(quality):
+    """Returns the ISO quality byte of a numeric or dropdown quality."""
+    try:
+        return int(quality)
+    except ValueError:
+        return QUALITY_VALUES.get(quality, 0)
+
+
+@traced(category="codec")
+def encode_iso19794(records, width, height, extended=b""):
+    """Encodes (x, y, angle, quality, type) records as an ISO 19794-2:2005 template.
+
+    `extended` holds the already encoded extended data areas, if any.
+    """
+    minutiae_num = len(records)
+    totalbytes = minutiae_num * 6 + 28 + 2 + len(extended)
+
+    b_array = bytearray(b"FMR\x00 20\x00")
+    b_array += totalbytes.to_bytes(4, "big")
+    b_array += bytearray(b"\x00\x00")
+    b_array += width.to_bytes(2, "big")
+    b_array += height.to_bytes(2, "big")
+    b_array += bytearray(
+        b"\x00\xc5\x00\xc5\x01\x00\x00\x00d"
+    )  # resolution x, resolution y, fingerprint count, reserved
+    b_array += minutiae_num.to_bytes(1, "big")
+    for x, y, angle, quality, m_type in records:
+        b_array += bytes(
+            [
+                x // 256 + iso_type_code(m_type) * 64,
+                x % 256,
+                y // 256,
+                y % 256,
+                round(angle / 360 * 256) % 256,
+                iso_quality(quality),
+            ]
+        )
+
+    b_array += len(extended).to_bytes(2, "big")
+    b_array += extended
+    return bytes(b_array)
+
+
+def write_iso19794(path, records, width, height, extended=b""):
+    with open(path, "wb") as f:
+        f.write(encode_iso19794(records, width, height, extended))
+
+
+@traced(category="codec")
+def read_minutiae_txt(path):
+    """Reads a `type,x,y,angle,quality` file into (x, y, angle, quality, type) records."""
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            m_type, x, y, angle, quality = line.split(",", 4)
+            try:
+                quality = int(quality)
+            except ValueError:
+                pass
+            records.append((int(x), int(y), int(angle), quality, m_type))
+    return records
+
+
+@traced(category="codec")
+def write_minutiae_txt(path, records):
+    """Writes (x, y, angle, quality, type) records as `type,x,y,angle,quality` lines."""
+    with open(path, "w") as f:
+        for x, y, angle, quality, m_type in records:
+            f.write(f"{m_type},{x},{y},{angle},{quality}\n")
+
+
+def iso_records(t):
+    """Returns the (x, y, angle, quality, type) records of an ISO template in memory."""
+    return [
+        (
+            m.x,
+            m.y,
+            m.angle,
+            m.quality if m.quality != 0 else "not set",
+            iso_type_name(m.type),
+        )
+        for m in parse_iso19794(t)
+    ]
+
+
+def read_template(path):
+    """Reads a TXT or ISO template into (x, y, angle, quality, type) records."""
+    if path.lower().endswith(ISO_EXTENSIONS):
+        with open(path, "rb") as f:
+            return iso_records(f.read())
+    return read_minutiae_txt(path)
+
+
+def find_annotation(image_path):
+    """Returns the annotation file stored next to an image, or None."""
+    stem = os.path.splitext(image_path)[0]
+    for ext in ANNOTATION_EXTENSIONS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def count_minutiae(path):
+    """Counts the minutiae in an annotation file without parsing every record."""
+    if path.lower().endswith(ISO_EXTENSIONS):
+        with open(path, "rb") as f:
+            header = f.read(28)
+        return header[27] if len(header) == 28 else 0
+    with open(path, "r") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def annotation_summary(image_path):
+    """Returns (minutiae count, status) where status is "annotated", "empty" or "none"."""
+    path = find_annotation(image_path)
+    if path is None:
+        return 0, "none"
+    try:
+        count = count_minutiae(path)
+    except (OSError, ValueError):
+        return 0, "none"
+    return count, "annotated" if count else "empty"
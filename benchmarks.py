@@ -0,0 +1,351 @@
+"""Benchmarks of the rendering, hit-testing and codec hot paths.
+
+Synthetic ridge images and random templates of configurable size are
+generated in memory, every case is run `repeat` times after a warm-up run,
+and the median, minimum and maximum times are written to JSON. Given the
+JSON of an earlier run as baseline, cases slower than the baseline by more
+than the threshold are reported as regressions and the exit status is 1.
+
+Startup is measured in fresh processes: the import of the GUI module, and
+the time from the start of main.py to the first interactive frame, which
+must stay within STARTUP_BUDGET_MS. Cases that need Tk (the first frame, and
+zoom and redraw cycles on the real canvas) are skipped when no display is
+available. ISO 19794-2 stores the minutiae count in one byte, so the ISO
+cases use at most 255 minutiae.
+
+    python benchmarks.py --minutiae 10 1000 50000 --sizes 500 2000 8000 \\
+        --output results.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from annotations import read_minutiae_txt, write_minutiae_txt
+from jobs import load_image_job, save_overlay_job
+from markup import Markup
+from overlay import render_overlay
+
+RESULTS_VERSION = 1
+ISO_MAX_MINUTIAE = 255
+DEFAULT_MINUTIAE = (10, 1000, 50000)
+DEFAULT_SIZES = (500, 2000)
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25  # Relative slowdown against the baseline that fails
+MIN_SLOWDOWN_MS = 1.0  # Smaller absolute slowdowns are timer noise, not regressions
+STARTUP_BUDGET_MS = 1000  # Time from the start of main.py to the first frame
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_GUI = (
+    "import time; start = time.perf_counter(); import fingeprint; "
+    "print((time.perf_counter() - start) * 1000)"
+)
+TYPES = ("ending", "bifurcation", "other")
+
+
+def synthetic_image(size, period=9.0):
+    """Returns a size x size grayscale image of concentric ridges."""
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    radius = np.hypot(xx - size / 2, yy - size / 2)
+    ridges = 128 + 100 * np.sin(radius * np.float32(2 * math.pi / period))
+    return Image.fromarray(ridges.astype(np.uint8), "L")
+
+
+def synthetic_template(count, width, height, seed=0):
+    """Returns `count` random (x, y, angle, quality, type) records."""
+    rng = random.Random(seed)
+    return [
+        (
+            rng.randrange(width),
+            rng.randrange(height),
+            rng.randrange(360),
+            rng.randrange(101),
+            rng.choice(TYPES),
+        )
+        for _ in range(count)
+    ]
+
+
+class Job:
+    """Stands in for jobs.Job when a job function is timed directly."""
+
+    def report(self, progress, message=None):
+        pass
+
+    def check(self):
+        pass
+
+
+def codec_cases(counts, size, tmp_dir):
+    cases = {}
+    for count in counts:
+        records = synthetic_template(count, size, size)
+        iso_records = records[:ISO_MAX_MINUTIAE]
+        markup = Markup(size, size, iso_records)
+        data = markup.to_iso19794()
+        n = len(iso_records)
+        cases[f"iso_encode[n={n}]"] = lambda m=markup: m.to_iso19794()
+        cases[f"iso_parse[n={n}]"] = lambda d=data: Markup.from_iso19794(d)
+
+        txt_path = os.path.join(tmp_dir, f"template_{count}.txt")
+        write_minutiae_txt(txt_path, records)
+        cases[f"txt_write[n={count}]"] = lambda r=records, p=txt_path: (
+            write_minutiae_txt(p, r)
+        )
+        cases[f"txt_read[n={count}]"] = lambda p=txt_path: read_minutiae_txt(p)
+    return cases
+
+
+def hit_test_cases(counts, size):
+    # The method only needs the minutiae and the zoom level, not a window
+    try:
+        from fingeprint import FingerprintApp
+    except ImportError as e:
+        return {}, [f"hit_test: {e}"]
+    cases = {}
+    rng = random.Random(1)
+    for count in counts:
+        app = SimpleNamespace(
+            minutiae=[
+                record + (0, 0) for record in synthetic_template(count, size, size)
+            ],
+            zoom_level=1.0,
+        )
+        clicks = [(rng.uniform(0, size), rng.uniform(0, size)) for _ in range(10)]
+
+        def hit_test(app=app, clicks=clicks):
+            for x, y in clicks:
+                FingerprintApp.find_closest_minutiae(app, x, y)
+
+        cases[f"find_closest_minutiae[n={count},clicks=10]"] = hit_test
+    return cases, []
+
+
+def render_cases(counts, sizes, tmp_dir):
+    cases = {}
+    for size in sizes:
+        image = synthetic_image(size)
+        png_path = os.path.join(tmp_dir, f"image_{size}.png")
+        image.save(png_path)
+        cases[f"load_image[size={size}]"] = lambda p=png_path: load_image_job(Job(), p)
+        for count in counts:
+            records = synthetic_template(count, size, size)
+            cases[f"render_overlay[size={size},n={count}]"] = (
+                lambda i=image, r=records: render_overlay(i, r, supersample=2)
+            )
+        # save_image renders and writes the PNG through its job
+        out_path = os.path.join(tmp_dir, f"overlay_{size}.png")
+        records = synthetic_template(max(counts), size, size)
+        cases[f"save_image[size={size},n={max(counts)}]"] = (
+            lambda i=image, r=records, p=out_path: save_overlay_job(Job(), p, i, r)
+        )
+    return cases
+
+
+def tk_cases(counts, sizes):
+    """Zoom and redraw cycles on the real canvas. Returns (cases, skipped, close)."""
+    try:
+        import tkinter as tk
+
+        root = tk.Tk()
+    except Exception as e:  # No tkinter or no display
+        return {}, [f"tk: {e}".splitlines()[0]], lambda: None
+    root.withdraw()
+    from fingeprint import FingerprintApp
+
+    app = FingerprintApp(root, restore=False)
+    cases = {}
+    for size in sizes:
+        image = synthetic_image(size)
+        for count in counts:
+            prepared = []
+
+            def cycle(image=image, count=count, size=size, prepared=prepared):
+                # The image and minutiae are loaded by the untimed warm-up run
+                if not prepared:
+                    app.reset_minutiae()
+                    app.original_image = image
+                    app.image = image.copy()
+                    app.zoom_level = 1.0
+                    for record in synthetic_template(count, size, size):
+                        app.add_minutiae(*record)
+                    prepared.append(True)
+                for factor in (1.1, 1 / 1.1):
+                    app.zoom_level *= factor
+                    app.display_image()
+                    app.redraw_minutiae()
+                    root.update_idletasks()
+
+            cases[f"zoom_redraw[size={size},n={count}]"] = cycle
+    return cases, [], app.on_close
+
+
+def summarize(times):
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "max_ms": max(times),
+        "runs": len(times),
+    }
+
+
+def measure(fn, repeat):
+    fn()  # Warm-up: caches, lazy imports, first allocations
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return summarize(times)
+
+
+def startup_cases():
+    """{case: (command, budget in ms or None)}; each command prints its own time."""
+    return {
+        "import_gui": ([sys.executable, "-c", IMPORT_GUI], None),
+        "first_frame": (
+            [sys.executable, os.path.join(HERE, "main.py"), "--startup-time"],
+            STARTUP_BUDGET_MS,
+        ),
+    }
+
+
+def measure_startup(command, repeat, cache_dir):
+    """Runs command in fresh processes and returns the times they print.
+
+    The first run only warms the file system cache. A failing run, e.g. for
+    lack of a display, raises RuntimeError with its last line of error output.
+    """
+    # An empty cache folder: no thumbnails, hash index or session to restore
+    env = dict(os.environ, FINGERPRINT_CACHE_DIR=cache_dir)
+    times = []
+    for _ in range(repeat + 1):
+        done = subprocess.run(
+            command, cwd=HERE, env=env, capture_output=True, text=True
+        )
+        if done.returncode != 0:
+            lines = done.stderr.strip().splitlines() or ["failed"]
+            raise RuntimeError(lines[-1])
+        times.append(float(done.stdout.split()[-1]))
+    return summarize(times[1:])
+
+
+def print_result(case, r):
+    print(
+        f"{case:<48} {r['median_ms']:10.3f} ms  "
+        f"(min {r['min_ms']:.3f}, max {r['max_ms']:.3f})"
+    )
+
+
+def compare(results, baseline, threshold):
+    """Returns [(case, ratio)] of the cases slower than the baseline by > threshold.
+
+    Slowdowns below MIN_SLOWDOWN_MS are ignored, as tiny cases are noisy.
+    """
+    regressions = []
+    for case, result in results.items():
+        before = baseline.get(case)
+        if before and before["median_ms"] > 0:
+            ratio = result["median_ms"] / before["median_ms"]
+            slowdown = result["median_ms"] - before["median_ms"]
+            if ratio > 1 + threshold and slowdown > MIN_SLOWDOWN_MS:
+                regressions.append((case, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the application hot paths.")
+    parser.add_argument("--minutiae", type=int, nargs="+", default=DEFAULT_MINUTIAE)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--filter", help="Only run cases containing this text")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--no-tk", action="store_true", help="Skip the Tk cases")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = codec_cases(args.minutiae, max(args.sizes), tmp_dir)
+        hit_cases, skipped = hit_test_cases(args.minutiae, max(args.sizes))
+        cases.update(hit_cases)
+        cases.update(render_cases(args.minutiae, args.sizes, tmp_dir))
+        close = lambda: None  # noqa: E731
+        if args.no_tk:
+            skipped.append("tk: disabled")
+        else:
+            tk_only, tk_skipped, close = tk_cases(args.minutiae, args.sizes)
+            cases.update(tk_only)
+            skipped += tk_skipped
+
+        results = {}
+        try:
+            for case, fn in cases.items():
+                if args.filter and args.filter not in case:
+                    continue
+                results[case] = measure(fn, args.repeat)
+                print_result(case, results[case])
+        finally:
+            close()
+
+        for case, (command, budget) in startup_cases().items():
+            if args.filter and args.filter not in case:
+                continue
+            cache_dir = os.path.join(tmp_dir, "cache")
+            try:
+                results[case] = measure_startup(command, args.repeat, cache_dir)
+            except RuntimeError as e:
+                skipped.append(f"{case}: {e}")
+                continue
+            if budget is not None:
+                results[case]["budget_ms"] = budget
+            print_result(case, results[case])
+
+    for reason in skipped:
+        print(f"skipped {reason}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "version": RESULTS_VERSION,
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                    "skipped": skipped,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    failed = False
+    for case, r in results.items():
+        if r.get("budget_ms") is not None and r["median_ms"] > r["budget_ms"]:
+            print(f"OVER BUDGET {case}: {r['median_ms']:.0f} ms > {r['budget_ms']} ms")
+            failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for case, ratio in regressions:
+            print(f"REGRESSION {case}: {ratio:.2f}x the baseline")
+        if regressions:
+            failed = True
+        else:
+            print(f"No regressions beyond {args.threshold:.0%} of the baseline")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+
+# Root directory for everything the application caches on disk
+CACHE_DIR = os.environ.get(
+    "FINGERPRINT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "fingerprint-minutiae"),
+)
+
+
+def cache_path(*parts):
+    """Returns a path inside the cache directory, creating parent folders."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentHashIndex:
+    """Remembers the content hash of files so that unchanged files are not re-read.
+
+    Entries are keyed by absolute path and are reused as long as the file size
+    and mtime still match what was recorded. The index file is read on first
+    use, so creating the index costs nothing at startup.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path("hash_index.json")
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._entries = None
+
+    @property
+    def entries(self):
+        # Call with the lock held
+        if self._entries is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def cached(self, path):
+        """Returns (content hash, mtime_ns) if the file is unchanged since it was
+        last hashed, otherwise None. Never reads the file contents."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2], st.st_mtime_ns
+        return None
+
+    def record(self, path, size, mtime_ns, digest):
+        with self.lock:
+            self.entries[os.path.abspath(path)] = [size, mtime_ns, digest]
+            self.dirty = True
+
+    def lookup(self, path):
+        """Returns (content hash, mtime_ns) for a file, hashing it if needed."""
+        found = self.cached(path)
+        if found:
+            return found
+        st = os.stat(path)
+        digest = file_hash(path)
+        self.record(path, st.st_size, st.st_mtime_ns, digest)
+        return digest, st.st_mtime_ns
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+_default_index = None
+
+
+def content_hash_index():
+    """Returns the process-wide ContentHashIndex."""
+    global _default_index
+    if _default_index is None:
+        _default_index = ContentHashIndex()
+    return _default_index
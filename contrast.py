@@ -0,0 +1,58 @@
+"""Window/level style contrast adjustments expressed as 256-entry lookup tables.
+
+A lookup table costs the same no matter how the parameters are set, so the
+display can be re-mapped on every slider movement; only the pixels that are
+actually shown need to go through it. NumPy is only imported by the functions
+that build tables, so the GUI can read the defaults before NumPy has loaded.
+"""
+
+DEFAULT_BRIGHTNESS = 0  # Added to the level, -100 ... 100
+DEFAULT_CONTRAST = 1.0  # Slope around mid grey
+DEFAULT_GAMMA = 1.0
+
+
+def is_identity(brightness, contrast, gamma, equalize):
+    return (
+        brightness == DEFAULT_BRIGHTNESS
+        and contrast == DEFAULT_CONTRAST
+        and gamma == DEFAULT_GAMMA
+        and not equalize
+    )
+
+
+def equalize_table(histogram):
+    """Maps grey levels through the normalized cumulative histogram."""
+    import numpy as np
+
+    histogram = np.asarray(histogram, dtype=np.float64)
+    if histogram.size > 256:
+        # RGB histograms hold one 256-bin block per band
+        histogram = histogram.reshape(-1, 256).sum(axis=0)
+    cdf = histogram.cumsum()
+    first = cdf[np.flatnonzero(histogram)[0]] if cdf[-1] else 0.0
+    span = max(cdf[-1] - first, 1.0)
+    return np.clip((cdf - first) / span, 0.0, 1.0) * 255
+
+
+def build_lut(brightness, contrast, gamma, histogram=None):
+    """Returns the 256-entry table for the given settings as a list of ints.
+
+    Levels are equalized first when a histogram is given, then stretched by
+    contrast around mid grey, shifted by brightness and finally gamma
+    corrected.
+    """
+    import numpy as np
+
+    levels = np.arange(256, dtype=np.float64)
+    if histogram is not None:
+        levels = equalize_table(histogram)
+    levels = (levels - 127.5) * contrast + 127.5 + brightness * 2.55
+    levels = np.clip(levels / 255, 0.0, 1.0) ** (1.0 / gamma) * 255
+    return np.rint(levels).astype(np.uint8).tolist()
+
+
+def apply_lut(image, lut):
+    """Applies a table to every band of a PIL image."""
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    return image.point(lut * len(image.getbands()))
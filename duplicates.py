@@ -0,0 +1,123 @@
+"""Detection and merging of duplicate minutiae in a markup.
+
+Minutiae are hashed into grid cells as wide as the distance tolerance, so
+every point only has to be compared with the points of its own and the
+eight surrounding cells. Points within both the distance and the angle
+tolerance are joined with a union-find, which gives groups of stacked
+duplicates in near-linear time. Run as a script it checks every markup of
+a dataset folder and lists those with duplicates.
+"""
+
+import argparse
+import math
+import os
+
+from annotations import find_annotation, read_template
+from thumbnails import scan_folder
+
+DUPLICATE_DISTANCE = 4.0  # Pixels between minutiae counting as one point
+DUPLICATE_ANGLE = 20.0  # Degrees between their angles
+
+
+def _angle_difference(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+def find_duplicates(records, distance=DUPLICATE_DISTANCE, angle=DUPLICATE_ANGLE):
+    """Returns groups of indices of duplicate (x, y, angle, ...) records.
+
+    Each group has at least two members, listed in their original order.
+    Duplicates are transitive: a chain of close points forms one group.
+    """
+    cell = max(distance, 1e-6)
+    grid = {}
+    for i, record in enumerate(records):
+        key = (math.floor(record[0] / cell), math.floor(record[1] / cell))
+        grid.setdefault(key, []).append(i)
+
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for (cx, cy), members in grid.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in grid.get((cx + dx, cy + dy), ()):
+                    for i in members:
+                        # Every pair is seen from both cells; test it once
+                        if j <= i:
+                            continue
+                        a, b = records[i], records[j]
+                        if (
+                            math.hypot(a[0] - b[0], a[1] - b[1]) <= distance
+                            and _angle_difference(a[2], b[2]) <= angle
+                        ):
+                            parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(records)):
+        groups.setdefault(find(i), []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def merge_group(records, group):
+    """Returns one (x, y, angle, quality, type) record replacing a group.
+
+    Position and angle are averaged; quality and type are kept from the
+    first member, the one marked or loaded first.
+    """
+    members = [records[i] for i in group]
+    x = round(sum(r[0] for r in members) / len(members))
+    y = round(sum(r[1] for r in members) / len(members))
+    angle = math.degrees(
+        math.atan2(
+            sum(math.sin(math.radians(r[2])) for r in members),
+            sum(math.cos(math.radians(r[2])) for r in members),
+        )
+    )
+    first = members[0]
+    return (x, y, round(angle) % 360, first[3], first[4])
+
+
+def merge_duplicates(records, groups):
+    """Returns the records with every group replaced by its merged record.
+
+    The merged record takes the place of the first member of its group.
+    """
+    merged = {group[0]: merge_group(records, group) for group in groups}
+    dropped = {i for group in groups for i in group[1:]}
+    return [
+        merged.get(i, tuple(record[:5]))
+        for i, record in enumerate(records)
+        if i not in dropped
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List the markups of a dataset that contain duplicate minutiae."
+    )
+    parser.add_argument("folder", help="Folder with images and their markups")
+    parser.add_argument("--distance", type=float, default=DUPLICATE_DISTANCE)
+    parser.add_argument("--angle", type=float, default=DUPLICATE_ANGLE)
+    args = parser.parse_args()
+
+    affected = 0
+    for image_path in scan_folder(args.folder):
+        path = find_annotation(image_path)
+        if path is None:
+            continue
+        groups = find_duplicates(read_template(path), args.distance, args.angle)
+        if groups:
+            affected += 1
+            extra = sum(len(group) - 1 for group in groups)
+            print(f"{os.path.basename(path)}: {len(groups)} groups, {extra} extra")
+    print(f"{affected} markup(s) with duplicates")
+
+
+if __name__ == "__main__":
+    main()
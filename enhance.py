@@ -0,0 +1,261 @@
+"""Ridge enhancement for low-contrast fingerprint captures.
+
+The pipeline follows the usual contextual filtering approach: local
+normalization, a block orientation field from smoothed gradient moments, a
+block ridge frequency from windowed spectra, and even-symmetric Gabor filters
+tuned to both. Filtering happens in the frequency domain with one filter per
+(orientation, wavelength) bin present in the image, so the cost is a handful
+of FFTs rather than a convolution per pixel.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from images import open_image
+from cache import cache_path, content_hash_index, file_hash
+
+ENHANCE_VERSION = 1  # Bump when the output changes to invalidate cached results
+
+BLOCK_SIZE = 16  # Orientation and frequency are estimated per block
+NORMALIZE_RADIUS = 16  # Half width of the local normalization window
+# Blocks whose deviation is below this fraction of the global one are background
+MASK_THRESHOLD = 0.2
+
+FREQUENCY_WINDOW = 32  # Spectrum window centred on each block
+FREQUENCY_FFT_SIZE = 64  # Zero padded so that the peak is located more finely
+FREQUENCY_CHUNK = 4096  # Windows transformed at once, bounds the memory use
+MIN_WAVELENGTH = 4.0
+MAX_WAVELENGTH = 16.0
+
+ANGLE_BINS = 16  # Gabor orientations over 180 degrees
+WAVELENGTH_BINS = (5.0, 7.0, 9.0, 11.0, 13.0, 15.0)
+GABOR_SIGMA = 0.65  # Gaussian envelope in units of the ridge wavelength
+
+
+def _box_mean(a, radius):
+    """Mean over a (2 * radius + 1) square window using an integral image."""
+    size = 2 * radius + 1
+    padded = np.pad(a, radius + 1, mode="reflect")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    total = (
+        integral[size:, size:]
+        - integral[:-size, size:]
+        - integral[size:, :-size]
+        + integral[:-size, :-size]
+    )
+    return total[: a.shape[0], : a.shape[1]] / (size * size)
+
+
+def _block_sum(a, block=BLOCK_SIZE):
+    h, w = a.shape
+    return a.reshape(h // block, block, w // block, block).sum(axis=(1, 3))
+
+
+def _smooth3(a):
+    """Sums every block with its 8 neighbours."""
+    padded = np.pad(a, 1, mode="edge")
+    h, w = a.shape
+    return sum(padded[dy : dy + h, dx : dx + w] for dy in range(3) for dx in range(3))
+
+
+def to_pixels(a, block=BLOCK_SIZE):
+    """Expands a per-block array to one value per pixel."""
+    return np.repeat(np.repeat(a, block, axis=0), block, axis=1)
+
+
+def pad_to_blocks(gray, block=BLOCK_SIZE):
+    """Pads a 2-D array on the bottom and right to a whole number of blocks."""
+    h, w = gray.shape
+    return np.pad(gray, ((0, -h % block), (0, -w % block)), mode="edge")
+
+
+def normalize(gray):
+    """Local zero-mean, unit-variance normalization of a 2-D float array."""
+    mean = _box_mean(gray, NORMALIZE_RADIUS)
+    variance = _box_mean(gray * gray, NORMALIZE_RADIUS) - mean * mean
+    std = np.sqrt(np.maximum(variance, 0.0))
+    return (gray - mean) / np.maximum(std, max(std.mean(), 1e-6) * 0.1)
+
+
+def foreground_mask(gray, block=BLOCK_SIZE):
+    """Per-block mask of the fingerprint area, by local grey-level deviation."""
+    n = block * block
+    mean = _block_sum(gray, block) / n
+    variance = _block_sum(gray * gray, block) / n - mean * mean
+    std = np.sqrt(np.maximum(variance, 0.0))
+    return std > MASK_THRESHOLD * max(gray.std(), 1e-6)
+
+
+def orientation_field(norm, block=BLOCK_SIZE):
+    """Returns per-block (ridge normal angle in radians, coherence).
+
+    The angle is the dominant gradient direction measured from the x axis
+    towards +y in image coordinates (y down), in [-pi/2, pi/2). Ridges run
+    perpendicular to it. Coherence is 0 for isotropic and 1 for perfectly
+    parallel gradients.
+    """
+    gy, gx = np.gradient(norm)
+    gxx = _smooth3(_block_sum(gx * gx, block))
+    gyy = _smooth3(_block_sum(gy * gy, block))
+    gxy = _smooth3(_block_sum(gx * gy, block))
+    # Doubled-angle averaging keeps opposite gradients from cancelling out
+    angle = 0.5 * np.arctan2(2 * gxy, gxx - gyy)
+    coherence = np.hypot(gxx - gyy, 2 * gxy) / np.maximum(gxx + gyy, 1e-12)
+    return angle, coherence
+
+
+def spectral_peaks(norm, block=BLOCK_SIZE):
+    """Returns per-block (peak frequency, peak to mean power ratio).
+
+    The peak is the strongest one of the windowed spectrum around the block
+    inside the plausible wavelength band; the ratio tells how clearly it
+    stands out.
+    """
+    shape = (norm.shape[0] // block, norm.shape[1] // block)
+    margin = (FREQUENCY_WINDOW - block) // 2
+    padded = np.pad(norm, margin, mode="reflect")
+    windows = sliding_window_view(padded, (FREQUENCY_WINDOW, FREQUENCY_WINDOW))
+    windows = windows[::block, ::block][: shape[0], : shape[1]]
+
+    hann = np.hanning(FREQUENCY_WINDOW)
+    taper = np.outer(hann, hann)
+    fy = np.fft.fftfreq(FREQUENCY_FFT_SIZE)[:, None]
+    fx = np.fft.rfftfreq(FREQUENCY_FFT_SIZE)[None, :]
+    radius = np.hypot(fx, fy)
+    band = (radius >= 1 / MAX_WAVELENGTH) & (radius <= 1 / MIN_WAVELENGTH)
+
+    peak = np.zeros(shape, dtype=np.int64)
+    ratio = np.zeros(shape)
+    rows = max(FREQUENCY_CHUNK // max(shape[1], 1), 1)
+    for top in range(0, shape[0], rows):
+        chunk = slice(top, top + rows)
+        spectrum = np.abs(
+            np.fft.rfft2(windows[chunk] * taper, s=(FREQUENCY_FFT_SIZE,) * 2)
+        )
+        power = np.where(band, spectrum, 0.0).reshape(spectrum.shape[:2] + (-1,))
+        peak[chunk] = power.argmax(axis=-1)
+        strength = np.take_along_axis(power, peak[chunk][..., None], axis=-1)[..., 0]
+        ratio[chunk] = strength / np.maximum(power.mean(axis=-1), 1e-12)
+    return radius.ravel()[peak], ratio
+
+
+def ridge_frequency(norm, mask, block=BLOCK_SIZE):
+    """Returns the per-block ridge frequency in cycles per pixel.
+
+    Each block's frequency is that of its spectral peak. Background blocks
+    and blocks without a clear peak get the median.
+    """
+    frequency, ratio = spectral_peaks(norm, block)
+    valid = mask & (ratio > 2)
+
+    fallback = np.median(frequency[valid]) if valid.any() else 1 / 9.0
+    return np.where(valid, frequency, fallback)
+
+
+def gabor_filter(norm, angle, frequency, mask, block=BLOCK_SIZE):
+    """Filters each block with the Gabor filter of its orientation and wavelength."""
+    h, w = norm.shape
+    angle_bin = np.round((angle % np.pi) / np.pi * ANGLE_BINS).astype(int) % ANGLE_BINS
+    wavelengths = np.array(WAVELENGTH_BINS)
+    wavelength_bin = np.abs(1 / frequency[..., None] - wavelengths).argmin(axis=-1)
+    filter_bin = np.where(mask, angle_bin * len(wavelengths) + wavelength_bin, -1)
+    pixel_bin = to_pixels(filter_bin, block)
+
+    spectrum = np.fft.rfft2(norm)
+    fy = np.fft.fftfreq(h)[:, None]
+    fx = np.fft.rfftfreq(w)[None, :]
+    result = np.zeros_like(norm)
+    for index in np.unique(filter_bin[filter_bin >= 0]):
+        theta = (index // len(wavelengths)) * np.pi / ANGLE_BINS
+        wavelength = wavelengths[index % len(wavelengths)]
+        # Spectrum of an even-symmetric Gabor filter: two Gaussians at +/- f
+        f = 1 / wavelength
+        s2 = 2 * (1 / (2 * np.pi * GABOR_SIGMA * wavelength)) ** 2
+        u = fx * np.cos(theta) + fy * np.sin(theta)
+        v = fy * np.cos(theta) - fx * np.sin(theta)
+        response = np.exp(-((u - f) ** 2 + v * v) / s2) + np.exp(
+            -((u + f) ** 2 + v * v) / s2
+        )
+        filtered = np.fft.irfft2(spectrum * response, s=(h, w))
+        selected = pixel_bin == index
+        result[selected] = filtered[selected]
+    return result
+
+
+def filter_ridges(gray):
+    """Returns (Gabor response, foreground block mask) of a block-padded array.
+
+    Ridges are negative in the response, valleys positive.
+    """
+    norm = normalize(gray)
+    mask = foreground_mask(gray)
+    angle, _ = orientation_field(norm)
+    frequency = ridge_frequency(norm, mask)
+    return gabor_filter(norm, angle, frequency, mask), mask
+
+
+def enhance(image):
+    """Returns an enhanced greyscale copy of a PIL image (dark ridges on white)."""
+    gray = np.asarray(image.convert("L"), dtype=np.float64)
+    h, w = gray.shape
+    filtered, mask = filter_ridges(pad_to_blocks(gray))
+
+    foreground = to_pixels(mask)
+    spread = filtered[foreground].std() if mask.any() else 1.0
+    out = np.clip(127.5 + 64 * filtered / max(spread, 1e-6), 0, 255)
+    out[~foreground] = 255
+    return Image.fromarray(out[:h, :w].astype(np.uint8), "L")
+
+
+# --- Disk cache ---
+
+
+def enhanced_path(digest):
+    return cache_path("enhanced", digest[:2], f"{digest}_v{ENHANCE_VERSION}.png")
+
+
+def enhance_file(src):
+    """Enhances an image file unless the result is already cached.
+
+    Runs inside a worker process. Returns (src, file size, mtime_ns, hash,
+    enhanced image path) like thumbnails.build_thumbnail.
+    """
+    st = os.stat(src)
+    digest = file_hash(src)
+    dest = enhanced_path(digest)
+    if not os.path.exists(dest):
+        with open_image(src) as image:
+            enhanced = enhance(image)
+        tmp_path = f"{dest}.{os.getpid()}.tmp.png"
+        enhanced.save(tmp_path)
+        os.replace(tmp_path, dest)
+    return src, st.st_size, st.st_mtime_ns, digest, dest
+
+
+class EnhancementCache:
+    """Enhanced images on disk, keyed by the content hash of the source file."""
+
+    def __init__(self):
+        self.hash_index = content_hash_index()
+
+    def lookup(self, image_path):
+        """Returns the cached enhanced image path, or None. Never reads the image."""
+        try:
+            found = self.hash_index.cached(image_path)
+        except OSError:
+            return None
+        if found and os.path.exists(enhanced_path(found[0])):
+            return enhanced_path(found[0])
+        return None
+
+    def generate(self, image_path, executor):
+        return executor.submit(enhance_file, image_path)
+
+    def finished(self, result):
+        """Records an enhance_file result and returns the enhanced image path."""
+        src, size, mtime_ns, digest, dest = result
+        self.hash_index.record(src, size, mtime_ns, digest)
+        return dest
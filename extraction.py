@@ -0,0 +1,311 @@
+"""Automatic minutiae extraction used to suggest candidates to the annotator.
+
+The ridge map comes from the Gabor response of enhance.filter_ridges. It is
+thinned to a one pixel skeleton with a vectorized Zhang-Suen pass, and
+endings and bifurcations are found with the crossing number. Candidates near
+the edge of the fingerprint area and short spurs are dropped before the
+angle of each remaining candidate is traced along the skeleton.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+
+from cache import cache_path, content_hash_index, file_hash
+from enhance import BLOCK_SIZE, filter_ridges, pad_to_blocks, to_pixels
+from images import open_image
+
+EXTRACT_VERSION = 3  # Bump when the output changes to invalidate cached results
+
+BORDER_BLOCKS = 1  # Blocks next to the background that cannot hold minutiae
+SPUR_LENGTH = 10  # Endings joined to a bifurcation or ending within this are noise
+ANGLE_LENGTH = 8  # Skeleton pixels followed to measure the direction
+STREAM_BATCH = 25  # Candidates per partial result sent to the caller
+
+# Neighbour offsets (dy, dx) in clockwise order starting north: P2 ... P9
+NEIGHBOURS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+def _neighbour_planes(img):
+    """Returns the eight neighbour planes of the interior of a 1-padded array."""
+    h, w = img.shape
+    return [img[1 + dy : h - 1 + dy, 1 + dx : w - 1 + dx] for dy, dx in NEIGHBOURS]
+
+
+def thin(binary):
+    """Zhang-Suen thinning of a boolean array to a one pixel wide skeleton."""
+    img = np.pad(binary, 1).astype(np.uint8)
+    while True:
+        changed = False
+        for step in (0, 1):
+            p2, p3, p4, p5, p6, p7, p8, p9 = planes = _neighbour_planes(img)
+            count = sum(planes)
+            # Number of 0 -> 1 transitions around the pixel
+            ring = planes + [p2]
+            transitions = sum(
+                (ring[i] == 0) & (ring[i + 1] == 1) for i in range(len(planes))
+            )
+            if step == 0:
+                side = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                side = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (
+                (img[1:-1, 1:-1] == 1)
+                & (count >= 2)
+                & (count <= 6)
+                & (transitions == 1)
+                & side
+            )
+            if remove.any():
+                img[1:-1, 1:-1][remove] = 0
+                changed = True
+        if not changed:
+            return img[1:-1, 1:-1].astype(bool)
+
+
+def crossing_number(skeleton):
+    """Half the number of 0/1 changes around each skeleton pixel, 0 elsewhere.
+
+    1 marks a ridge ending and 3 a bifurcation.
+    """
+    planes = _neighbour_planes(np.pad(skeleton, 1).astype(np.int8))
+    ring = planes + [planes[0]]
+    cn = sum(np.abs(ring[i] - ring[i + 1]) for i in range(len(planes))) // 2
+    return np.where(skeleton, cn, 0)
+
+
+def _erode(mask, steps):
+    """Shrinks a block mask, treating everything outside the image as background."""
+    for _ in range(steps):
+        padded = np.pad(mask, 1)
+        h, w = mask.shape
+        mask = np.logical_and.reduce(
+            [padded[dy : dy + h, dx : dx + w] for dy in range(3) for dx in range(3)]
+        )
+    return mask
+
+
+def _trace(skeleton, cn, y, x, length, visited):
+    """Follows the skeleton from (y, x) for up to `length` pixels.
+
+    Stops early at another minutia. Returns (last y, last x, steps taken,
+    crossing number where it stopped or 0).
+    """
+    h, w = skeleton.shape
+    steps = 0
+    while steps < length:
+        step = None
+        for dy, dx in NEIGHBOURS:
+            ny, nx = y + dy, x + dx
+            if 0 <= ny < h and 0 <= nx < w and skeleton[ny, nx]:
+                if (ny, nx) not in visited:
+                    step = ny, nx
+                    # Prefer 4-connected moves so diagonal corners are not skipped
+                    if dy == 0 or dx == 0:
+                        break
+        if step is None:
+            return y, x, steps, 0
+        y, x = step
+        visited.add(step)
+        steps += 1
+        if cn[y, x] in (1, 3):
+            return y, x, steps, cn[y, x]
+    return y, x, steps, 0
+
+
+def _direction(y0, x0, y1, x1):
+    """Angle in degrees from (y0, x0) towards (y1, x1) with the y axis pointing up."""
+    return math.degrees(math.atan2(y0 - y1, x1 - x0)) % 360
+
+
+def _angle_difference(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+def _ending(skeleton, cn, y, x):
+    """Returns (angle, partner) for an ending; partner is set for spurs and
+    short ridges, which should be dropped together with the ending."""
+    ty, tx, steps, stop = _trace(skeleton, cn, y, x, SPUR_LENGTH, {(y, x)})
+    if stop or steps < SPUR_LENGTH:
+        return None, (ty, tx) if stop else None
+    # The angle points from the ending into its ridge
+    ty, tx, _, _ = _trace(skeleton, cn, y, x, ANGLE_LENGTH, {(y, x)})
+    return round(_direction(y, x, ty, tx)) % 360, None
+
+
+def _bifurcation(skeleton, cn, y, x):
+    """Returns the angle of a bifurcation: the bisector of its two closest branches."""
+    h, w = skeleton.shape
+    ring = [
+        0 <= y + dy < h and 0 <= x + dx < w and bool(skeleton[y + dy, x + dx])
+        for dy, dx in NEIGHBOURS
+    ]
+    visited = {(y, x)} | {
+        (y + dy, x + dx) for (dy, dx), on in zip(NEIGHBOURS, ring) if on
+    }
+
+    # Neighbours that touch each other around the ring belong to one branch
+    starts = []
+    for i in range(len(NEIGHBOURS)):
+        if ring[i] and not ring[i - 1]:
+            run = []
+            while ring[(i + len(run)) % len(NEIGHBOURS)] and len(run) < len(ring):
+                run.append(NEIGHBOURS[(i + len(run)) % len(NEIGHBOURS)])
+            dy, dx = min(run, key=lambda offset: abs(offset[0]) + abs(offset[1]))
+            starts.append((y + dy, x + dx))
+    directions = []
+    for sy, sx in starts:
+        ty, tx, _, _ = _trace(skeleton, cn, sy, sx, ANGLE_LENGTH - 1, visited)
+        directions.append(_direction(y, x, ty, tx))
+    if len(directions) < 2:
+        return None
+    pairs = [
+        (_angle_difference(a, b), a, b)
+        for i, a in enumerate(directions)
+        for b in directions[i + 1 :]
+    ]
+    _, a, b = min(pairs)
+    bisector = math.atan2(
+        math.sin(math.radians(a)) + math.sin(math.radians(b)),
+        math.cos(math.radians(a)) + math.cos(math.radians(b)),
+    )
+    return round(math.degrees(bisector)) % 360
+
+
+def ridge_map(gray):
+    """Returns (binarized ridges, block mask) of a 2-D float array.
+
+    The ridge map is cropped to the array; the mask covers whole blocks.
+    """
+    h, w = gray.shape
+    filtered, mask = filter_ridges(pad_to_blocks(gray))
+    return ((filtered < 0) & to_pixels(mask))[:h, :w], mask
+
+
+def ridge_skeleton(gray):
+    """Returns (skeleton, block mask) of a 2-D float array."""
+    ridges, mask = ridge_map(gray)
+    return thin(ridges), mask
+
+
+def extract(image, emit=None):
+    """Extracts candidate minutiae from a PIL image.
+
+    Returns (x, y, angle, quality, type) records with quality "not set".
+    If `emit` is given it is called with each batch of records as soon as it
+    is ready, so callers can show results while the rest is still traced.
+    """
+    gray = np.asarray(image.convert("L"), dtype=np.float64)
+    h, w = gray.shape
+    skeleton, mask = ridge_skeleton(gray)
+    cn = crossing_number(skeleton)
+
+    # Ridges are cut off at the edge of the fingerprint area, so minutiae
+    # found next to the background are artefacts
+    inner = to_pixels(_erode(mask, BORDER_BLOCKS))[:h, :w]
+    # The block grid is padded past the bottom and right edges; keep the same
+    # margin from the real edges there as on the top and left
+    margin = BORDER_BLOCKS * BLOCK_SIZE
+    inner[max(h - margin, 0) :, :] = False
+    inner[:, max(w - margin, 0) :] = False
+    ending_ys, ending_xs = np.nonzero((cn == 1) & inner)
+    bifurcation_ys, bifurcation_xs = np.nonzero((cn == 3) & inner)
+
+    records, batch, dropped = [], [], set()
+
+    def add(record):
+        records.append(record)
+        batch.append(record)
+        if emit is not None and len(batch) >= STREAM_BATCH:
+            emit(list(batch))
+            batch.clear()
+
+    # Endings first: spurs found here also remove the bifurcation they hang off
+    for y, x in zip(ending_ys.tolist(), ending_xs.tolist()):
+        if (y, x) in dropped:
+            continue
+        angle, partner = _ending(skeleton, cn, y, x)
+        if angle is None:
+            if partner is not None:
+                dropped.add(partner)
+            continue
+        add((x, y, angle, "not set", "ending"))
+
+    for y, x in zip(bifurcation_ys.tolist(), bifurcation_xs.tolist()):
+        if (y, x) in dropped:
+            continue
+        angle = _bifurcation(skeleton, cn, y, x)
+        if angle is not None:
+            add((x, y, angle, "not set", "bifurcation"))
+
+    if emit is not None and batch:
+        emit(list(batch))
+    return records
+
+
+# --- Disk cache ---
+
+
+def suggestions_path(digest):
+    return cache_path("suggestions", digest[:2], f"{digest}_v{EXTRACT_VERSION}.json")
+
+
+def read_suggestions(path):
+    with open(path, "r") as f:
+        return [tuple(record) for record in json.load(f)]
+
+
+def extract_file(src, queue=None):
+    """Extracts candidates from an image file unless they are already cached.
+
+    Runs inside a worker process. Partial results are put on `queue` as
+    (src, records) while extraction runs. Returns (src, file size, mtime_ns,
+    hash, cache path, records).
+    """
+    st = os.stat(src)
+    digest = file_hash(src)
+    dest = suggestions_path(digest)
+    if os.path.exists(dest):
+        records = read_suggestions(dest)
+        if queue is not None:
+            queue.put((src, records))
+    else:
+
+        def emit(batch):
+            queue.put((src, batch))
+
+        with open_image(src) as image:
+            records = extract(image, emit if queue is not None else None)
+        tmp_path = f"{dest}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(records, f)
+        os.replace(tmp_path, dest)
+    return src, st.st_size, st.st_mtime_ns, digest, dest, records
+
+
+class SuggestionCache:
+    """Extracted candidates on disk, keyed by the content hash of the image."""
+
+    def __init__(self):
+        self.hash_index = content_hash_index()
+
+    def lookup(self, image_path):
+        """Returns the cached candidates of an image, or None. Never reads the image."""
+        try:
+            found = self.hash_index.cached(image_path)
+        except OSError:
+            return None
+        if found and os.path.exists(suggestions_path(found[0])):
+            return read_suggestions(suggestions_path(found[0]))
+        return None
+
+    def generate(self, image_path, executor, queue=None):
+        return executor.submit(extract_file, image_path, queue)
+
+    def finished(self, result):
+        """Records an extract_file result and returns its candidates."""
+        src, size, mtime_ns, digest, dest, records = result
+        self.hash_index.record(src, size, mtime_ns, digest)
+        return records
@@ -1,27 +1,76 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image
+from functools import cached_property
+import json
 import math
+import multiprocessing
 import os
+import queue
+
+# Only modules that do not import NumPy are imported here. Image processing,
+# jobs, codecs, overlays and the database are imported by the methods that
+# first need them, so the window shows before NumPy has loaded
+from annotations import CORE, DELTA, annotation_summary, read_template
+from cache import cache_path
+from duplicates import find_duplicates, merge_duplicates
+from contrast import (
+    DEFAULT_BRIGHTNESS,
+    DEFAULT_CONTRAST,
+    DEFAULT_GAMMA,
+    apply_lut,
+    build_lut,
+    is_identity,
+)
+from thumbnails import THUMBNAIL_SIZE, ThumbnailCache, scan_folder
+import tracing
+from tracing import traced
 
-# Define colors for minutiae types
-ENDING_COLOR = "red"
-BIFURCATION_COLOR = "green"
-OTHER_COLOR = "blue"
 ACTIVE_COLOR = "yellow"  # Color for highlighting the active minutiae
-
-
-class Minutiae:
-    def __init__(self, type, x, y, angle, quality):
-        self.type = type
-        self.x = x
-        self.y = y
-        self.angle = angle
-        self.quality = quality
+SUGGESTION_DISTANCE = 6  # Suggestions this close to a marked minutia are not shown
+
+# Colors for minutiae of a compared template, drawn aligned onto the image
+MATCHED_COLOR = "cyan"
+UNMATCHED_COLOR = "magenta"
+MISSING_COLOR = "orange"  # Own minutiae without a partner in a diffed markup
+DUPLICATE_COLOR = "red"  # Rings around stacked duplicate minutiae
+
+# Colors for the core and delta markers
+CORE_COLOR = "purple"
+DELTA_COLOR = "brown"
+GALLERY_RESULTS = 10  # Templates listed by a gallery search
+
+# Latency HUD drawn over the canvas while tracing
+HUD_COLOR = "yellow"
+HUD_INTERVAL = 250  # Milliseconds between HUD updates
+HUD_SPANS = ("display_image", "draw_viewport", "redraw_minutiae", "hit_test")
+
+# (widget, sequence, handler) of the bindings logged while recording events
+RECORDED_BINDINGS = (
+    ("canvas", "<Control-MouseWheel>", "zoom"),
+    ("canvas", "<Button-1>", "on_canvas_click"),
+    ("canvas", "<B1-Motion>", "on_canvas_drag"),
+    ("canvas", "<B3-Motion>", "on_canvas_drag_angle"),
+    ("canvas", "<ButtonRelease-1>", "on_canvas_release"),
+    ("canvas", "<Shift-Button-1>", "on_shift_click"),
+    ("canvas", "<Shift-B1-Motion>", "on_shift_drag"),
+    ("canvas", "<Shift-ButtonRelease-1>", "on_shift_release_drag"),
+    ("master", "<Control-equal>", "zoom_in"),
+    ("master", "<Control-minus>", "zoom_out"),
+    ("master", "<Shift_L>", "on_shift_press"),
+    ("master", "<KeyRelease-Shift_L>", "on_shift_release"),
+)
+
+SESSION_FILE = "session.json"  # Last image, zoom and scroll, in the cache folder
+
+# Colors for the annotation status of dataset thumbnails
+ANNOTATED_COLOR = "green"
+EMPTY_ANNOTATION_COLOR = "orange"
+NOT_ANNOTATED_COLOR = "gray"
 
 
 class FingerprintApp:
-    def __init__(self, master):
+    def __init__(self, master, restore=True):
         self.master = master
         master.title("Fingerprint Minutiae Marking v1.3.0")
 
@@ -44,12 +93,72 @@ class FingerprintApp:
         )  # List to store IDs of active minutiae circles
         self.editor_mode = False
         self.dragged_minutiae_index = None
+        self.dragged_singular_index = None
         self.active_minutiae_index = None
         self.image_name = None  # Variable to store image file name
         self.alt_pressed = False  # Variable to track Alt key state
         self.shift_pressed = False  # Variable to track Shift key state
         self.selection_rect = None  # Variable to store the selection rectangle
         self.selection_start = None  # Variable to store the start point of selection
+        self.recorder = None  # EventRecorder while canvas events are recorded
+
+        # Dataset navigation and thumbnail strip
+        self.dataset_paths = []  # Sorted image paths of the open folder
+        self.dataset_index = None  # Index of the open image in dataset_paths
+        self.thumbnail_cache = ThumbnailCache()
+        self.thumbnail_files = {}  # Image path -> cached thumbnail file
+        self.thumbnail_summaries = {}  # Image path -> (minutiae count, status)
+        self.thumbnail_photos = {}  # Dataset index -> PhotoImage of visible thumbnails
+        self.thumbnail_cell_width = THUMBNAIL_SIZE[0] + 10
+        self.thumbnail_redraw_pending = False
+
+        # Background work
+        self.executor = None  # Process pool, created on first use
+        self.pending_futures = []  # (future, callback) pairs polled from the mainloop
+        self.polling_futures = False
+        self.jobs = None  # File loading and saving, shown in the info bar; see get_jobs
+        self.open_job = None  # Job loading the image to open
+        self.store = None  # Optional annotation database, saved to and loaded from
+
+        # Session restored at startup: the stored session and the pending view
+        self.last_session = {}
+        self.restored_view = None  # (image path, zoom, x view, y view)
+
+        # Ridge enhancement of the open image, computed in the background.
+        # This and the caches below are created on first use
+        self.enhanced_image = None
+        self.enhancement_pending = set()  # Image paths with a running worker
+
+        # Orientation field and skeleton of the open image, for automatic angles
+        self.ridge_structure = None
+        self.structure_pending = set()  # Image paths with a running worker
+        # (x, y, CORE or DELTA); None until detected or loaded, then editable
+        self.singular_points = None
+
+        # Block quality map of the open image, for the heatmap and new minutiae
+        self.quality_map = None  # (quality, mask) per block
+        self.quality_pending = set()  # Image paths with a running worker
+        self.heatmap_image = None  # One RGBA pixel per block
+        self.heatmap_photo = None
+        self.heatmap_image_id = None
+
+        # Automatic minutiae suggestions, streamed back from a worker process
+        self.suggestions = []  # (x, y, angle, quality, type, oval id, line id)
+        self.suggestion_manager = None  # Owns the queue the worker streams into
+        self.suggestion_queue = None
+        self.suggestion_job = None  # Image path of the running extraction
+
+        # Template comparison, in image coordinates of the open image
+        self.comparison_marks = []  # (x, y, color) of the compared template
+        self.comparison_links = []  # (x, y, other x, other y) of paired minutiae
+        self.duplicate_marks = []  # (x, y) of minutiae found stacked on others
+
+        # Contrast lookup table, applied only to the visible part of the canvas
+        self.contrast_histogram = None  # (source image, histogram) for equalize
+        self.viewport_photo = None
+        self.viewport_image_id = None
+        self.viewport_redraw_pending = False
+        self.hud_update = None  # after() id of the next HUD update
 
         # Create a frame for image size and minutiae count labels
         self.info_frame = tk.Frame(master)
@@ -62,6 +171,13 @@ class FingerprintApp:
         self.minutiae_count_label = tk.Label(self.info_frame, text="")
         self.minutiae_count_label.pack(side=tk.LEFT, padx=5)
 
+        # Progress of background jobs, with a button shown while any run
+        self.job_label = tk.Label(self.info_frame, text="")
+        self.job_label.pack(side=tk.LEFT, padx=5)
+        self.cancel_jobs_button = tk.Button(
+            self.info_frame, text="Cancel", command=self.cancel_jobs
+        )
+
         # Create GUI elements
         self.create_widgets()
 
@@ -86,7 +202,29 @@ class FingerprintApp:
 
         self.master.bind("e", self.cycle_minutiae_type)
 
+        # Accept or reject the suggestion under the mouse pointer
+        self.master.bind("a", self.accept_suggestion)
+        self.master.bind("x", self.reject_suggestion)
+
+        # Add a core or delta at the mouse pointer, or remove the one under it
+        self.master.bind("c", self.toggle_core)
+        self.master.bind("v", self.toggle_delta)
+
+        # Bind Page Up / Page Down for dataset navigation
+        self.master.bind("<Prior>", self.previous_image)
+        self.master.bind("<Next>", self.next_image)
+
+        master.protocol("WM_DELETE_WINDOW", lambda: self.on_close(save_session=True))
+
+        # Read the last session now, reopen its image once the window is up
+        self.load_last_session()
+        if restore:
+            self.master.after_idle(self.restore_last_session)
+
     def create_widgets(self):
+        # Thumbnail strip for the open folder (packed first so it keeps its height)
+        self.create_thumbnail_strip()
+
         # PanedWindow for resizable divider
         self.paned_window = ttk.Panedwindow(self.master, orient=tk.HORIZONTAL)
         self.paned_window.pack(fill=tk.BOTH, expand=1)
@@ -107,10 +245,10 @@ class FingerprintApp:
         # Create scrollbars
         self.hbar = tk.Scrollbar(self.image_frame, orient=tk.HORIZONTAL)
         self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
-        self.hbar.config(command=self.canvas.xview)
+        self.hbar.config(command=self.scroll_canvas_x)
         self.vbar = tk.Scrollbar(self.image_frame, orient=tk.VERTICAL)
         self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.vbar.config(command=self.canvas.yview)
+        self.vbar.config(command=self.scroll_canvas_y)
 
         # Configure canvas to use scrollbars
         self.canvas.config(xscrollcommand=self.hbar.set, yscrollcommand=self.vbar.set)
@@ -120,6 +258,7 @@ class FingerprintApp:
             "<Control-MouseWheel>", self.zoom
         )  # Ctrl + Mouse Wheel for zooming
         self.canvas.bind("<Button-1>", self.on_canvas_click)  # Handle clicks on canvas
+        self.canvas.bind("<Configure>", self.schedule_viewport_redraw)
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<B3-Motion>", self.on_canvas_drag_angle)
 
@@ -140,6 +279,11 @@ class FingerprintApp:
             side=tk.TOP, fill=tk.X
         )
 
+        # Open Folder Button
+        tk.Button(control_frame, text="Open Folder", command=self.open_folder).pack(
+            side=tk.TOP, fill=tk.X
+        )
+
         # Load ISO Template Button
         self.load_iso_button = tk.Button(
             control_frame,
@@ -149,6 +293,18 @@ class FingerprintApp:
         )
         self.load_iso_button.pack(side=tk.TOP, fill=tk.X)
 
+        # Duplicate Check Button (also runs after loading and before saving ISO)
+        tk.Button(
+            control_frame, text="Find Duplicates", command=self.find_duplicate_minutiae
+        ).pack(side=tk.TOP, fill=tk.X)
+
+        # Core/Delta Detection Button (markers: "c"/"v" keys, drag in editor mode)
+        tk.Button(
+            control_frame,
+            text="Detect Core/Delta",
+            command=self.detect_singular_points,
+        ).pack(side=tk.TOP, fill=tk.X)
+
         # Minutiae Type Selection
         type_label = tk.Label(control_frame, text="Type:")
         type_label.pack(side=tk.TOP)
@@ -187,12 +343,66 @@ class FingerprintApp:
             command=self.update_quality,
         )
         quality_dropdown.pack(side=tk.TOP)
+        # Fill in "not set" from the quality map of the image
+        self.auto_quality_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            control_frame,
+            text="Auto Quality",
+            variable=self.auto_quality_var,
+            command=self.toggle_quality_options,
+        ).pack(side=tk.TOP)
 
         # Angle Input
         angle_label = tk.Label(control_frame, text="Angle (degrees):")
         angle_label.pack(side=tk.TOP)
         self.angle_entry = tk.Entry(control_frame, width=5)
         self.angle_entry.pack(side=tk.TOP)
+        self.auto_angle_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            control_frame,
+            text="Auto Angle",
+            variable=self.auto_angle_var,
+            command=self.toggle_structure_options,
+        ).pack(side=tk.TOP)
+
+        # Snap clicks to the nearest ridge ending or bifurcation
+        self.snap_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Snap to Ridge Features",
+            variable=self.snap_var,
+            command=self.toggle_structure_options,
+        ).pack(side=tk.TOP)
+
+        # Suggestion Buttons
+        tk.Button(
+            control_frame, text="Suggest Minutiae", command=self.suggest_minutiae
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Button(
+            control_frame, text="Run Extractor Plugin", command=self.run_plugin
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Button(
+            control_frame,
+            text="Accept All Suggestions",
+            command=self.accept_all_suggestions,
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Button(
+            control_frame, text="Reject All Suggestions", command=self.clear_suggestions
+        ).pack(side=tk.TOP, fill=tk.X)
+
+        # Template Comparison Buttons
+        tk.Button(
+            control_frame, text="Compare Template", command=self.compare_template
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Button(
+            control_frame, text="Search Gallery", command=self.search_gallery
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Button(control_frame, text="Diff Markup", command=self.diff_markup).pack(
+            side=tk.TOP, fill=tk.X
+        )
+        tk.Button(
+            control_frame, text="Clear Comparison", command=self.clear_comparison
+        ).pack(side=tk.TOP, fill=tk.X)
 
         # Save Minutiae Button
         tk.Button(
@@ -213,6 +423,105 @@ class FingerprintApp:
             side=tk.TOP, fill=tk.X
         )
 
+        # Export Overlays Button
+        tk.Button(
+            control_frame, text="Export Overlays", command=self.export_overlays
+        ).pack(side=tk.TOP, fill=tk.X)
+
+        # Annotation Database Button
+        tk.Button(control_frame, text="Open Database", command=self.open_database).pack(
+            side=tk.TOP, fill=tk.X
+        )
+
+        # Enhanced View Toggle
+        self.enhanced_view_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Enhanced View",
+            variable=self.enhanced_view_var,
+            command=self.toggle_enhanced_view,
+        ).pack(side=tk.TOP)
+
+        # Quality Heatmap Toggle
+        self.heatmap_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Quality Heatmap",
+            variable=self.heatmap_var,
+            command=self.toggle_quality_options,
+        ).pack(side=tk.TOP)
+
+        # Contrast Controls (applied to the display, and on save if requested)
+        tk.Label(control_frame, text="Brightness:").pack(side=tk.TOP)
+        self.brightness_var = tk.DoubleVar(value=DEFAULT_BRIGHTNESS)
+        tk.Scale(
+            control_frame,
+            from_=-100,
+            to=100,
+            orient=tk.HORIZONTAL,
+            variable=self.brightness_var,
+            command=self.schedule_viewport_redraw,
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Label(control_frame, text="Contrast:").pack(side=tk.TOP)
+        self.contrast_var = tk.DoubleVar(value=DEFAULT_CONTRAST)
+        tk.Scale(
+            control_frame,
+            from_=0.1,
+            to=4.0,
+            resolution=0.05,
+            orient=tk.HORIZONTAL,
+            variable=self.contrast_var,
+            command=self.schedule_viewport_redraw,
+        ).pack(side=tk.TOP, fill=tk.X)
+        tk.Label(control_frame, text="Gamma:").pack(side=tk.TOP)
+        self.gamma_var = tk.DoubleVar(value=DEFAULT_GAMMA)
+        tk.Scale(
+            control_frame,
+            from_=0.2,
+            to=3.0,
+            resolution=0.05,
+            orient=tk.HORIZONTAL,
+            variable=self.gamma_var,
+            command=self.schedule_viewport_redraw,
+        ).pack(side=tk.TOP, fill=tk.X)
+        self.equalize_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Equalize Histogram",
+            variable=self.equalize_var,
+            command=self.schedule_viewport_redraw,
+        ).pack(side=tk.TOP)
+        self.bake_contrast_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Apply Contrast on Save",
+            variable=self.bake_contrast_var,
+        ).pack(side=tk.TOP)
+        tk.Button(
+            control_frame, text="Reset Contrast", command=self.reset_contrast
+        ).pack(side=tk.TOP, fill=tk.X)
+
+        # Latency tracing with an on-canvas HUD, exported as a Chrome trace
+        self.trace_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Trace HUD",
+            variable=self.trace_var,
+            command=self.toggle_tracing,
+        ).pack(side=tk.TOP)
+        tk.Button(control_frame, text="Export Trace", command=self.export_trace).pack(
+            side=tk.TOP, fill=tk.X
+        )
+
+        # Record canvas events for replay with recording.py
+        self.record_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Record Events",
+            variable=self.record_var,
+            command=self.toggle_recording,
+        ).pack(side=tk.TOP)
+
         # Editor Mode Toggle
         self.editor_mode_var = tk.BooleanVar(value=False)
         tk.Checkbutton(
@@ -222,6 +531,14 @@ class FingerprintApp:
             command=self.toggle_editor_mode,
         ).pack(side=tk.TOP)
 
+        # Reopen the last image at its zoom and scroll position on startup
+        self.restore_session_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="Restore Last Session",
+            variable=self.restore_session_var,
+        ).pack(side=tk.TOP)
+
         # Reset Button
         tk.Button(control_frame, text="Reset", command=self.reset_app).pack(
             side=tk.TOP, fill=tk.X
@@ -241,8 +558,25 @@ class FingerprintApp:
         self.minutiae_list.bind("<Delete>", self.delete_minutiae)  # Delete
         self.minutiae_list.bind("d", self.delete_minutiae_no_confirm)  # Delete key
 
-        # Create entry widgets for editing (initially hidden)
-        self.create_edit_widgets()
+        # Entry widgets for editing are created when first shown
+        self.edit_frame = None
+
+    def create_thumbnail_strip(self):
+        self.thumbnail_frame = tk.Frame(self.master)
+        self.thumbnail_frame.pack(side=tk.BOTTOM, fill=tk.X)
+
+        self.thumbnail_canvas = tk.Canvas(
+            self.thumbnail_frame, height=THUMBNAIL_SIZE[1] + 40, bg="white"
+        )
+        self.thumbnail_canvas.pack(side=tk.TOP, fill=tk.X)
+        self.thumbnail_bar = tk.Scrollbar(self.thumbnail_frame, orient=tk.HORIZONTAL)
+        self.thumbnail_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.thumbnail_bar.config(command=self.scroll_thumbnail_strip)
+        self.thumbnail_canvas.config(xscrollcommand=self.thumbnail_bar.set)
+
+        self.thumbnail_canvas.bind("<Configure>", self.schedule_thumbnail_redraw)
+        self.thumbnail_canvas.bind("<Button-1>", self.on_thumbnail_click)
+        self.thumbnail_canvas.bind("<MouseWheel>", self.on_thumbnail_wheel)
 
     def create_edit_widgets(self):
         # Frame for edit widgets (placed within listbox_frame)
@@ -313,27 +647,1096 @@ class FingerprintApp:
         self.edit_angle_entry.bind("<Return>", self.update_minutiae_from_entry)
 
     def load_image(self):
-        self.image_path = filedialog.askopenfilename(
+        path = filedialog.askopenfilename(
             defaultextension=".png",
-            filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.tif *.tiff")],
+            filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.tif *.tiff *.wsq")],
         )
+        if path:
+            self.open_image(path)
+
+    def open_image(self, path):
+        from jobs import load_image_job
+
+        if not path:
+            return
+        # Decode in the background; a newer image replaces one still loading
+        if self.open_job is not None:
+            self.open_job.cancel()
+        self.open_job = self.run_job(
+            f"Loading {os.path.basename(path)}",
+            load_image_job,
+            path,
+            callback=lambda job: self.on_image_loaded(job, path),
+        )
+
+    def on_image_loaded(self, job, path):
+        from jobs import JobCancelled
+
+        if job is not self.open_job:
+            return
+        self.open_job = None
+        try:
+            image = job.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open image: {e}")
+            return
+
+        self.image_path = path
         if self.image_path:
-            self.original_image = Image.open(self.image_path)
+            self.original_image = image
             self.image = self.original_image.copy()
+            self.enhanced_image = None
+            self.clear_suggestions()
+            self.suggestion_job = None
+            self.clear_comparison()
+            self.ridge_structure = None
+            self.clear_singular_points()
+            self.set_quality_map(None)
+            if self.enhanced_view_var.get():
+                self.request_enhancement()
+            if self.auto_angle_var.get() or self.snap_var.get():
+                self.request_structure()
+            if self.auto_quality_var.get() or self.heatmap_var.get():
+                self.request_quality()
             self.zoom_level = 1.0
             self.display_image()
             self.redraw_minutiae()
             self.update_image_size_label()
             self.update_image_name_label()
 
+            # Zoom and scroll of a restored session, once its image is shown
+            if self.restored_view is not None and self.restored_view[0] == path:
+                _, self.zoom_level, x_view, y_view = self.restored_view
+                self.display_image()
+                self.redraw_minutiae()
+                self.canvas.xview_moveto(x_view)
+                self.canvas.yview_moveto(y_view)
+            self.restored_view = None
+
             # Enable Load ISO Template button and Save ISO Template button
             self.load_iso_button.config(state=tk.NORMAL)
             self.save_iso_button.config(state=tk.NORMAL)
 
+            # Keep the thumbnail strip in sync with the open image
+            if self.image_path in self.dataset_paths:
+                self.dataset_index = self.dataset_paths.index(self.image_path)
+                self.scroll_thumbnail_to(self.dataset_index)
+            self.schedule_thumbnail_redraw()
+
             # Set focus to the minutiae listbox after loading an image
             self.minutiae_list.focus_set()
 
+            self.request_stored_markup()
+
+    def open_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+
+        self.dataset_paths = scan_folder(folder)
+        self.dataset_index = None
+        self.thumbnail_files = {}
+        self.thumbnail_summaries = {}
+        self.thumbnail_photos = {}
+        self.thumbnail_canvas.delete("all")
+        self.thumbnail_canvas.config(
+            scrollregion=(
+                0,
+                0,
+                len(self.dataset_paths) * self.thumbnail_cell_width,
+                THUMBNAIL_SIZE[1] + 40,
+            )
+        )
+        self.thumbnail_canvas.xview_moveto(0)
+        if not self.dataset_paths:
+            messagebox.showwarning("No Images", "The folder contains no images.")
+            return
+
+        # Reuse cached thumbnails and render the rest in background processes
+        cached, missing = self.thumbnail_cache.split(self.dataset_paths)
+        self.thumbnail_files.update(cached)
+        futures = self.thumbnail_cache.generate(missing, self.get_executor())
+        for future, image_path in futures.items():
+            self.watch_future(future, self.on_thumbnail_ready)
+
+        self.open_image(self.dataset_paths[0])
+
+    def previous_image(self, event=None):
+        if self.dataset_paths and self.dataset_index:
+            self.open_image(self.dataset_paths[self.dataset_index - 1])
+
+    def next_image(self, event=None):
+        if self.dataset_index is not None:
+            if self.dataset_index + 1 < len(self.dataset_paths):
+                self.open_image(self.dataset_paths[self.dataset_index + 1])
+
+    def on_thumbnail_ready(self, future):
+        try:
+            result = future.result()
+        except Exception:
+            return  # Leave the placeholder for images that cannot be decoded
+        thumb = self.thumbnail_cache.finished(result)
+        self.thumbnail_files[result[0]] = thumb
+        self.schedule_thumbnail_redraw()
+
+    def scroll_thumbnail_strip(self, *args):
+        self.thumbnail_canvas.xview(*args)
+        self.schedule_thumbnail_redraw()
+
+    def scroll_thumbnail_to(self, index):
+        total = len(self.dataset_paths) * self.thumbnail_cell_width
+        left = self.thumbnail_canvas.canvasx(0)
+        right = left + self.thumbnail_canvas.winfo_width()
+        x = index * self.thumbnail_cell_width
+        if total and not (left <= x and x + self.thumbnail_cell_width <= right):
+            self.thumbnail_canvas.xview_moveto(x / total)
+
+    def on_thumbnail_wheel(self, event):
+        self.thumbnail_canvas.xview_scroll(-1 if event.delta > 0 else 1, "units")
+        self.schedule_thumbnail_redraw()
+
+    def on_thumbnail_click(self, event):
+        index = int(self.thumbnail_canvas.canvasx(event.x) // self.thumbnail_cell_width)
+        if 0 <= index < len(self.dataset_paths) and index != self.dataset_index:
+            self.open_image(self.dataset_paths[index])
+
+    def schedule_thumbnail_redraw(self, event=None):
+        # Coalesce redraw requests from scrolling and finished workers
+        if not self.thumbnail_redraw_pending:
+            self.thumbnail_redraw_pending = True
+            self.master.after_idle(self.draw_visible_thumbnails)
+
+    def draw_visible_thumbnails(self):
+        from PIL import ImageTk
+
+        # Only the visible part of the strip holds canvas items and PhotoImages,
+        # so large datasets cost no more than a screenful of thumbnails
+        self.thumbnail_redraw_pending = False
+        self.thumbnail_canvas.delete("all")
+        if not self.dataset_paths:
+            return
+
+        cell = self.thumbnail_cell_width
+        left = self.thumbnail_canvas.canvasx(0)
+        first = max(int(left // cell), 0)
+        last = min(
+            int((left + self.thumbnail_canvas.winfo_width()) // cell) + 1,
+            len(self.dataset_paths) - 1,
+        )
+
+        photos = {}
+        for index in range(first, last + 1):
+            path = self.dataset_paths[index]
+            x = index * cell + 5
+
+            photo = self.thumbnail_photos.get(index)
+            if photo is None and path in self.thumbnail_files:
+                try:
+                    photo = ImageTk.PhotoImage(file=self.thumbnail_files[path])
+                except tk.TclError:
+                    photo = None
+            if photo is not None:
+                photos[index] = photo
+                self.thumbnail_canvas.create_image(
+                    x + THUMBNAIL_SIZE[0] // 2,
+                    5 + THUMBNAIL_SIZE[1] // 2,
+                    image=photo,
+                )
+            else:
+                self.thumbnail_canvas.create_rectangle(
+                    x, 5, x + THUMBNAIL_SIZE[0], 5 + THUMBNAIL_SIZE[1], outline="gray"
+                )
+
+            # Minutiae count and annotation status under the thumbnail
+            if path not in self.thumbnail_summaries:
+                self.thumbnail_summaries[path] = annotation_summary(path)
+            count, status = self.thumbnail_summaries[path]
+            if status == "annotated":
+                color = ANNOTATED_COLOR
+            elif status == "empty":
+                color = EMPTY_ANNOTATION_COLOR
+            else:
+                color = NOT_ANNOTATED_COLOR
+            self.thumbnail_canvas.create_text(
+                x + THUMBNAIL_SIZE[0] // 2,
+                THUMBNAIL_SIZE[1] + 12,
+                text=os.path.basename(path)[:14],
+            )
+            self.thumbnail_canvas.create_text(
+                x + THUMBNAIL_SIZE[0] // 2,
+                THUMBNAIL_SIZE[1] + 28,
+                text=f"{count} minutiae" if status != "none" else "not annotated",
+                fill=color,
+            )
+
+            if index == self.dataset_index:
+                self.thumbnail_canvas.create_rectangle(
+                    x - 3,
+                    2,
+                    x + THUMBNAIL_SIZE[0] + 3,
+                    THUMBNAIL_SIZE[1] + 37,
+                    outline=ACTIVE_COLOR,
+                    width=3,
+                )
+        self.thumbnail_photos = photos
+
+    def refresh_thumbnail_summary(self):
+        # Re-read the annotation status of the open image after saving
+        if self.image_path in self.thumbnail_summaries:
+            del self.thumbnail_summaries[self.image_path]
+            self.schedule_thumbnail_redraw()
+
+    def annotation_dialog_options(self, extension):
+        # Suggest saving annotations next to the image so the dataset strip finds them
+        if not self.image_path:
+            return {}
+        stem = os.path.splitext(os.path.basename(self.image_path))[0]
+        return {
+            "initialdir": os.path.dirname(self.image_path),
+            "initialfile": stem + extension,
+        }
+
+    def toggle_enhanced_view(self):
+        if self.enhanced_view_var.get() and self.enhanced_image is None:
+            self.request_enhancement()
+        self.display_image()
+
+    def request_enhancement(self):
+        if not self.image_path:
+            return
+
+        # Results cached on disk load directly, everything else goes to a worker
+        cached = self.enhancement_cache.lookup(self.image_path)
+        if cached:
+            self.set_enhanced_image(cached)
+        elif self.image_path not in self.enhancement_pending:
+            self.enhancement_pending.add(self.image_path)
+            future = self.enhancement_cache.generate(
+                self.image_path, self.get_executor()
+            )
+            self.watch_future(future, self.on_enhancement_ready)
+
+    def on_enhancement_ready(self, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.enhancement_pending.clear()
+            messagebox.showerror("Error", f"Failed to enhance image: {e}")
+            return
+        self.enhancement_pending.discard(result[0])
+        enhanced_path = self.enhancement_cache.finished(result)
+        if result[0] == self.image_path:
+            self.set_enhanced_image(enhanced_path)
+            self.display_image()
+
+    def set_enhanced_image(self, path):
+        with Image.open(path) as enhanced:
+            self.enhanced_image = enhanced.copy()
+
+    def toggle_structure_options(self):
+        # Automatic angles and snapping both need the ridge structure
+        if self.auto_angle_var.get() or self.snap_var.get():
+            if self.ridge_structure is None:
+                self.request_structure()
+
+    def request_structure(self):
+        from orientation import read_structure
+
+        if not self.image_path:
+            return
+
+        cached = self.structure_cache.lookup(self.image_path)
+        if cached:
+            self.set_ridge_structure(read_structure(cached))
+        elif self.image_path not in self.structure_pending:
+            self.structure_pending.add(self.image_path)
+            future = self.structure_cache.generate(self.image_path, self.get_executor())
+            self.watch_future(future, self.on_structure_ready)
+
+    def on_structure_ready(self, future):
+        from orientation import read_structure
+
+        try:
+            result = future.result()
+        except Exception:
+            # Marking falls back to the angle entry
+            self.structure_pending.clear()
+            return
+        self.structure_pending.discard(result[0])
+        structure_path = self.structure_cache.finished(result)
+        if result[0] == self.image_path:
+            self.set_ridge_structure(read_structure(structure_path))
+
+    def set_ridge_structure(self, structure):
+        self.ridge_structure = structure
+        # Detected cores and deltas are shown unless loaded or edited ones exist
+        if self.singular_points is None:
+            self.singular_points = [tuple(p) for p in structure.singular.tolist()]
+            self.draw_singular_points()
+
+    def detect_singular_points(self):
+        if not self.image:
+            messagebox.showwarning("No Image", "Please load an image first.")
+            return
+        self.singular_points = None
+        if self.ridge_structure is not None:
+            self.set_ridge_structure(self.ridge_structure)
+        else:
+            self.request_structure()
+
+    def draw_singular_points(self):
+        self.canvas.delete("singular")
+        size = 8 * self.zoom_level
+        for x, y, kind in self.singular_points or []:
+            canvas_x = x * self.zoom_level
+            canvas_y = y * self.zoom_level
+            if kind == CORE:
+                # Circle with a cross
+                self.canvas.create_oval(
+                    canvas_x - size,
+                    canvas_y - size,
+                    canvas_x + size,
+                    canvas_y + size,
+                    outline=CORE_COLOR,
+                    width=2,
+                    tags="singular",
+                )
+                for dx, dy in ((size, 0), (0, size)):
+                    self.canvas.create_line(
+                        canvas_x - dx,
+                        canvas_y - dy,
+                        canvas_x + dx,
+                        canvas_y + dy,
+                        fill=CORE_COLOR,
+                        width=2,
+                        tags="singular",
+                    )
+            else:
+                # Triangle
+                self.canvas.create_polygon(
+                    canvas_x,
+                    canvas_y - size,
+                    canvas_x - size,
+                    canvas_y + size,
+                    canvas_x + size,
+                    canvas_y + size,
+                    outline=DELTA_COLOR,
+                    fill="",
+                    width=2,
+                    tags="singular",
+                )
+
+    def clear_singular_points(self):
+        self.singular_points = None
+        self.canvas.delete("singular")
+
+    @traced("hit_test", "hit-test")
+    def find_singular_point(self, canvas_x, canvas_y):
+        closest_index = None
+        min_distance = 10  # Pixels on screen
+        for i, (x, y, _) in enumerate(self.singular_points or []):
+            distance = math.hypot(
+                x * self.zoom_level - canvas_x, y * self.zoom_level - canvas_y
+            )
+            if distance < min_distance:
+                min_distance = distance
+                closest_index = i
+        return closest_index
+
+    def toggle_core(self, event):
+        self.toggle_singular_point(event, CORE)
+
+    def toggle_delta(self, event):
+        self.toggle_singular_point(event, DELTA)
+
+    def toggle_singular_point(self, event, kind):
+        if isinstance(event.widget, tk.Entry) or not self.image:
+            return
+        canvas_x, canvas_y = self.canvas_pointer()
+        points = list(self.singular_points or [])
+        index = self.find_singular_point(canvas_x, canvas_y)
+        if index is not None:
+            del points[index]
+        else:
+            x = int(canvas_x / self.zoom_level)
+            y = int(canvas_y / self.zoom_level)
+            if not (0 <= x < self.image.width and 0 <= y < self.image.height):
+                return
+            points.append((x, y, kind))
+        self.singular_points = points
+        self.draw_singular_points()
+
+    def toggle_quality_options(self):
+        # Automatic quality and the heatmap both need the quality map
+        if self.auto_quality_var.get() or self.heatmap_var.get():
+            if self.quality_map is None:
+                self.request_quality()
+        self.schedule_viewport_redraw()
+
+    def request_quality(self):
+        from quality import read_quality
+
+        if not self.image_path:
+            return
+
+        cached = self.quality_cache.lookup(self.image_path)
+        if cached:
+            self.set_quality_map(read_quality(cached))
+        elif self.image_path not in self.quality_pending:
+            self.quality_pending.add(self.image_path)
+            future = self.quality_cache.generate(self.image_path, self.get_executor())
+            self.watch_future(future, self.on_quality_ready)
+
+    def on_quality_ready(self, future):
+        from quality import read_quality
+
+        try:
+            result = future.result()
+        except Exception:
+            # Quality stays as chosen in the dropdown
+            self.quality_pending.clear()
+            return
+        self.quality_pending.discard(result[0])
+        quality_path = self.quality_cache.finished(result)
+        if result[0] == self.image_path:
+            self.set_quality_map(read_quality(quality_path))
+
+    def set_quality_map(self, quality_map):
+        from quality import heatmap
+
+        self.quality_map = quality_map
+        self.heatmap_image = heatmap(*quality_map) if quality_map else None
+        self.schedule_viewport_redraw()
+
+    def display_source(self):
+        # The enhanced image replaces the raw one only for display
+        if self.enhanced_view_var.get() and self.enhanced_image is not None:
+            return self.enhanced_image
+        return self.original_image
+
+    def get_executor(self):
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.executor = ProcessPoolExecutor()
+        return self.executor
+
+    def get_jobs(self):
+        if self.jobs is None:
+            from jobs import JobQueue
+
+            self.jobs = JobQueue()
+        return self.jobs
+
+    @cached_property
+    def enhancement_cache(self):
+        from enhance import EnhancementCache
+
+        return EnhancementCache()
+
+    @cached_property
+    def structure_cache(self):
+        from orientation import StructureCache
+
+        return StructureCache()
+
+    @cached_property
+    def quality_cache(self):
+        from quality import QualityCache
+
+        return QualityCache()
+
+    @cached_property
+    def suggestion_cache(self):
+        from extraction import SuggestionCache
+
+        return SuggestionCache()
+
+    def run_job(self, name, fn, *args, callback):
+        # Runs fn(job, *args) on the job threads; callback(job) runs in the mainloop
+        job = self.get_jobs().submit(name, fn, *args)
+        self.watch_future(job.future, lambda future: callback(job))
+        self.update_job_status()
+        return job
+
+    def update_job_status(self):
+        active = self.jobs.active() if self.jobs is not None else []
+        if not active:
+            self.job_label.config(text="")
+            self.cancel_jobs_button.pack_forget()
+            return
+        job = active[0]
+        text = f"{job.message} {job.progress:.0%}"
+        if len(active) > 1:
+            text += f" (+{len(active) - 1} more)"
+        self.job_label.config(text=text)
+        if not self.cancel_jobs_button.winfo_ismapped():
+            self.cancel_jobs_button.pack(side=tk.LEFT, padx=5)
+
+    def cancel_jobs(self):
+        if self.jobs is not None:
+            self.jobs.cancel_all()
+        self.update_job_status()
+
+    def watch_future(self, future, callback):
+        # Poll a background future from the Tk mainloop and call back on completion
+        self.pending_futures.append((future, callback))
+        if not self.polling_futures:
+            self.polling_futures = True
+            self.master.after(50, self.poll_futures)
+
+    def poll_futures(self):
+        pending, self.pending_futures = self.pending_futures, []
+        for future, callback in pending:
+            if future.done():
+                callback(future)
+            else:
+                self.pending_futures.append((future, callback))
+        self.update_job_status()
+        if self.pending_futures:
+            self.master.after(50, self.poll_futures)
+        else:
+            self.polling_futures = False
+            self.thumbnail_cache.save()
+
+    def load_last_session(self):
+        try:
+            with open(cache_path(SESSION_FILE)) as f:
+                self.last_session = json.load(f)
+        except (OSError, ValueError):
+            self.last_session = {}
+        self.restore_session_var.set(self.last_session.get("restore", False))
+
+    def restore_last_session(self):
+        # Reopens the image of the last session; on_image_loaded restores the view
+        session = self.last_session
+        if not self.restore_session_var.get() or self.image_path:
+            return
+        path = session.get("image")
+        if path and os.path.exists(path):
+            self.restored_view = (
+                path,
+                session.get("zoom", 1.0),
+                session.get("x_view", 0.0),
+                session.get("y_view", 0.0),
+            )
+            self.open_image(path)
+
+    def save_session(self):
+        # Keeps the last image of an earlier session if none is open now
+        session = dict(self.last_session, restore=self.restore_session_var.get())
+        if self.image_path:
+            session.update(
+                image=os.path.abspath(self.image_path),
+                zoom=self.zoom_level,
+                x_view=self.canvas.xview()[0],
+                y_view=self.canvas.yview()[0],
+            )
+        path = cache_path(SESSION_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, path)
+
+    def on_close(self, save_session=False):
+        # Replays, benchmarks and --startup-time close the app themselves and
+        # must not overwrite the session of the user
+        if save_session:
+            try:
+                self.save_session()
+            except OSError:
+                pass  # The session is a convenience; never keep the window from closing
+        if self.jobs is not None:
+            self.jobs.shutdown()
+        if self.store is not None:
+            self.store.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.suggestion_manager is not None:
+            self.suggestion_manager.shutdown()
+        self.thumbnail_cache.save()
+        self.master.destroy()
+
+    def suggest_minutiae(self):
+        if not self.image:
+            messagebox.showwarning("No Image", "Please load an image first.")
+            return
+        if self.suggestion_job == self.image_path:
+            return  # Already running for this image
+        self.clear_suggestions()
+
+        # Cached candidates are shown at once, everything else is streamed in
+        cached = self.suggestion_cache.lookup(self.image_path)
+        if cached is not None:
+            self.add_suggestions(cached)
+            return
+        if self.suggestion_queue is None:
+            self.suggestion_manager = multiprocessing.Manager()
+            self.suggestion_queue = self.suggestion_manager.Queue()
+        self.suggestion_job = self.image_path
+        future = self.suggestion_cache.generate(
+            self.image_path, self.get_executor(), self.suggestion_queue
+        )
+        self.watch_future(future, self.on_suggestions_ready)
+        self.master.after(50, self.poll_suggestions)
+
+    def poll_suggestions(self):
+        self.drain_suggestion_queue()
+        if self.suggestion_job is not None:
+            self.master.after(50, self.poll_suggestions)
+
+    def drain_suggestion_queue(self):
+        while True:
+            try:
+                image_path, records = self.suggestion_queue.get_nowait()
+            except queue.Empty:
+                return
+            # Batches of an image that is no longer open are dropped
+            if image_path == self.suggestion_job:
+                self.add_suggestions(records)
+
+    def on_suggestions_ready(self, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.suggestion_job = None
+            messagebox.showerror("Error", f"Failed to suggest minutiae: {e}")
+            return
+        self.suggestion_cache.finished(result)
+        # Every batch was queued before the worker returned
+        self.drain_suggestion_queue()
+        if result[0] == self.suggestion_job:
+            self.suggestion_job = None
+
+    def run_plugin(self):
+        if not self.image:
+            messagebox.showwarning("No Image", "Please load an image first.")
+            return
+        from jobs import plugin_job
+        from plugins import PLUGIN_DIR
+
+        path = filedialog.askopenfilename(
+            title="Choose an Extractor Plugin",
+            initialdir=PLUGIN_DIR if os.path.isdir(PLUGIN_DIR) else None,
+            filetypes=[("Python Plugins", "*.py")],
+        )
+        if not path:
+            return
+        # The plugin runs in its own process; its minutiae come back as suggestions
+        image_path = self.image_path
+        self.run_job(
+            f"Running {os.path.basename(path)}",
+            plugin_job,
+            path,
+            self.original_image,
+            callback=lambda job: self.on_plugin_done(job, image_path),
+        )
+
+    def on_plugin_done(self, job, image_path):
+        from jobs import JobCancelled
+
+        try:
+            records = job.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Plugin failed: {e}")
+            return
+        if image_path != self.image_path:
+            return  # Another image was opened meanwhile
+        if not records:
+            messagebox.showinfo("Plugin", "The plugin found no minutiae.")
+            return
+        self.add_suggestions(records)
+
+    def add_suggestions(self, records):
+        # A restarted extraction can stream candidates that are already shown
+        shown = {(s[0], s[1]) for s in self.suggestions}
+        for x, y, angle, quality, m_type in records:
+            if (x, y) in shown or any(
+                math.hypot(m[0] - x, m[1] - y) <= SUGGESTION_DISTANCE
+                for m in self.minutiae
+            ):
+                continue
+            minutiae_id, orientation_line_id = self.draw_suggestion(x, y, angle, m_type)
+            self.suggestions.append(
+                (x, y, angle, quality, m_type, minutiae_id, orientation_line_id)
+            )
+
+    def draw_suggestion(self, x, y, angle, m_type):
+        from overlay import type_color
+
+        # Suggestions are drawn hollow with a dashed line to set them apart
+        color = type_color(m_type)
+        minutiae_id = self.canvas.create_oval(0, 0, 0, 0, outline=color, width=2)
+        orientation_line_id = self.canvas.create_line(
+            0, 0, 0, 0, fill=color, width=2, dash=(3, 2)
+        )
+        self.place_minutiae_items(x, y, angle, minutiae_id, orientation_line_id)
+        return minutiae_id, orientation_line_id
+
+    def place_minutiae_items(self, x, y, angle, minutiae_id, orientation_line_id):
+        canvas_x = x * self.zoom_level
+        canvas_y = y * self.zoom_level
+        zoomed_radius = 3 * self.zoom_level
+        self.canvas.coords(
+            minutiae_id,
+            canvas_x - zoomed_radius,
+            canvas_y - zoomed_radius,
+            canvas_x + zoomed_radius,
+            canvas_y + zoomed_radius,
+        )
+        zoomed_line_length = 15 * self.zoom_level
+        angle_rad = math.radians(angle)
+        self.canvas.coords(
+            orientation_line_id,
+            canvas_x,
+            canvas_y,
+            canvas_x + zoomed_line_length * math.cos(angle_rad),
+            canvas_y - zoomed_line_length * math.sin(angle_rad),  # Inverted y-axis
+        )
+
+    def redraw_suggestions(self):
+        for x, y, angle, _, _, minutiae_id, orientation_line_id in self.suggestions:
+            self.place_minutiae_items(x, y, angle, minutiae_id, orientation_line_id)
+
+    def clear_suggestions(self):
+        for _, _, _, _, _, minutiae_id, orientation_line_id in self.suggestions:
+            self.canvas.delete(minutiae_id)
+            self.canvas.delete(orientation_line_id)
+        self.suggestions = []
+
+    def canvas_pointer(self):
+        # Canvas coordinates of the mouse pointer, for key bindings on the window
+        canvas_x = self.canvas.canvasx(
+            self.canvas.winfo_pointerx() - self.canvas.winfo_rootx()
+        )
+        canvas_y = self.canvas.canvasy(
+            self.canvas.winfo_pointery() - self.canvas.winfo_rooty()
+        )
+        return canvas_x, canvas_y
+
+    @traced("hit_test", "hit-test")
+    def find_suggestion_under_pointer(self):
+        canvas_x, canvas_y = self.canvas_pointer()
+        closest_index = None
+        min_distance = 10  # Pixels on screen
+        for i, (x, y, _, _, _, _, _) in enumerate(self.suggestions):
+            distance = math.hypot(
+                x * self.zoom_level - canvas_x, y * self.zoom_level - canvas_y
+            )
+            if distance < min_distance:
+                min_distance = distance
+                closest_index = i
+        return closest_index
+
+    def accept_suggestion(self, event):
+        if isinstance(event.widget, tk.Entry):
+            return  # Typing in an entry field
+        index = self.find_suggestion_under_pointer()
+        if index is not None:
+            self.accept_suggestions([index])
+
+    def reject_suggestion(self, event):
+        if isinstance(event.widget, tk.Entry):
+            return
+        index = self.find_suggestion_under_pointer()
+        if index is not None:
+            x, y, angle, quality, m_type, minutiae_id, orientation_line_id = (
+                self.suggestions.pop(index)
+            )
+            self.canvas.delete(minutiae_id)
+            self.canvas.delete(orientation_line_id)
+
+    def accept_all_suggestions(self):
+        self.accept_suggestions(range(len(self.suggestions)))
+
+    def accept_suggestions(self, indices):
+        # Turn suggestions into regular minutiae
+        indices = set(indices)
+        remaining = []
+        for i, suggestion in enumerate(self.suggestions):
+            x, y, angle, quality, m_type, minutiae_id, orientation_line_id = suggestion
+            if i not in indices:
+                remaining.append(suggestion)
+                continue
+            self.canvas.delete(minutiae_id)
+            self.canvas.delete(orientation_line_id)
+            self.add_minutiae(x, y, angle, quality, m_type)
+        self.suggestions = remaining
+        self.update_minutiae_listbox()
+        self.update_minutiae_count_label()
+
+    def add_minutiae(self, x, y, angle, quality, m_type):
+        from overlay import type_color
+
+        color = type_color(m_type)
+        minutiae_id = self.canvas.create_oval(0, 0, 0, 0, fill=color)
+        orientation_line_id = self.canvas.create_line(0, 0, 0, 0, fill=color, width=2)
+        self.place_minutiae_items(x, y, angle, minutiae_id, orientation_line_id)
+        self.minutiae.append(
+            (x, y, angle, quality, m_type, minutiae_id, orientation_line_id)
+        )
+
+    def compare_template(self):
+        from matching import match
+
+        if not self.image:
+            messagebox.showwarning("No Image", "Please load an image first.")
+            return
+        if not self.minutiae:
+            messagebox.showwarning("No Minutiae", "Mark or load minutiae first.")
+            return
+
+        path = filedialog.askopenfilename(
+            filetypes=[("Template files", "*.iso *.ist *.dat *.txt")],
+        )
+        if not path:
+            return
+        try:
+            other = read_template(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to read template: {e}")
+            return
+
+        result = match([m[:5] for m in self.minutiae], other)
+        self.show_comparison(other, result)
+
+        messagebox.showinfo(
+            "Compare Template",
+            f"Similarity score: {result.score:.3f}\n"
+            f"Corresponding pairs: {len(result.pairs)} "
+            f"({len(self.minutiae)} marked, {len(other)} in template)\n"
+            f"Alignment: rotation {result.rotation:.1f} degrees, "
+            f"shift ({result.translation[0]:.0f}, {result.translation[1]:.0f})",
+        )
+
+    def show_comparison(self, other, result):
+        # Keep the compared template in image coordinates so it survives zooming
+        paired = {j: i for i, j in result.pairs}
+        self.comparison_marks = []
+        self.comparison_links = []
+        for j, record in enumerate(other):
+            x, y = result.b_to_a(record[0], record[1])
+            self.comparison_marks.append(
+                (x, y, MATCHED_COLOR if j in paired else UNMATCHED_COLOR)
+            )
+            if j in paired:
+                m = self.minutiae[paired[j]]
+                self.comparison_links.append((m[0], m[1], x, y))
+        self.draw_comparison()
+
+    def diff_markup(self):
+        from agreement import compare
+
+        if not self.image:
+            messagebox.showwarning("No Image", "Please load an image first.")
+            return
+
+        path = filedialog.askopenfilename(
+            title="Second markup of this image",
+            filetypes=[("Template files", "*.iso *.ist *.dat *.txt")],
+        )
+        if not path:
+            return
+        try:
+            other = read_template(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to read markup: {e}")
+            return
+
+        # Both markups share the image, so no alignment is needed
+        agreement = compare([m[:5] for m in self.minutiae], other)
+        self.comparison_marks = [
+            (other[j][0], other[j][1], MATCHED_COLOR) for _, j in agreement.pairs
+        ]
+        self.comparison_marks += [
+            (other[j][0], other[j][1], UNMATCHED_COLOR) for j in agreement.extra
+        ]
+        self.comparison_marks += [
+            (self.minutiae[i][0], self.minutiae[i][1], MISSING_COLOR)
+            for i in agreement.missing
+        ]
+        self.comparison_links = [
+            (self.minutiae[i][0], self.minutiae[i][1], other[j][0], other[j][1])
+            for i, j in agreement.pairs
+        ]
+        self.draw_comparison()
+
+        messagebox.showinfo(
+            "Diff Markup",
+            f"{agreement.report()}\n\n"
+            f"Cyan: matched, magenta: only in {os.path.basename(path)}, "
+            "orange: only in the current markup",
+        )
+
+    def search_gallery(self):
+        from gallery import gallery_index_path, index_chunk, load_gallery_index
+        from gallery import refresh_index, refresh_jobs
+
+        if not self.minutiae:
+            messagebox.showwarning("No Minutiae", "Mark or load minutiae first.")
+            return
+
+        folder = filedialog.askdirectory(title="Gallery folder")
+        if not folder:
+            return
+        index = load_gallery_index(folder)
+        try:
+            paths, stats, jobs = refresh_jobs(index, folder)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to open gallery: {e}")
+            return
+        if not paths:
+            messagebox.showwarning("Empty Gallery", "No templates found in the folder.")
+            return
+        if not jobs:
+            self.show_gallery_results(index)
+            return
+
+        # No index yet, or templates changed since it was built
+        results = [None] * len(jobs)
+        done = []
+
+        def on_done(position, future):
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                results[position] = e
+            done.append(position)
+            if len(done) < len(jobs):
+                return
+            failures = [r for r in results if isinstance(r, Exception)]
+            if failures:
+                messagebox.showerror("Error", f"Failed to index gallery: {failures[0]}")
+                return
+            updated = refresh_index(index, paths, stats, jobs, results)
+            updated.save(gallery_index_path(folder))
+            self.show_gallery_results(updated)
+
+        executor = self.get_executor()
+        for position, job in enumerate(jobs):
+            self.watch_future(
+                executor.submit(index_chunk, *job),
+                lambda future, position=position: on_done(position, future),
+            )
+
+    def show_gallery_results(self, index):
+        query = [m[:5] for m in self.minutiae]
+        hits = index.search(query, GALLERY_RESULTS)
+        if not hits or hits[0][1] <= 0:
+            messagebox.showinfo("Search Gallery", "No similar templates found.")
+            return
+
+        # Overlay the best hit like a manual comparison
+        path, _, result = hits[0]
+        self.show_comparison(read_template(path), result)
+        lines = [
+            f"{score:.3f}  {len(r.pairs)} pairs  {os.path.basename(p)}"
+            for p, score, r in hits
+        ]
+        messagebox.showinfo(
+            "Search Gallery",
+            f"Top {len(hits)} of {len(index.paths)} templates "
+            f"(best shown on the image):\n\n" + "\n".join(lines),
+        )
+
+    def find_duplicate_minutiae(self):
+        if self.review_duplicates("The markup") == 0:
+            messagebox.showinfo("Duplicate Minutiae", "No duplicate minutiae found.")
+
+    def review_duplicates(self, context, allow_cancel=False):
+        # Highlights duplicate minutiae and offers to merge them. Returns the
+        # number of duplicate groups, or None if the user cancelled
+        groups = find_duplicates([m[:5] for m in self.minutiae])
+        self.duplicate_marks = [self.minutiae[i][:2] for g in groups for i in g]
+        self.draw_duplicates()
+        if not groups:
+            return 0
+
+        extra = sum(len(group) - 1 for group in groups)
+        message = (
+            f"{context} has {len(groups)} group(s) of stacked minutiae "
+            f"({extra} more than needed), circled in red.\n\n"
+            "Merge every group into a single minutia?"
+        )
+        if allow_cancel:
+            answer = messagebox.askyesnocancel("Duplicate Minutiae", message)
+            if answer is None:
+                return None
+        else:
+            answer = messagebox.askyesno("Duplicate Minutiae", message)
+        if answer:
+            self.merge_duplicate_minutiae()
+        return len(groups)
+
+    def merge_duplicate_minutiae(self):
+        records = [m[:5] for m in self.minutiae]
+        records = merge_duplicates(records, find_duplicates(records))
+        self.reset_minutiae()
+        for record in records:
+            self.add_minutiae(*record)
+        self.update_minutiae_listbox()
+        self.update_minutiae_count_label()
+        self.clear_duplicates()
+
+    def draw_duplicates(self):
+        self.canvas.delete("duplicates")
+        size = 8 * self.zoom_level
+        for x, y in self.duplicate_marks:
+            canvas_x = x * self.zoom_level
+            canvas_y = y * self.zoom_level
+            self.canvas.create_oval(
+                canvas_x - size,
+                canvas_y - size,
+                canvas_x + size,
+                canvas_y + size,
+                outline=DUPLICATE_COLOR,
+                width=2,
+                dash=(3, 2),
+                tags="duplicates",
+            )
+
+    def clear_duplicates(self):
+        self.duplicate_marks = []
+        self.canvas.delete("duplicates")
+
+    def draw_comparison(self):
+        self.canvas.delete("comparison")
+        size = 4 * self.zoom_level
+        for x, y, color in self.comparison_marks:
+            canvas_x = x * self.zoom_level
+            canvas_y = y * self.zoom_level
+            self.canvas.create_rectangle(
+                canvas_x - size,
+                canvas_y - size,
+                canvas_x + size,
+                canvas_y + size,
+                outline=color,
+                width=2,
+                tags="comparison",
+            )
+        for x, y, other_x, other_y in self.comparison_links:
+            self.canvas.create_line(
+                x * self.zoom_level,
+                y * self.zoom_level,
+                other_x * self.zoom_level,
+                other_y * self.zoom_level,
+                fill=MATCHED_COLOR,
+                width=2,
+                tags="comparison",
+            )
+
+    def clear_comparison(self):
+        self.comparison_marks = []
+        self.comparison_links = []
+        self.canvas.delete("comparison")
+
     def load_iso_template(self):
+        from jobs import load_markup_job
+
         if not self.image:
             messagebox.showwarning("No Image", "Please load an image first.")
             return
@@ -343,81 +1746,121 @@ class FingerprintApp:
             filetypes=[("ISO Template files", "*.iso *.ist *.dat")],
         )
         if path:
-            try:
-                minutiaes = self.load_iso19794(path, "19794-2-2005")
-                self.reset_minutiae()  # Clear existing minutiae
-
-                # Add loaded minutiae to the list
-                for min in minutiaes:
-                    if min.type == 0:
-                        minutiae_type = "other"
-                    elif min.type == 1:
-                        minutiae_type = "ending"
-                    else:
-                        minutiae_type = "bifurcation"
+            image_path = self.image_path
+            self.run_job(
+                f"Loading {os.path.basename(path)}",
+                load_markup_job,
+                path,
+                callback=lambda job: self.on_iso_template_loaded(job, image_path),
+            )
 
-                    quality = (
-                        min.quality
-                        if min.quality != 0
-                        else "not set"  # Set quality to "not set" if it's 0
-                    )
+    def on_iso_template_loaded(self, job, image_path):
+        from jobs import JobCancelled
 
-                    # Determine color based on type
-                    if minutiae_type == "ending":
-                        color = ENDING_COLOR
-                    elif minutiae_type == "bifurcation":
-                        color = BIFURCATION_COLOR
-                    else:
-                        color = OTHER_COLOR
-
-                    # Draw a small circle on the canvas and store the id
-                    radius = 3
-                    canvas_x = min.x * self.zoom_level
-                    canvas_y = min.y * self.zoom_level
-                    zoomed_radius = radius * self.zoom_level
-                    minutiae_id = self.canvas.create_oval(
-                        canvas_x - zoomed_radius,
-                        canvas_y - zoomed_radius,
-                        canvas_x + zoomed_radius,
-                        canvas_y + zoomed_radius,
-                        fill=color,
-                    )
+        try:
+            markup = job.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load ISO template: {e}")
+            return
+        if self.image and image_path == self.image_path:
+            self.apply_markup(markup, "The loaded template")
 
-                    # Draw orientation line and store the id
-                    line_length = 15
-                    zoomed_line_length = line_length * self.zoom_level
-                    angle_rad = math.radians(min.angle)
-                    line_end_x = canvas_x + zoomed_line_length * math.cos(angle_rad)
-                    line_end_y = canvas_y - zoomed_line_length * math.sin(
-                        angle_rad
-                    )  # Inverted y-axis
-                    orientation_line_id = self.canvas.create_line(
-                        canvas_x,
-                        canvas_y,
-                        line_end_x,
-                        line_end_y,
-                        fill=color,
-                        width=2,
-                    )
+    def apply_markup(self, markup, context):
+        self.reset_minutiae()  # Clear existing minutiae
 
-                    minutiae_data = (
-                        min.x,
-                        min.y,
-                        min.angle,
-                        quality,
-                        minutiae_type,
-                        minutiae_id,
-                        orientation_line_id,
-                    )
-                    self.minutiae.append(minutiae_data)
+        # Add loaded minutiae to the list
+        for x, y, angle, quality, m_type in markup.minutiae:
+            self.add_minutiae(x, y, angle, quality, m_type)
 
-                self.update_minutiae_listbox()
-                self.update_minutiae_count_label()
+        self.update_minutiae_listbox()
+        self.update_minutiae_count_label()
 
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to load ISO template: {e}")
+        # Cores and deltas stored with the markup replace detected ones
+        if markup.singular_points is not None:
+            self.singular_points = markup.singular_points
+            self.draw_singular_points()
+
+        self.review_duplicates(context)
+
+    def open_database(self):
+        from store import AnnotationStore
+
+        path = filedialog.asksaveasfilename(
+            title="Open or create an annotation database",
+            defaultextension=".sqlite",
+            filetypes=[("SQLite databases", "*.sqlite *.db")],
+            confirmoverwrite=False,
+        )
+        if not path:
+            return
+        try:
+            store = AnnotationStore(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open database: {e}")
+            return
+        if self.store is not None:
+            self.store.close()
+        self.store = store
+        self.request_stored_markup()
+
+    def request_stored_markup(self):
+        from jobs import load_stored_markup_job
+
+        # The markup stored in the database replaces the one shown, if there is one
+        if self.store is None or not self.image_path:
+            return
+        image_path = self.image_path
+        self.run_job(
+            f"Reading {os.path.basename(image_path)}",
+            load_stored_markup_job,
+            self.store,
+            image_path,
+            callback=lambda job: self.on_stored_markup_loaded(job, image_path),
+        )
+
+    def on_stored_markup_loaded(self, job, image_path):
+        from jobs import JobCancelled
+
+        try:
+            markup = job.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to read the database: {e}")
+            return
+        if markup is not None and image_path == self.image_path:
+            self.apply_markup(markup, "The stored markup")
+
+    def store_markup(self, image_path, markup):
+        from jobs import store_markup_job
+
+        # Saved markups also go to the database, if one is open
+        if self.store is None or not image_path:
+            return
+        self.run_job(
+            f"Storing {os.path.basename(image_path)}",
+            store_markup_job,
+            self.store,
+            image_path,
+            markup,
+            callback=self.on_markup_stored,
+        )
+
+    def on_markup_stored(self, job):
+        from jobs import JobCancelled
+
+        try:
+            job.result()
+        except JobCancelled:
+            pass
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to store the markup: {e}")
 
     def save_image(self):
+        from jobs import save_overlay_job
+
         if not self.image:
             messagebox.showwarning("No Image", "No image to save.")
             return
@@ -427,69 +1870,78 @@ class FingerprintApp:
             filetypes=[("PNG files", "*.png"), ("All files", "*.*")],
         )
         if file_path:
-            try:
-                # Create a copy of the original image to draw on
-                image_to_save = self.original_image.copy().convert("RGB")
-                draw = ImageDraw.Draw(image_to_save)
-
-                # Draw minutiae on the image
-                for x, y, angle, _, m_type, _, _ in self.minutiae:
-                    # Convert from canvas coordinates to image coordinates
-                    image_x = x
-                    image_y = y
-
-                    # Determine color based on type
-                    if m_type == "ending":
-                        color = ENDING_COLOR
-                    elif m_type == "bifurcation":
-                        color = BIFURCATION_COLOR
-                    else:
-                        color = OTHER_COLOR
-
-                    # Draw the minutiae point
-                    radius = 3
-                    try:
-                        draw.ellipse(
-                            [
-                                (image_x - radius, image_y - radius),
-                                (image_x + radius, image_y + radius),
-                            ],
-                            fill=color,
-                            outline=None,
-                        )
-                    except Exception as e:
-                        print(f"Error drawing ellipse: {e}")
-
-                    # Draw the orientation line
-                    line_length = 15
-                    angle_rad = math.radians(angle)
-                    line_end_x = image_x + line_length * math.cos(angle_rad)
-                    line_end_y = image_y - line_length * math.sin(angle_rad)
-
-                    try:
-                        # Check if line end coordinates are within image bounds
-                        if (
-                            0 <= line_end_x < image_to_save.width
-                            and 0 <= line_end_y < image_to_save.height
-                        ):
-                            draw.line(
-                                [(image_x, image_y), (line_end_x, line_end_y)],
-                                fill=color,
-                                width=2,
-                            )
-                        else:
-                            print("Error: Line end coordinates are out of bounds.")
-                    except Exception as e:
-                        print(f"Error drawing line: {e}")
+            # Rendering and writing run in the background; the LUT is applied there
+            lut = None
+            if self.bake_contrast_var.get():
+                lut = self.contrast_lut(self.original_image)
+            records = [m[:5] for m in self.minutiae]
+            self.run_job(
+                f"Saving {os.path.basename(file_path)}",
+                save_overlay_job,
+                file_path,
+                self.original_image,
+                records,
+                lut,
+                callback=self.on_image_saved,
+            )
 
-                # Save the image
-                image_to_save.save(file_path)
-                messagebox.showinfo("Info", "Image saved successfully!")
+    def on_image_saved(self, job):
+        from jobs import JobCancelled
+
+        try:
+            job.result()
+            messagebox.showinfo("Info", "Image saved successfully!")
+        except JobCancelled:
+            pass
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save image: {e}")
+
+    def export_overlays(self):
+        from overlay import build_review_sheets, export_jobs, export_overlay
+
+        # Export overlays for the open folder, or ask for one
+        if self.dataset_paths:
+            image_paths = self.dataset_paths
+        else:
+            folder = filedialog.askdirectory(title="Dataset folder")
+            if not folder:
+                return
+            image_paths = scan_folder(folder)
+
+        out_dir = filedialog.askdirectory(title="Output folder for overlays")
+        if not out_dir:
+            return
+
+        jobs = export_jobs(image_paths, out_dir)
+        if not jobs:
+            messagebox.showwarning("No Annotations", "No annotated images to export.")
+            return
 
+        results = []
+
+        def on_done(future):
+            try:
+                results.append(future.result())
             except Exception as e:
-                messagebox.showerror("Error", f"Failed to save image: {e}")
+                results.append(e)
+            if len(results) < len(jobs):
+                return
+            failures = [r for r in results if isinstance(r, Exception)]
+            sheets = build_review_sheets(
+                [r for r in results if not isinstance(r, Exception)], out_dir
+            )
+            message = f"Exported {len(jobs) - len(failures)} overlays and {len(sheets)} review sheets."
+            if failures:
+                message += f" {len(failures)} image(s) failed: {failures[0]}"
+            messagebox.showinfo("Export Overlays", message)
+
+        executor = self.get_executor()
+        for job in jobs:
+            self.watch_future(executor.submit(export_overlay, *job), on_done)
 
     def reset_minutiae(self):
+        self.clear_duplicates()
+
         # Remove all minutiae from the canvas
         for _, _, _, _, _, minutiae_id, orientation_line_id in self.minutiae:
             self.canvas.delete(minutiae_id)
@@ -505,54 +1957,43 @@ class FingerprintApp:
             self.canvas.delete(circle_id)
         self.active_minutiae_circle_ids = []
 
-    def load_iso19794(self, path, format):
-        if format == "19794-2-2005":
-            with open(path, "rb") as f:
-                t = f.read()
-            magic = int.from_bytes(t[0:4], "big")
-            version = int.from_bytes(t[4:8], "big")
-            total_bytes = int.from_bytes(t[8:12], "big")
-            im_w = int.from_bytes(t[14:16], "big")
-            im_h = int.from_bytes(t[16:18], "big")
-            resolution_x = int.from_bytes(t[18:20], "big")
-            resolution_y = int.from_bytes(t[20:22], "big")
-            f_count = int.from_bytes(t[22:23], "big")
-            reserved_byte = int.from_bytes(t[23:24], "big")
-            fingerprint_quality = int.from_bytes(t[26:27], "big")
-            minutiae_num = int.from_bytes(t[27:28], "big")
-            minutiaes = []
-            for i in range(minutiae_num):
-                x = 28 + 6 * i
-                min_type = (t[x] >> 6) & 0x3
-                min_x = int.from_bytes([t[x] & 0x3F, t[x + 1]], "big")
-                min_y = int.from_bytes(t[x + 2 : x + 4], "big")
-                angle = round((t[x + 4] / 256 * 360)) % 360
-                min_quality = t[x + 5]
-                minutiaes.append(Minutiae(min_type, min_x, min_y, angle, min_quality))
-            return minutiaes
-
     def mark_minutiae(self, event):
         if not self.image:
             return
 
+        from overlay import BIFURCATION_COLOR, ENDING_COLOR, OTHER_COLOR
+        from quality import quality_at, quality_label
+
         # Convert canvas coordinates to image coordinates
         canvas_x = self.canvas.canvasx(event.x)
         canvas_y = self.canvas.canvasy(event.y)
         image_x = int(canvas_x / self.zoom_level)
         image_y = int(canvas_y / self.zoom_level)
+        m_type = self.current_minutiae_type
+
+        # Snap to the nearest ridge feature and take its type as a suggestion
+        if self.snap_var.get() and self.ridge_structure is not None:
+            snapped = self.ridge_structure.snap(image_x, image_y)
+            if snapped:
+                image_x, image_y, m_type = snapped
+                canvas_x = image_x * self.zoom_level
+                canvas_y = image_y * self.zoom_level
 
         # Check if the point is within the image boundaries
         if 0 <= image_x < self.image.width and 0 <= image_y < self.image.height:
-            # Get angle from input
-            try:
-                angle = int(self.angle_entry.get())
-            except ValueError:
-                angle = 0  # Default angle if input is invalid
+            # Get angle from the ridge structure, or from input until it is ready
+            if self.auto_angle_var.get() and self.ridge_structure is not None:
+                angle = self.ridge_structure.angle_at(image_x, image_y)
+            else:
+                try:
+                    angle = int(self.angle_entry.get())
+                except ValueError:
+                    angle = 0  # Default angle if input is invalid
 
             # Determine color based on type
-            if self.current_minutiae_type == "ending":
+            if m_type == "ending":
                 color = ENDING_COLOR
-            elif self.current_minutiae_type == "bifurcation":
+            elif m_type == "bifurcation":
                 color = BIFURCATION_COLOR
             else:
                 color = OTHER_COLOR
@@ -580,13 +2021,24 @@ class FingerprintApp:
                 canvas_x, canvas_y, line_end_x, line_end_y, fill=color, width=2
             )
 
+            # Quality from the quality map unless one is chosen in the dropdown
+            quality = self.current_quality
+            if (
+                quality == "not set"
+                and self.auto_quality_var.get()
+                and self.quality_map is not None
+            ):
+                value = quality_at(self.quality_map[0], image_x, image_y)
+                if value is not None:
+                    quality = quality_label(value)
+
             # Add minutiae data to the list
             minutiae_data = (
                 image_x,
                 image_y,
                 angle,
-                self.current_quality,
-                self.current_minutiae_type,
+                quality,
+                m_type,
                 minutiae_id,
                 orientation_line_id,
             )
@@ -595,11 +2047,6 @@ class FingerprintApp:
             # Update the minutiae listbox
             self.update_minutiae_listbox()
             self.update_minutiae_count_label()
-
-            # Print minutiae data to console
-            print(
-                f"Minutiae added: Type={self.current_minutiae_type}, X={image_x}, Y={image_y}, Angle={angle}, Quality={self.current_quality}"
-            )
         else:
             messagebox.showwarning(
                 "Out of Bounds", "Cannot add minutiae outside the image."
@@ -612,6 +2059,7 @@ class FingerprintApp:
     def update_quality(self, quality):
         self.current_quality = quality
 
+    @traced(category="render")
     def update_minutiae_listbox(self):
         self.minutiae_list.delete(0, tk.END)
         for (
@@ -633,13 +2081,16 @@ class FingerprintApp:
             messagebox.showwarning("No Minutiae", "No minutiae to save.")
             return
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".txt", filetypes=[("Text files", "*.txt")]
+            defaultextension=".txt",
+            filetypes=[("Text files", "*.txt")],
+            **self.annotation_dialog_options(".txt"),
         )
         if file_path:
             try:
-                with open(file_path, "w") as f:
-                    for x, y, angle, quality, m_type, _, _ in self.minutiae:
-                        f.write(f"{m_type},{x},{y},{angle},{quality}\n")
+                markup = self.markup()
+                markup.save_txt(file_path)
+                self.store_markup(self.image_path, markup)
+                self.refresh_thumbnail_summary()
                 messagebox.showinfo("Info", "Minutiae saved successfully!")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save minutiae: {e}")
@@ -666,16 +2117,19 @@ class FingerprintApp:
         self.display_image()
         self.redraw_minutiae()
 
+    @traced(category="render")
     def display_image(self):
         if not self.image:
             return
 
+        from PIL import ImageTk
+
         # Calculate the scaled size of the image
         image_width = int(self.image.width * self.zoom_level)
         image_height = int(self.image.height * self.zoom_level)
 
         # Resize the image
-        self.zoomed_image = self.original_image.resize(
+        self.zoomed_image = self.display_source().resize(
             (image_width, image_height), Image.LANCZOS
         )
         self.photo = ImageTk.PhotoImage(self.zoomed_image)
@@ -699,11 +2153,212 @@ class FingerprintApp:
                 max(image_height, self.canvas_height),
             )
         )
+        self.schedule_viewport_redraw()
+
+    def scroll_canvas_x(self, *args):
+        self.canvas.xview(*args)
+        self.schedule_viewport_redraw()
+
+    def scroll_canvas_y(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_viewport_redraw()
+
+    def contrast_lut(self, image):
+        # Returns the lookup table of the contrast controls, or None if they are neutral
+        brightness = self.brightness_var.get()
+        contrast = self.contrast_var.get()
+        gamma = self.gamma_var.get()
+        equalize = self.equalize_var.get()
+        if is_identity(brightness, contrast, gamma, equalize):
+            return None
+
+        histogram = None
+        if equalize:
+            if (
+                self.contrast_histogram is None
+                or self.contrast_histogram[0] is not image
+            ):
+                self.contrast_histogram = (image, image.histogram())
+            histogram = self.contrast_histogram[1]
+        return build_lut(brightness, contrast, gamma, histogram)
+
+    def reset_contrast(self):
+        self.brightness_var.set(DEFAULT_BRIGHTNESS)
+        self.contrast_var.set(DEFAULT_CONTRAST)
+        self.gamma_var.set(DEFAULT_GAMMA)
+        self.equalize_var.set(False)
+        self.schedule_viewport_redraw()
+
+    def toggle_tracing(self):
+        tracing.enable(self.trace_var.get())
+        # Quick toggles must not leave a second update loop running
+        if self.hud_update is not None:
+            self.master.after_cancel(self.hud_update)
+        self.update_hud()
+
+    def update_hud(self):
+        # Last duration of each hot path and the canvas item count, top left
+        self.hud_update = None
+        self.canvas.delete("hud")
+        if not tracing.enabled:
+            return
+        lines = []
+        for name in HUD_SPANS:
+            duration = tracing.latest(name)
+            if duration is not None:
+                lines.append(f"{name}: {duration:.1f} ms")
+        lines.append(f"canvas items: {len(self.canvas.find_all())}")
+        self.canvas.create_text(
+            self.canvas.canvasx(5),
+            self.canvas.canvasy(5),
+            text="\n".join(lines),
+            anchor=tk.NW,
+            fill=HUD_COLOR,
+            font=("TkFixedFont", 9),
+            tags="hud",
+        )
+        self.hud_update = self.master.after(HUD_INTERVAL, self.update_hud)
+
+    def toggle_recording(self):
+        from recording import EventRecorder
+
+        if self.record_var.get():
+            if not self.image:
+                messagebox.showwarning("No Image", "Please load an image first.")
+                self.record_var.set(False)
+                return
+            # The session starts from the current image, markup and zoom
+            self.recorder = EventRecorder(
+                {
+                    "image": os.path.abspath(self.image_path),
+                    "zoom": self.zoom_level,
+                    "editor_mode": self.editor_mode,
+                    "minutiae": [m[:5] for m in self.minutiae],
+                    "singular_points": self.singular_points,
+                },
+                lambda: (self.canvas.xview()[0], self.canvas.yview()[0]),
+            )
+            for widget, sequence, name in RECORDED_BINDINGS:
+                getattr(self, widget).bind(
+                    sequence, self.recorder.wrap(name, getattr(self, name))
+                )
+            return
+
+        # Restore the plain bindings, then offer to save the session
+        for widget, sequence, name in RECORDED_BINDINGS:
+            getattr(self, widget).bind(sequence, getattr(self, name))
+        recorder, self.recorder = self.recorder, None
+        if not recorder.events:
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Session recordings", "*.json")],
+        )
+        if path:
+            try:
+                recorder.save(path)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save recording: {e}")
+
+    def export_trace(self):
+        if not tracing.summary():
+            messagebox.showwarning(
+                "No Trace", "Enable Trace HUD and use the application first."
+            )
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace files", "*.json")],
+        )
+        if path:
+            try:
+                tracing.export_chrome_trace(path)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to export trace: {e}")
+
+    def schedule_viewport_redraw(self, *args):
+        # Coalesce slider, scroll and resize events into one redraw per idle cycle
+        if not self.viewport_redraw_pending:
+            self.viewport_redraw_pending = True
+            self.master.after_idle(self.draw_viewport)
+
+    @traced(category="render")
+    def draw_viewport(self):
+        # Only the visible crop of zoomed_image goes through the lookup table, so the
+        # cost per frame depends on the window size and not on the scan size
+        self.viewport_redraw_pending = False
+        self.draw_heatmap()
+        lut = self.contrast_lut(self.display_source()) if self.image else None
+        left = max(int(self.canvas.canvasx(0)), 0)
+        top = max(int(self.canvas.canvasy(0)), 0)
+        if lut is not None:
+            right = min(left + self.canvas.winfo_width(), self.zoomed_image.width)
+            bottom = min(top + self.canvas.winfo_height(), self.zoomed_image.height)
+        if lut is None or right <= left or bottom <= top:
+            if self.viewport_image_id:
+                self.canvas.delete(self.viewport_image_id)
+                self.viewport_image_id = None
+            self.viewport_photo = None
+            return
+
+        from PIL import ImageTk
+
+        region = self.zoomed_image.crop((left, top, right, bottom))
+        self.viewport_photo = ImageTk.PhotoImage(apply_lut(region, lut))
+        if self.viewport_image_id:
+            self.canvas.coords(self.viewport_image_id, left, top)
+            self.canvas.itemconfig(self.viewport_image_id, image=self.viewport_photo)
+        else:
+            self.viewport_image_id = self.canvas.create_image(
+                left, top, anchor=tk.NW, image=self.viewport_photo
+            )
+            # Keep the adjusted region above the image but below the minutiae
+            self.canvas.tag_raise(self.viewport_image_id, self.image_id)
+
+    def draw_heatmap(self):
+        # The heatmap has one pixel per block and is scaled up for the visible
+        # region only, like the contrast viewport
+        show = self.image and self.heatmap_var.get() and self.heatmap_image is not None
+        if show:
+            left = max(int(self.canvas.canvasx(0)), 0)
+            top = max(int(self.canvas.canvasy(0)), 0)
+            right = min(left + self.canvas.winfo_width(), self.zoomed_image.width)
+            bottom = min(top + self.canvas.winfo_height(), self.zoomed_image.height)
+        if not show or right <= left or bottom <= top:
+            if self.heatmap_image_id:
+                self.canvas.delete(self.heatmap_image_id)
+                self.heatmap_image_id = None
+            self.heatmap_photo = None
+            return
+
+        from PIL import ImageTk
+        from enhance import BLOCK_SIZE
 
+        scale = self.zoom_level * BLOCK_SIZE
+        region = self.heatmap_image.resize(
+            (right - left, bottom - top),
+            Image.NEAREST,
+            box=(left / scale, top / scale, right / scale, bottom / scale),
+        )
+        self.heatmap_photo = ImageTk.PhotoImage(region)
+        if self.heatmap_image_id:
+            self.canvas.coords(self.heatmap_image_id, left, top)
+            self.canvas.itemconfig(self.heatmap_image_id, image=self.heatmap_photo)
+        else:
+            self.heatmap_image_id = self.canvas.create_image(
+                left, top, anchor=tk.NW, image=self.heatmap_photo
+            )
+            self.canvas.tag_raise(
+                self.heatmap_image_id, self.viewport_image_id or self.image_id
+            )
+
+    @traced(category="render")
     def redraw_minutiae(self):
         if not self.image:
             return
 
+        from overlay import BIFURCATION_COLOR, ENDING_COLOR, OTHER_COLOR
+
         for (
             i,
             (
@@ -765,6 +2420,11 @@ class FingerprintApp:
                     self.canvas.delete(self.active_minutiae_circle_ids[i])
                     self.active_minutiae_circle_ids[i] = None
 
+        self.redraw_suggestions()
+        self.draw_comparison()
+        self.draw_duplicates()
+        self.draw_singular_points()
+
     def draw_active_minutiae_circle(self, x, y, index):
         # Remove the previous circle if it exists for this index
         if (
@@ -825,6 +2485,9 @@ class FingerprintApp:
                 orientation_line_id,
             ) = self.minutiae[index]
 
+            if self.edit_frame is None:
+                self.create_edit_widgets()
+
             # Set the current values to the edit widgets
             self.edit_type_var.set(m_type)
             self.edit_x_entry.delete(0, tk.END)
@@ -840,7 +2503,7 @@ class FingerprintApp:
 
             # Store the index of the minutiae being edited
             self.editing_index = index
-        else:
+        elif self.edit_frame is not None:
             # Hide edit frame if multiple minutiae are selected
             self.edit_frame.pack_forget()
 
@@ -1068,9 +2731,13 @@ class FingerprintApp:
             canvas_x = self.canvas.canvasx(event.x)
             canvas_y = self.canvas.canvasy(event.y)
 
+            # Cores and deltas under the click are dragged instead of minutiae
+            self.dragged_singular_index = self.find_singular_point(canvas_x, canvas_y)
+            if self.dragged_singular_index is not None:
+                return
+
             # Find the closest minutiae point
             closest_index = self.find_closest_minutiae(canvas_x, canvas_y)
-            print("closest_index", closest_index)
 
             if closest_index is not None:
                 x, y, angle, _, _, minutiae_id, orientation_line_id = self.minutiae[
@@ -1194,6 +2861,15 @@ class FingerprintApp:
             self.mark_minutiae(event)
 
     def on_canvas_drag(self, event):
+        if self.editor_mode and self.dragged_singular_index is not None:
+            # Move the dragged core or delta
+            x = int(self.canvas.canvasx(event.x) / self.zoom_level)
+            y = int(self.canvas.canvasy(event.y) / self.zoom_level)
+            if 0 <= x < self.image.width and 0 <= y < self.image.height:
+                kind = self.singular_points[self.dragged_singular_index][2]
+                self.singular_points[self.dragged_singular_index] = (x, y, kind)
+                self.draw_singular_points()
+            return
         if self.editor_mode and self.dragged_minutiae_index is not None:
             canvas_x = self.canvas.canvasx(event.x)
             canvas_y = self.canvas.canvasy(event.y)
@@ -1271,6 +2947,7 @@ class FingerprintApp:
     def on_canvas_release(self, event):
         if self.editor_mode:
             self.dragged_minutiae_index = None
+            self.dragged_singular_index = None
 
     def on_alt_press(self, event):
         self.alt_pressed = True
@@ -1278,6 +2955,7 @@ class FingerprintApp:
     def on_alt_release(self, event):
         self.alt_pressed = False
 
+    @traced("hit_test", "hit-test")
     def find_closest_minutiae(self, canvas_x, canvas_y):
         min_distance = float("inf")
         closest_index = None
@@ -1330,6 +3008,8 @@ class FingerprintApp:
             self.image_name_label.config(text="")
 
     def save_iso_template(self):
+        from jobs import save_iso_job
+
         if not self.image:
             messagebox.showwarning("No Image", "Please load an image first.")
             return
@@ -1337,71 +3017,60 @@ class FingerprintApp:
         file_path = filedialog.asksaveasfilename(
             defaultextension=".iso",
             filetypes=[("ISO Template files", "*.iso *.ist")],
+            **self.annotation_dialog_options(".iso"),
         )
         if file_path:
-            try:
-                self.to_iso19794(file_path)
-                messagebox.showinfo("Info", "ISO template saved successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to save ISO template: {e}")
+            # Stacked duplicates would end up in the ISO record
+            if (
+                self.review_duplicates("The template to save", allow_cancel=True)
+                is None
+            ):
+                return
+            # Ridge counts need the ridge structure, computed first if missing
+            image_path = self.image_path
+            markup = self.markup()
+            cached = None
+            if self.ridge_structure is None and image_path:
+                cached = self.structure_cache.lookup(image_path)
+            self.run_job(
+                f"Saving {os.path.basename(file_path)}",
+                save_iso_job,
+                file_path,
+                markup,
+                self.ridge_structure,
+                image_path,
+                cached,
+                self.get_executor(),
+                callback=lambda job: self.on_iso_template_saved(
+                    job, image_path, markup
+                ),
+            )
 
-    def to_iso19794(self, isopath):
-        if not self.image:
-            messagebox.showwarning("No Image", "Please load an image first.")
-            return
+    def on_iso_template_saved(self, job, image_path, markup):
+        from jobs import JobCancelled
 
+        try:
+            structure, result = job.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save ISO template: {e}")
+            return
+        self.store_markup(image_path, markup)
+        if result is not None:
+            self.structure_cache.finished(result)
+        if structure is not None and image_path == self.image_path:
+            if self.ridge_structure is None:
+                self.set_ridge_structure(structure)
+        self.refresh_thumbnail_summary()
+        messagebox.showinfo("Info", "ISO template saved successfully!")
+
+    def markup(self):
+        from markup import Markup
+
+        # Headless copy of the current markup for the TXT and ISO codecs
         width, height = self.image.size
-        b_array = bytearray()
-        minutiae_num = len(self.minutiae)
-        totalbytes = minutiae_num * 6 + 28 + 2
-
-        b_array = bytearray(b"FMR\x00 20\x00")
-        b_array += totalbytes.to_bytes(4, "big")
-        b_array += bytearray(b"\x00\x00")
-        b_array += width.to_bytes(2, "big")
-        b_array += height.to_bytes(2, "big")
-        b_array += bytearray(
-            b"\x00\xc5\x00\xc5\x01\x00\x00\x00d"
-        )  # resolution x, resolution y, fingerprint count, reserved
-        b_array += minutiae_num.to_bytes(1, "big")
-        byte_list = [0, 0, 0, 0, 0, 0]
-        for line in self.minutiae:
-            x, y, angle, quality, m_type, _, _ = line
-            quality_map = {
-                "not set": 0,
-                "poor": 20,
-                "fair": 40,
-                "good": 60,
-                "very good": 80,
-                "excellent": 100,
-            }
-
-            # Check if quality is already a digit
-            try:
-                quality_val = int(quality)
-            except ValueError:
-                quality_val = quality_map.get(quality, 0)  # Use map if not a digit
-
-            if m_type == "ending":
-                min_type = 1
-            elif m_type == "bifurcation":
-                min_type = 2
-            else:
-                min_type = 0
-
-            byte_list[1] = x % 256
-            byte_list[0] = x // 256 + min_type * 64
-            byte_list[2] = y // 256
-            byte_list[3] = y % 256
-            byte_list[4] = round(angle / 360 * 256) % 256
-            byte_list[5] = quality_val
-            b_array += bytearray(byte_list)
-
-        zero = 0
-        b_array += zero.to_bytes(2, "big")
-
-        with open(isopath, "wb") as istfile:
-            istfile.write(b_array)
+        return Markup(width, height, self.minutiae, self.singular_points)
 
     def reset_app(self):
         """Resets the application to its initial state."""
@@ -1412,14 +3081,27 @@ class FingerprintApp:
             "Are you sure you want to reset the application? This will clear all data.",
         ):
             self.reset_minutiae()  # Reuse the existing reset_minutiae method
+            self.cancel_jobs()
+            self.open_job = None
 
             # Clear the image
             if hasattr(self, "image_id"):
                 self.canvas.delete(self.image_id)
                 self.image_id = None
+            if self.viewport_image_id:
+                self.canvas.delete(self.viewport_image_id)
+                self.viewport_image_id = None
+                self.viewport_photo = None
             self.image = None
             self.photo = None
             self.original_image = None
+            self.enhanced_image = None
+            self.clear_suggestions()
+            self.suggestion_job = None
+            self.clear_comparison()
+            self.ridge_structure = None
+            self.clear_singular_points()
+            self.set_quality_map(None)
 
             # Reset zoom and other variables
             self.zoom_level = 1.0
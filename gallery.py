@@ -0,0 +1,302 @@
+"""Indexed 1:N search of a template against a gallery folder.
+
+Each template is reduced to the set of its quantized minutia triplets (see
+matching.descriptors) and an inverted index maps every triplet key to the
+templates containing it. A search only reads the posting lists of the
+query's keys, ranks the templates by shared keys, and runs the full matcher
+on the best candidates alone. The index is built in parallel over chunks of
+templates and stored as an .npz file in the cache directory, with the size
+and mtime of every template. Chunks holding templates changed since then
+are re-indexed on their own; adding or removing templates renumbers them
+and rebuilds the whole index.
+"""
+
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from annotations import ISO_EXTENSIONS, read_template
+from cache import cache_path
+from matching import NEIGHBOURS, _arrays, descriptors, match
+
+GALLERY_EXTENSIONS = (".txt",) + ISO_EXTENSIONS
+INDEX_VERSION = 2
+
+DISTANCE_STEP = 10.0  # Pixels per distance bin of a triplet key
+ANGLE_STEPS = 12  # Direction and angle bins over 360 degrees
+KEY_BITS = 6  # Bits per quantized component, distances are capped to fit
+CHUNK_SIZE = 500  # Templates per indexing job
+CANDIDATES = 100  # Templates passed on to the full matcher
+TOP_K = 10
+
+
+def scan_gallery(folder):
+    """Returns the sorted paths of all templates in a folder."""
+    return sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.lower().endswith(GALLERY_EXTENSIONS)
+    )
+
+
+def triplet_keys(template):
+    """Returns the unique quantized triplet keys of a template as int64."""
+    xs, ys, angles = _arrays(template)
+    if len(xs) <= NEIGHBOURS:
+        return np.zeros(0, dtype=np.int64)
+    desc = descriptors(xs, ys, angles)
+
+    limit = (1 << KEY_BITS) - 1
+    distance = np.minimum(np.floor(desc[..., 0] / DISTANCE_STEP), limit)
+    step = 2 * np.pi / ANGLE_STEPS
+    direction = np.floor((desc[..., 1] % (2 * np.pi)) / step) % ANGLE_STEPS
+    angle = np.floor((desc[..., 2] % (2 * np.pi)) / step) % ANGLE_STEPS
+    # One code per neighbour, sorted so that the key does not depend on
+    # which neighbour happened to be nearer
+    codes = (distance * (1 << KEY_BITS) + direction) * (1 << KEY_BITS) + angle
+    codes = np.sort(codes.astype(np.int64), axis=1)
+    keys = np.zeros(len(codes), dtype=np.int64)
+    for k in range(NEIGHBOURS):
+        keys = (keys << (3 * KEY_BITS)) | codes[:, k]
+    return np.unique(keys)
+
+
+def index_chunk(paths, first_id):
+    """Computes the postings of a chunk of templates. Runs inside a worker process.
+
+    Returns (keys, template ids, minutiae counts); unreadable templates are
+    left out of the postings and get a count of 0.
+    """
+    keys, ids, sizes = [], [], []
+    for offset, path in enumerate(paths):
+        try:
+            template = read_template(path)
+        except (OSError, ValueError, IndexError):
+            sizes.append(0)
+            continue
+        template_keys = triplet_keys(template)
+        keys.append(template_keys)
+        ids.append(np.full(len(template_keys), first_id + offset, dtype=np.int32))
+        sizes.append(len(template))
+    if not keys:
+        return np.zeros(0, np.int64), np.zeros(0, np.int32), np.array(sizes)
+    return np.concatenate(keys), np.concatenate(ids), np.array(sizes)
+
+
+def file_stats(paths):
+    """Returns (sizes, mtimes in ns) of files as int64 arrays, -1 for missing files."""
+    stats = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stats.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            stats.append((-1, -1))
+    table = np.array(stats, dtype=np.int64).reshape(-1, 2)
+    return table[:, 0].copy(), table[:, 1].copy()
+
+
+def index_jobs(paths):
+    """Splits gallery paths into (paths, first id) indexing jobs."""
+    return [
+        (paths[first : first + CHUNK_SIZE], first)
+        for first in range(0, len(paths), CHUNK_SIZE)
+    ]
+
+
+class GalleryIndex:
+    """Inverted index from triplet keys to gallery templates.
+
+    Postings are stored CSR style: ids[offsets[i]:offsets[i + 1]] are the
+    templates containing keys[i].
+    """
+
+    def __init__(self, paths, keys, offsets, ids, sizes, stats):
+        self.paths = list(paths)
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+        self.sizes = sizes
+        self.stats = stats  # file_stats of the templates when they were indexed
+
+    @classmethod
+    def from_postings(cls, paths, keys, ids, sizes, stats):
+        order = np.argsort(keys, kind="stable")
+        keys, ids = keys[order], ids[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys))
+        return cls(paths, unique_keys, offsets, ids, sizes, stats)
+
+    @classmethod
+    def build(cls, paths, chunk_results, stats):
+        """Merges the index_chunk results of all jobs into one index."""
+        return cls.from_postings(
+            paths,
+            np.concatenate([r[0] for r in chunk_results]),
+            np.concatenate([r[1] for r in chunk_results]),
+            np.concatenate([r[2] for r in chunk_results]),
+            stats,
+        )
+
+    def stale_jobs(self, paths, stats):
+        """Returns the index_jobs of the chunks with templates changed since
+        indexing, or None if templates were added or removed."""
+        if paths != self.paths:
+            return None
+        changed = (stats[0] != self.stats[0]) | (stats[1] != self.stats[1])
+        return [
+            (chunk, first)
+            for chunk, first in index_jobs(paths)
+            if changed[first : first + len(chunk)].any()
+        ]
+
+    def update(self, jobs, chunk_results, stats):
+        """Returns the index with the postings of re-indexed chunks replaced."""
+        keys = np.repeat(self.keys, np.diff(self.offsets))
+        keep = np.ones(len(self.ids), dtype=bool)
+        sizes = self.sizes.copy()
+        for (chunk, first), result in zip(jobs, chunk_results):
+            keep &= (self.ids < first) | (self.ids >= first + len(chunk))
+            sizes[first : first + len(chunk)] = result[2]
+        return self.from_postings(
+            self.paths,
+            np.concatenate([keys[keep]] + [r[0] for r in chunk_results]),
+            np.concatenate([self.ids[keep]] + [r[1] for r in chunk_results]),
+            sizes,
+            stats,
+        )
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=INDEX_VERSION,
+            paths=np.array(self.paths, dtype=str),
+            keys=self.keys,
+            offsets=self.offsets,
+            ids=self.ids,
+            sizes=self.sizes,
+            file_sizes=self.stats[0],
+            file_mtimes=self.stats[1],
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError("Gallery index was built by another version")
+            return cls(
+                data["paths"].tolist(),
+                data["keys"],
+                data["offsets"],
+                data["ids"],
+                data["sizes"],
+                (data["file_sizes"], data["file_mtimes"]),
+            )
+
+    def candidates(self, template, count=CANDIDATES):
+        """Returns [(template id, key votes)] for the most promising templates.
+
+        Only the posting lists of the query's own keys are read.
+        """
+        query = triplet_keys(template)
+        if not len(query) or not len(self.keys):
+            return []
+        pos = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        pos = pos[self.keys[pos] == query]
+        starts, ends = self.offsets[pos], self.offsets[pos + 1]
+        lengths = ends - starts
+        gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        posted = self.ids[gather + np.arange(lengths.sum())]
+
+        ids, votes = np.unique(posted, return_counts=True)
+        # Large templates share more keys by chance; normalize by their size
+        norm = votes / np.sqrt(np.maximum(self.sizes[ids], 1) * len(query))
+        best = np.argsort(norm)[::-1][:count]
+        return list(zip(ids[best].tolist(), votes[best].tolist()))
+
+    def search(self, template, top_k=TOP_K, candidates=CANDIDATES):
+        """Returns [(path, score, MatchResult)] of the top_k most similar templates."""
+        hits = []
+        for template_id, _ in self.candidates(template, candidates):
+            path = self.paths[template_id]
+            try:
+                result = match(template, read_template(path))
+            except (OSError, ValueError, IndexError):
+                continue
+            hits.append((path, result.score, result))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+
+def gallery_index_path(folder):
+    name = hashlib.sha1(os.path.abspath(folder).encode("utf-8")).hexdigest()
+    return cache_path("gallery", f"{name}.npz")
+
+
+def load_gallery_index(folder):
+    """Returns the stored index of a folder, possibly out of date, or None."""
+    try:
+        return GalleryIndex.load(gallery_index_path(folder))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def refresh_jobs(index, folder):
+    """Returns (paths, stats, index_jobs still to run) to bring an index up to date.
+
+    Templates are stat'ed before they are read, so a template changed while
+    it is indexed is indexed again next time.
+    """
+    paths = scan_gallery(folder)
+    stats = file_stats(paths)
+    jobs = index.stale_jobs(paths, stats) if index is not None else None
+    return paths, stats, index_jobs(paths) if jobs is None else jobs
+
+
+def refresh_index(index, paths, stats, jobs, chunk_results):
+    """Returns the up to date index, given the results of the refresh_jobs."""
+    if index is None or index.paths != paths:
+        return GalleryIndex.build(paths, chunk_results, stats)
+    return index.update(jobs, chunk_results, stats)
+
+
+def build_gallery_index(folder, workers=None, index=None):
+    """Brings the index of a folder up to date and stores it, using a process pool.
+
+    Only the chunks of changed templates of `index` are indexed again.
+    """
+    paths, stats, jobs = refresh_jobs(index, folder)
+    if index is not None and not jobs:
+        return index
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(index_chunk, *job) for job in jobs]
+        results = [future.result() for future in futures]
+    index = refresh_index(index, paths, stats, jobs, results)
+    index.save(gallery_index_path(folder))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a template gallery.")
+    parser.add_argument("gallery", help="Folder with .txt/.iso templates")
+    parser.add_argument("template", nargs="?", help="Template to search for")
+    parser.add_argument("--top", type=int, default=TOP_K)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    index = None if args.rebuild else load_gallery_index(args.gallery)
+    index = build_gallery_index(args.gallery, args.workers, index)
+    print(f"Index of {len(index.paths)} templates, {len(index.keys)} keys")
+    if args.template:
+        for path, score, result in index.search(read_template(args.template), args.top):
+            print(f"{score:.3f}  {len(result.pairs):4d} pairs  {path}")
+
+
+if __name__ == "__main__":
+    main()
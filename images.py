@@ -0,0 +1,17 @@
+"""Opening of the image files of the application.
+
+PIL only reads WSQ, the usual format of scanned fingerprints, once
+wsq_decoder has registered it, and wsq_decoder needs NumPy. Loaders open
+images through open_image, which registers the format on first use, so
+modules that may open an image stay quick to import.
+"""
+
+from PIL import Image
+
+
+def open_image(fp):
+    """Image.open with WSQ support; `fp` is a path or a binary file object."""
+    import wsq_decoder
+
+    wsq_decoder.register()
+    return Image.open(fp)
@@ -0,0 +1,217 @@
+"""Background jobs with progress, cancellation and clean partial output.
+
+Jobs run on a small thread pool so that reading and writing files, and
+waiting for the process pool to finish heavy computations, never block the
+Tk mainloop. A job function receives its Job as first argument to report
+progress, which is also where a cancelled job stops. Files are written
+through partial_output, so a job that fails or is cancelled leaves no half
+written file behind. The application polls the job futures from the
+mainloop like any other background work. Nothing here imports tkinter.
+"""
+
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from contrast import apply_lut
+from images import open_image
+from markup import Markup
+from orientation import read_structure, structure_file
+from overlay import render_overlay
+from plugins import column_records, plugin_name, run_extractor
+
+JOB_WORKERS = 2
+WAIT_INTERVAL = 0.1  # Seconds between cancellation checks while waiting
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function, and by Job.result, once the job is cancelled."""
+
+
+class Job:
+    """One background operation with its progress and cancellation flag."""
+
+    def __init__(self, name, fn, args):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.progress = 0.0  # 0 ... 1
+        self.message = name  # What the job is doing right now
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.waiting = None  # Future of another executor the job waits for
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        self.check()
+        return self.fn(self, *self.args)
+
+    def report(self, progress, message=None):
+        """Updates the progress. Raises JobCancelled if the job was cancelled."""
+        self.progress = progress
+        if message is not None:
+            self.message = message
+        self.check()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+        waiting = self.waiting
+        if waiting is not None:
+            waiting.cancel()
+
+    def wait(self, future):
+        """Returns the result of a future of another executor, e.g. the process pool.
+
+        Cancelling the job cancels the future too, if it has not started yet.
+        """
+        self.waiting = future
+        try:
+            while not wait([future], timeout=WAIT_INTERVAL).done:
+                self.check()
+            return future.result()
+        except CancelledError:
+            raise JobCancelled(self.name)
+        finally:
+            self.waiting = None
+
+    def result(self):
+        """Returns the result of the finished job, raising its exception if it failed."""
+        if self.cancelled:
+            raise JobCancelled(self.name)
+        try:
+            return self.future.result()
+        except CancelledError:
+            raise JobCancelled(self.name)
+
+
+class JobQueue:
+    """Runs jobs on a thread pool and keeps track of the unfinished ones."""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self.jobs = []
+
+    def submit(self, name, fn, *args):
+        """Starts fn(job, *args) in the background and returns its Job."""
+        job = Job(name, fn, args)
+        job.future = self.executor.submit(job.run)
+        self.jobs.append(job)
+        return job
+
+    def active(self):
+        """Returns the jobs that are queued or running."""
+        self.jobs = [job for job in self.jobs if not job.future.done()]
+        return self.jobs
+
+    def cancel_all(self):
+        for job in self.active():
+            job.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def partial_output(path, job=None):
+    """Yields a temporary path that replaces `path` once the block succeeds.
+
+    The temporary file keeps the extension, so writers choosing the format
+    by extension still work. On an error, or if `job` was cancelled in the
+    meantime, it is removed and `path` is left untouched.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{os.getpid()}.{threading.get_ident()}.part{ext}"
+    try:
+        yield tmp_path
+        if job is not None:
+            job.check()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# --- Jobs of the application ---
+
+
+def load_image_job(job, path):
+    """Decodes an image file completely, so the mainloop only has to show it."""
+    job.report(0.0, f"Loading {os.path.basename(path)}")
+    with open_image(path) as image:
+        image.load()
+        loaded = image.copy()
+    job.report(1.0)
+    return loaded
+
+
+def load_markup_job(job, path):
+    job.report(0.0, f"Loading {os.path.basename(path)}")
+    return Markup.load(path)
+
+
+def load_stored_markup_job(job, store, image_path):
+    job.report(0.0, f"Reading {os.path.basename(image_path)} from the database")
+    return store.get(image_path)
+
+
+def store_markup_job(job, store, image_path, markup):
+    job.report(0.0, f"Storing {os.path.basename(image_path)} in the database")
+    store.put(image_path, markup)
+
+
+def save_overlay_job(job, path, image, records, lut=None):
+    """Renders the minutiae onto an image and writes it to `path`."""
+    job.report(0.0, "Rendering overlay")
+    if lut is not None:
+        image = apply_lut(image, lut)
+    overlay = render_overlay(image, records, supersample=2)
+    job.report(0.8, f"Writing {os.path.basename(path)}")
+    with partial_output(path, job) as tmp_path:
+        overlay.save(tmp_path)
+
+
+def plugin_job(job, path, image):
+    """Runs an extractor plugin on an image. Returns its minutiae as records."""
+    job.report(0.0, f"Running {plugin_name(path)}")
+    return column_records(run_extractor(path, image, check=job.check))
+
+
+def save_iso_job(job, path, markup, structure, image_path, cached, executor):
+    """Writes a markup as an ISO template with ridge counts.
+
+    Without a RidgeStructure, the one of the image is read from `cached`
+    or computed in the process pool first. Returns (structure, structure_file
+    result or None if nothing was computed); the structure is None if it
+    could not be computed and the template was saved without ridge counts.
+    """
+    result = None
+    if structure is None and image_path:
+        job.report(0.0, "Computing ridge structure")
+        try:
+            if cached is None:
+                result = job.wait(executor.submit(structure_file, image_path))
+                cached = result[4]
+            structure = read_structure(cached)
+        except JobCancelled:
+            raise
+        except Exception:
+            structure = None  # Saved without ridge counts
+    if markup.singular_points is None and structure is not None:
+        # Detected cores and deltas, as the application shows them
+        markup.singular_points = [tuple(p) for p in structure.singular.tolist()]
+    job.report(0.8, f"Writing {os.path.basename(path)}")
+    with partial_output(path, job) as tmp_path:
+        markup.save_iso(tmp_path, structure)
+    return structure, result
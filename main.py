@@ -1,9 +1,28 @@
+import time
+
+STARTED = time.perf_counter()  # Before the GUI modules are imported
+
+import argparse
 import tkinter as tk
 from fingeprint import FingerprintApp
 
 def main():
+    parser = argparse.ArgumentParser(description="Mark minutiae on fingerprint images.")
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        help="Print the milliseconds to the first interactive frame and quit",
+    )
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = FingerprintApp(root)
+    app = FingerprintApp(root, restore=not args.startup_time)
+    if args.startup_time:
+        # The first frame is drawn once the pending window events are handled
+        root.update()
+        print(f"{(time.perf_counter() - STARTED) * 1000:.1f}")
+        app.on_close()
+        return
     root.mainloop()
 
 if __name__ == "__main__":
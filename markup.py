@@ -0,0 +1,83 @@
+"""Headless model of the markup of one image.
+
+A Markup holds the minutiae, cores and deltas marked on an image of a given
+size and converts them to and from TXT and ISO 19794-2:2005 templates. The
+application keeps its canvas items next to these records and hands a Markup
+to the codecs; batch jobs and services use it directly. Nothing here, nor
+in the modules it imports, imports tkinter.
+"""
+
+from annotations import CORE, CORE_DELTA_AREA, DELTA, ISO_EXTENSIONS
+from annotations import core_delta_area
+from annotations import encode_iso19794, iso_records, parse_core_delta
+from annotations import parse_extended_data, parse_iso_size, read_template
+from annotations import ridge_count_area, write_iso19794, write_minutiae_txt
+
+
+class Markup:
+    """Minutiae and singular points of an image of width x height pixels."""
+
+    def __init__(self, width, height, minutiae=(), singular_points=None):
+        self.width = width
+        self.height = height
+        self.minutiae = [tuple(m[:5]) for m in minutiae]  # (x, y, angle, quality, type)
+        self.singular_points = (
+            singular_points  # [(x, y, CORE or DELTA)], None if unknown
+        )
+
+    @classmethod
+    def load(cls, path, width=0, height=0):
+        """Reads a TXT or ISO template. ISO templates carry their own image size."""
+        if path.lower().endswith(ISO_EXTENSIONS):
+            with open(path, "rb") as f:
+                return cls.from_iso19794(f.read())
+        return cls(width, height, read_template(path))
+
+    @classmethod
+    def from_iso19794(cls, data):
+        """Parses an ISO 19794-2:2005 template held in memory."""
+        width, height = parse_iso_size(data)
+        singular_points = None
+        areas = parse_extended_data(data)
+        if CORE_DELTA_AREA in areas:
+            cores, deltas = parse_core_delta(areas[CORE_DELTA_AREA])
+            singular_points = [(x, y, CORE) for x, y in cores] + [
+                (x, y, DELTA) for x, y in deltas
+            ]
+        return cls(width, height, iso_records(data), singular_points)
+
+    def cores(self):
+        return [(x, y) for x, y, kind in self.singular_points or () if kind == CORE]
+
+    def deltas(self):
+        return [(x, y) for x, y, kind in self.singular_points or () if kind == DELTA]
+
+    def extended_data(self, structure=None):
+        """Returns the encoded extended data areas of an ISO template.
+
+        Ridge counts need the RidgeStructure of the image and are left out
+        without it.
+        """
+        extended = bytearray()
+        if structure is not None and len(self.minutiae) > 1:
+            # Only needed with a structure; keeps NumPy out of plain conversions
+            from orientation import ridge_counts
+
+            counts = ridge_counts(structure.ridges, [m[:2] for m in self.minutiae])
+            extended += ridge_count_area(counts)
+        if self.singular_points:
+            extended += core_delta_area(self.cores(), self.deltas())
+        return bytes(extended)
+
+    def to_iso19794(self, structure=None):
+        return encode_iso19794(
+            self.minutiae, self.width, self.height, self.extended_data(structure)
+        )
+
+    def save_iso(self, path, structure=None):
+        write_iso19794(
+            path, self.minutiae, self.width, self.height, self.extended_data(structure)
+        )
+
+    def save_txt(self, path):
+        write_minutiae_txt(path, self.minutiae)
@@ -0,0 +1,181 @@
+"""1:1 comparison of two minutiae templates.
+
+Every minutia is described by the triplet it forms with its two nearest
+neighbours: the neighbour distances, their directions and their angles,
+all relative to the minutia itself so the descriptor does not depend on
+how the finger was placed. Descriptors of both templates are compared all
+against all with NumPy broadcasting. Every similar pair then votes for the
+rotation and translation that would map one onto the other. The strongest
+votes are refined and the alignment that pairs up the most minutiae wins.
+
+Templates are lists of (x, y, angle, quality, type) records as returned by
+annotations.read_template, with angles in degrees and the y axis pointing
+down in image coordinates but up for angles, as drawn by the application.
+"""
+
+import math
+
+import numpy as np
+
+NEIGHBOURS = 2  # Nearest neighbours forming the local triplet
+DISTANCE_SCALE = 12.0  # Pixels of descriptor distance difference counting as 1
+ANGLE_SCALE = math.radians(20)  # Angle difference counting as 1
+MAX_DESCRIPTOR_DISTANCE = 3.0  # Pairs beyond this do not vote
+
+ROTATION_BIN = math.radians(10)
+TRANSLATION_BIN = 20.0
+CANDIDATE_ALIGNMENTS = 5  # Strongest Hough bins that are refined and tried
+
+PAIR_DISTANCE = 15.0  # Aligned minutiae closer than this can pair up
+PAIR_ANGLE = math.radians(30)
+
+
+def _wrap(angle):
+    """Wraps angles to [-pi, pi)."""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def _arrays(template):
+    records = list(template)
+    xs = np.array([r[0] for r in records], dtype=np.float64)
+    # Flip y so positions and angles share the same counterclockwise frame
+    ys = -np.array([r[1] for r in records], dtype=np.float64)
+    angles = np.radians([r[2] for r in records]).astype(np.float64)
+    return xs, ys, angles
+
+
+def descriptors(xs, ys, angles):
+    """Returns (n, NEIGHBOURS, 3) local triplet descriptors.
+
+    For each neighbour: distance, direction relative to the minutia angle
+    and angle relative to the minutia angle, sorted by distance.
+    """
+    dx = xs[None, :] - xs[:, None]
+    dy = ys[None, :] - ys[:, None]
+    distance = np.hypot(dx, dy)
+    np.fill_diagonal(distance, np.inf)
+    nearest = np.argsort(distance, axis=1)[:, :NEIGHBOURS]
+
+    rows = np.arange(len(xs))[:, None]
+    return np.stack(
+        (
+            distance[rows, nearest],
+            _wrap(np.arctan2(dy[rows, nearest], dx[rows, nearest]) - angles[:, None]),
+            _wrap(angles[nearest] - angles[:, None]),
+        ),
+        axis=-1,
+    )
+
+
+def descriptor_distances(desc_a, desc_b):
+    """Returns the (len(a), len(b)) distances between two descriptor sets.
+
+    Neighbours of similar distance can swap places, so every ordering of the
+    neighbours of b is tried and the closest one is kept.
+    """
+    best = None
+    orders = [list(range(NEIGHBOURS)), list(range(NEIGHBOURS))[::-1]]
+    for order in orders:
+        diff = desc_a[:, None, :, :] - desc_b[None, :, order, :]
+        distance = (
+            np.abs(diff[..., 0]) / DISTANCE_SCALE
+            + np.abs(_wrap(diff[..., 1])) / ANGLE_SCALE
+            + np.abs(_wrap(diff[..., 2])) / ANGLE_SCALE
+        ).sum(axis=-1) / NEIGHBOURS
+        best = distance if best is None else np.minimum(best, distance)
+    return best
+
+
+def _transform(xs, ys, rotation, tx, ty):
+    cos, sin = math.cos(rotation), math.sin(rotation)
+    return xs * cos - ys * sin + tx, xs * sin + ys * cos + ty
+
+
+def pair_minutiae(a, b, rotation, tx, ty):
+    """Pairs the minutiae of a, aligned onto b, with those of b one to one.
+
+    a and b are (xs, ys, angles) arrays. Returns [(index in a, index in b)],
+    closest pairs first.
+    """
+    ax, ay = _transform(a[0], a[1], rotation, tx, ty)
+    distance = np.hypot(ax[:, None] - b[0][None, :], ay[:, None] - b[1][None, :])
+    angle = np.abs(_wrap(a[2][:, None] + rotation - b[2][None, :]))
+    ia, ib = np.nonzero((distance <= PAIR_DISTANCE) & (angle <= PAIR_ANGLE))
+    order = np.argsort(distance[ia, ib], kind="stable")
+
+    pairs, used_a, used_b = [], set(), set()
+    for i, j in zip(ia[order].tolist(), ib[order].tolist()):
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+class MatchResult:
+    """Score, corresponding pairs and the alignment mapping template a onto b."""
+
+    def __init__(self, score, pairs, rotation=0.0, translation=(0.0, 0.0)):
+        self.score = score  # 0 (nothing in common) ... 1 (every minutia paired)
+        self.pairs = pairs  # [(index in a, index in b)]
+        self.rotation = rotation  # Degrees, counterclockwise
+        self.translation = translation  # Pixels in image coordinates
+
+    def b_to_a(self, x, y):
+        """Maps a point of template b into the image coordinates of template a."""
+        rotation = math.radians(self.rotation)
+        tx, ty = self.translation
+        x, y = x - tx, -(y - ty)
+        cos, sin = math.cos(-rotation), math.sin(-rotation)
+        return x * cos - y * sin, -(x * sin + y * cos)
+
+
+def match(template_a, template_b):
+    """Compares two templates and returns a MatchResult."""
+    a = _arrays(template_a)
+    b = _arrays(template_b)
+    if min(len(a[0]), len(b[0])) <= NEIGHBOURS:
+        return MatchResult(0.0, [])
+
+    distance = descriptor_distances(descriptors(*a), descriptors(*b))
+    ia, ib = np.nonzero(distance < MAX_DESCRIPTOR_DISTANCE)
+    if not len(ia):
+        return MatchResult(0.0, [])
+    weight = 1 - distance[ia, ib] / MAX_DESCRIPTOR_DISTANCE
+
+    # Every similar pair votes for the rotation and translation aligning it
+    rotation = _wrap(b[2][ib] - a[2][ia])
+    cos, sin = np.cos(rotation), np.sin(rotation)
+    tx = b[0][ib] - (a[0][ia] * cos - a[1][ia] * sin)
+    ty = b[1][ib] - (a[0][ia] * sin + a[1][ia] * cos)
+    bins = np.column_stack(
+        (
+            np.floor(rotation / ROTATION_BIN),
+            np.floor(tx / TRANSLATION_BIN),
+            np.floor(ty / TRANSLATION_BIN),
+        )
+    ).astype(np.int64)
+    keys, inverse = np.unique(bins, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    votes = np.bincount(inverse, weights=weight, minlength=len(keys))
+
+    best = MatchResult(0.0, [])
+    for candidate in np.argsort(votes)[::-1][:CANDIDATE_ALIGNMENTS]:
+        # Refine the bin to the weighted mean of the votes that fell into it
+        voters = inverse == candidate
+        w = weight[voters]
+        mean_rotation = math.atan2(
+            (np.sin(rotation[voters]) * w).sum(), (np.cos(rotation[voters]) * w).sum()
+        )
+        mean_tx = float((tx[voters] * w).sum() / w.sum())
+        mean_ty = float((ty[voters] * w).sum() / w.sum())
+        pairs = pair_minutiae(a, b, mean_rotation, mean_tx, mean_ty)
+        score = len(pairs) ** 2 / (len(a[0]) * len(b[0]))
+        if score > best.score:
+            best = MatchResult(
+                score,
+                pairs,
+                math.degrees(mean_rotation),
+                (mean_tx, -mean_ty),  # Back to the image y axis
+            )
+    return best
@@ -0,0 +1,333 @@
+"""Per-image ridge structure used to give newly marked minutiae their angle.
+
+The block orientation field fixes the ridge axis at a point but not which
+way along it the minutia points. That is decided from the skeleton: the
+ridge a minutia sits on continues on one side only for an ending, and with
+two branches against one stem for a bifurcation, so in both cases the angle
+points to the side holding more of the connected skeleton. This matches the
+directions traced by extraction.py.
+
+For snapping, every pixel also knows the nearest skeleton ending or
+bifurcation within SNAP_DISTANCE, so a click resolves with one lookup.
+
+The binarized ridges are kept as well, to count the ridges between
+neighbouring minutiae for the ISO extended data, together with the cores
+and deltas found with the Poincare index of the orientation field.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from annotations import CORE, DELTA
+from cache import cache_path, content_hash_index, file_hash
+from enhance import BLOCK_SIZE, _smooth3, normalize, orientation_field
+from enhance import pad_to_blocks, to_pixels
+from extraction import NEIGHBOURS, _erode, crossing_number, ridge_map, thin
+from images import open_image
+
+STRUCTURE_VERSION = 4  # Bump when the output changes to invalidate cached results
+
+PATCH_RADIUS = 12  # Skeleton pixels this close to the click decide the direction
+SNAP_RADIUS = 4  # Distance within which the click is taken to be on a ridge
+SNAP_DISTANCE = 10  # Clicks snap to ridge features at most this far away
+
+FEATURE_TYPES = {1: "ending", 3: "bifurcation"}  # By crossing number
+
+RIDGE_COUNT_NEIGHBOURS = 8  # Nearest neighbours each minutia is ridge counted to
+
+SINGULAR_SMOOTHING = 2  # 3x3 block smoothing passes before the Poincare index
+
+# Block offsets (dy, dx) of the closed path around a block, counterclockwise
+# as seen on screen
+RING = ((0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1))
+
+
+class RidgeStructure:
+    """Block orientation field and ridge skeleton of one image."""
+
+    def __init__(
+        self,
+        orientation,
+        ridges,
+        skeleton,
+        features,
+        feature_grid,
+        singular,
+        block=BLOCK_SIZE,
+    ):
+        self.orientation = orientation  # Ridge normal per block, radians, y down
+        self.ridges = ridges  # Binarized ridge map
+        self.skeleton = skeleton
+        self.features = features  # (x, y, crossing number) rows
+        self.feature_grid = feature_grid  # Nearest feature index per pixel, or -1
+        self.singular = singular  # (x, y, CORE or DELTA) rows
+        self.block = block
+
+    def snap(self, x, y):
+        """Returns (x, y, type) of the ridge feature nearest to a pixel, or None."""
+        h, w = self.feature_grid.shape
+        if not (0 <= y < h and 0 <= x < w):
+            return None
+        index = self.feature_grid[y, x]
+        if index < 0:
+            return None
+        fx, fy, cn = self.features[index]
+        return int(fx), int(fy), FEATURE_TYPES[int(cn)]
+
+    def ridge_axis(self, x, y):
+        """Unit vector along the ridges at a pixel, in image coordinates."""
+        rows, cols = self.orientation.shape
+        normal = self.orientation[
+            min(int(y) // self.block, rows - 1), min(int(x) // self.block, cols - 1)
+        ]
+        return -math.sin(normal), math.cos(normal)
+
+    def _component(self, x, y):
+        """Returns the skeleton pixels of the patch connected to the ridge at (x, y)."""
+        top, left = max(y - PATCH_RADIUS, 0), max(x - PATCH_RADIUS, 0)
+        patch = self.skeleton[top : y + PATCH_RADIUS + 1, left : x + PATCH_RADIUS + 1]
+        ys, xs = np.nonzero(patch)
+        if not len(ys):
+            return []
+        distance = np.hypot(xs + left - x, ys + top - y)
+        nearest = distance.argmin()
+        if distance[nearest] > SNAP_RADIUS:
+            return []
+
+        seed = ys[nearest], xs[nearest]
+        component, pending = {seed}, [seed]
+        while pending:
+            py, px = pending.pop()
+            for dy, dx in NEIGHBOURS:
+                ny, nx = py + dy, px + dx
+                if (
+                    0 <= ny < patch.shape[0]
+                    and 0 <= nx < patch.shape[1]
+                    and patch[ny, nx]
+                    and (ny, nx) not in component
+                ):
+                    component.add((ny, nx))
+                    pending.append((ny, nx))
+        return [(py + top, px + left) for py, px in component]
+
+    def angle_at(self, x, y):
+        """Returns the angle in degrees (y axis up) for a minutia at (x, y)."""
+        ux, uy = self.ridge_axis(x, y)
+        # Skeleton mass on either side of the minutia along the ridge axis
+        balance = sum((px - x) * ux + (py - y) * uy for py, px in self._component(x, y))
+        if balance < 0:
+            ux, uy = -ux, -uy
+        return round(math.degrees(math.atan2(-uy, ux))) % 360
+
+
+def feature_grid(features, shape, radius=SNAP_DISTANCE):
+    """Returns the index of the nearest feature within `radius` of every pixel.
+
+    This is a Euclidean distance transform carrying feature indices, limited
+    to the radius: an exact pass down every column finds the nearest feature
+    row per column, then 2 * radius + 1 shifted passes combine the columns.
+    Pixels with no feature within the radius get -1.
+    """
+    h, w = shape
+    ids = np.full(shape, -1, dtype=np.int32)
+    ids[features[:, 1], features[:, 0]] = np.arange(len(features), dtype=np.int32)
+
+    # Nearest feature row above and below every pixel of each column
+    rows = np.arange(h, dtype=np.int32)[:, None]
+    far = h + radius + 1
+    above = np.maximum.accumulate(np.where(ids >= 0, rows, -far), axis=0)
+    below = np.minimum.accumulate(np.where(ids >= 0, rows, h + far)[::-1], axis=0)[::-1]
+    nearest_row = np.where(rows - above <= below - rows, above, below)
+    column_distance = np.minimum(np.abs(nearest_row - rows), radius + 1)
+    cols = np.arange(w)[None, :]
+    column_id = np.where(
+        column_distance <= radius, ids[np.clip(nearest_row, 0, h - 1), cols], -1
+    )
+    column_distance2 = column_distance * column_distance
+
+    best = np.full(shape, radius * radius + 1, dtype=np.int32)
+    best_id = np.full(shape, -1, dtype=np.int32)
+    for dx in range(-radius, radius + 1):
+        # Candidate from column x + dx for every pixel x
+        src = slice(max(dx, 0), w + min(dx, 0))
+        dst = slice(max(-dx, 0), w - max(dx, 0))
+        distance2 = column_distance2[:, src] + dx * dx
+        better = (distance2 < best[:, dst]) & (column_id[:, src] >= 0)
+        best[:, dst] = np.where(better, distance2, best[:, dst])
+        best_id[:, dst] = np.where(better, column_id[:, src], best_id[:, dst])
+    return best_id
+
+
+def ridge_counts(ridges, points, neighbours=RIDGE_COUNT_NEIGHBOURS):
+    """Returns (i, j, count) ridge counts from every point to its nearest neighbours.
+
+    Pairs are unordered with i < j. All connecting segments are sampled in
+    one pass at no more than one pixel spacing. A ridge counts when the
+    segment both enters and leaves it, so the ridges the two minutiae sit
+    on are left out.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    if n < 2:
+        return []
+    distance = np.hypot(
+        points[:, None, 0] - points[None, :, 0], points[:, None, 1] - points[None, :, 1]
+    )
+    np.fill_diagonal(distance, np.inf)
+    k = min(neighbours, n - 1)
+    nearest = np.argsort(distance, axis=1)[:, :k]
+    pairs = np.column_stack((np.repeat(np.arange(n), k), nearest.ravel()))
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+
+    a, b = points[pairs[:, 0]], points[pairs[:, 1]]
+    samples = int(math.ceil(distance[pairs[:, 0], pairs[:, 1]].max())) + 1
+    t = np.linspace(0.0, 1.0, samples)[None, :]
+    h, w = ridges.shape
+    xs = np.clip(np.rint(a[:, :1] + (b[:, :1] - a[:, :1]) * t), 0, w - 1)
+    ys = np.clip(np.rint(a[:, 1:] + (b[:, 1:] - a[:, 1:]) * t), 0, h - 1)
+    on = ridges[ys.astype(np.intp), xs.astype(np.intp)]
+
+    rising = on[:, 1:] & ~on[:, :-1]
+    falling = on[:, :-1] & ~on[:, 1:]
+    first_rise = np.where(rising.any(axis=1), rising.argmax(axis=1), samples)
+    steps = np.arange(samples - 1)[None, :]
+    counts = (falling & (steps > first_rise[:, None])).sum(axis=1)
+    return list(zip(pairs[:, 0].tolist(), pairs[:, 1].tolist(), counts.tolist()))
+
+
+def singular_points(orientation, mask, block=BLOCK_SIZE):
+    """Returns (x, y, CORE or DELTA) rows of the singular points, in pixels.
+
+    The doubled ridge angle is smoothed as a vector field and its winding
+    along the ring around every block is summed for all blocks at once. A
+    full turn one way marks a core, the other way a delta. Neighbouring
+    blocks flagging the same point are merged into their centroid.
+    """
+    c, s = np.cos(2 * orientation), np.sin(2 * orientation)
+    for _ in range(SINGULAR_SMOOTHING):
+        c, s = _smooth3(c), _smooth3(s)
+    doubled = np.pad(np.arctan2(s, c), 1, mode="edge")
+    h, w = orientation.shape
+
+    ring = [doubled[1 + dy : 1 + dy + h, 1 + dx : 1 + dx + w] for dy, dx in RING]
+    winding = sum(
+        (ring[(k + 1) % len(ring)] - ring[k] + np.pi) % (2 * np.pi) - np.pi
+        for k in range(len(ring))
+    )
+    # Angles grow clockwise on screen with the y axis down, against the ring
+    index = np.rint(-winding / (2 * np.pi)).astype(np.int32)
+    # The whole ring has to lie on the fingerprint
+    index[~_erode(mask, 1)] = 0
+
+    points = []
+    for kind in (CORE, DELTA):
+        pending = set(zip(*np.nonzero(index == kind)))
+        while pending:
+            group = [pending.pop()]
+            for by, bx in group:
+                for dy, dx in RING:
+                    if (by + dy, bx + dx) in pending:
+                        pending.discard((by + dy, bx + dx))
+                        group.append((by + dy, bx + dx))
+            y = (np.mean([by for by, _ in group]) + 0.5) * block
+            x = (np.mean([bx for _, bx in group]) + 0.5) * block
+            points.append((round(x), round(y), kind))
+    return np.array(points, dtype=np.int32).reshape(-1, 3)
+
+
+def ridge_structure(image):
+    """Computes the RidgeStructure of a PIL image."""
+    gray = np.asarray(image.convert("L"), dtype=np.float64)
+    h, w = gray.shape
+    orientation, _ = orientation_field(normalize(pad_to_blocks(gray)))
+    ridges, mask = ridge_map(gray)
+    skeleton = thin(ridges)
+
+    cn = crossing_number(skeleton)
+    ys, xs = np.nonzero(((cn == 1) | (cn == 3)) & to_pixels(mask)[:h, :w])
+    features = np.column_stack((xs, ys, cn[ys, xs])).astype(np.int32)
+    return RidgeStructure(
+        orientation,
+        ridges,
+        skeleton,
+        features,
+        feature_grid(features, (h, w)),
+        singular_points(orientation, mask),
+    )
+
+
+# --- Disk cache ---
+
+
+def structure_path(digest):
+    return cache_path("structure", digest[:2], f"{digest}_v{STRUCTURE_VERSION}.npz")
+
+
+def read_structure(path):
+    with np.load(path) as data:
+        shape = tuple(data["shape"])
+        ridges = np.unpackbits(data["ridges"], count=shape[0] * shape[1])
+        skeleton = np.unpackbits(data["skeleton"], count=shape[0] * shape[1])
+        return RidgeStructure(
+            data["orientation"],
+            ridges.reshape(shape).astype(bool),
+            skeleton.reshape(shape).astype(bool),
+            data["features"],
+            data["feature_grid"],
+            data["singular"],
+        )
+
+
+def structure_file(src):
+    """Computes the ridge structure of an image file unless it is cached.
+
+    Runs inside a worker process. Returns (src, file size, mtime_ns, hash,
+    structure path) like thumbnails.build_thumbnail.
+    """
+    st = os.stat(src)
+    digest = file_hash(src)
+    dest = structure_path(digest)
+    if not os.path.exists(dest):
+        with open_image(src) as image:
+            structure = ridge_structure(image)
+        tmp_path = f"{dest}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            orientation=structure.orientation.astype(np.float32),
+            ridges=np.packbits(structure.ridges),
+            skeleton=np.packbits(structure.skeleton),
+            shape=np.array(structure.skeleton.shape),
+            features=structure.features,
+            feature_grid=structure.feature_grid,
+            singular=structure.singular,
+        )
+        os.replace(tmp_path, dest)
+    return src, st.st_size, st.st_mtime_ns, digest, dest
+
+
+class StructureCache:
+    """Ridge structures on disk, keyed by the content hash of the image."""
+
+    def __init__(self):
+        self.hash_index = content_hash_index()
+
+    def lookup(self, image_path):
+        """Returns the cached structure file of an image, or None. Never reads the image."""
+        try:
+            found = self.hash_index.cached(image_path)
+        except OSError:
+            return None
+        if found and os.path.exists(structure_path(found[0])):
+            return structure_path(found[0])
+        return None
+
+    def generate(self, image_path, executor):
+        return executor.submit(structure_file, image_path)
+
+    def finished(self, result):
+        """Records a structure_file result and returns the structure path."""
+        src, size, mtime_ns, digest, dest = result
+        self.hash_index.record(src, size, mtime_ns, digest)
+        return dest
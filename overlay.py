@@ -0,0 +1,259 @@
+"""Renders minutiae overlays onto images and builds QA review sheets.
+
+Glyphs are drawn from sprites: the coverage of the disc and of each
+orientation line angle is rasterized once (optionally at several subpixel
+positions for antialiasing) and then stamped at every minutia with NumPy
+scatter operations, so the cost grows with the glyph pixels only.
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+from annotations import find_annotation, read_template
+from thumbnails import scan_folder
+from images import open_image
+
+# Define colors for minutiae types
+ENDING_COLOR = "red"
+BIFURCATION_COLOR = "green"
+OTHER_COLOR = "blue"
+
+# Glyph sizes in pixels for images up to REFERENCE_SIZE pixels on the short side
+GLYPH_RADIUS = 3
+GLYPH_LINE_LENGTH = 15
+GLYPH_LINE_WIDTH = 2
+REFERENCE_SIZE = 500
+
+STAMP_BUDGET = 4_000_000  # Sprite pixels scattered per NumPy batch, bounds peak memory
+
+
+def type_color(m_type):
+    if m_type == "ending":
+        return ENDING_COLOR
+    elif m_type == "bifurcation":
+        return BIFURCATION_COLOR
+    return OTHER_COLOR
+
+
+def glyph_scale(width, height):
+    """Grows glyphs with the image so they stay visible on large scans."""
+    return max(1.0, min(width, height) / REFERENCE_SIZE)
+
+
+def _subpixel_offsets(supersample):
+    steps = (np.arange(supersample) + 0.5) / supersample - 0.5
+    sx, sy = np.meshgrid(steps, steps)
+    return sx.ravel(), sy.ravel()
+
+
+def _sprite(half_width, end_x, end_y, supersample):
+    """Rasterizes a segment from the origin to (end_x, end_y) with round caps.
+
+    A zero length segment is a disc of radius half_width. Returns the
+    (dx, dy, coverage) of every pixel the glyph touches.
+    """
+    pad = int(np.ceil(half_width)) + 1
+    oy, ox = np.mgrid[
+        int(np.floor(min(0, end_y))) - pad : int(np.ceil(max(0, end_y))) + pad + 1,
+        int(np.floor(min(0, end_x))) - pad : int(np.ceil(max(0, end_x))) + pad + 1,
+    ]
+    ox = ox.ravel()
+    oy = oy.ravel()
+
+    # (pixel, sample) distances to the segment
+    sx, sy = _subpixel_offsets(supersample)
+    dx = ox[:, None] + sx
+    dy = oy[:, None] + sy
+    length2 = max(end_x * end_x + end_y * end_y, 1e-9)
+    t = np.clip((dx * end_x + dy * end_y) / length2, 0.0, 1.0)
+    ex = dx - t * end_x
+    ey = dy - t * end_y
+    coverage = (ex * ex + ey * ey <= half_width * half_width).mean(axis=1)
+
+    keep = coverage > 0
+    return ox[keep], oy[keep], coverage[keep].astype(np.float32)
+
+
+def render_overlay(image, records, scale=None, supersample=1):
+    """Returns an RGB copy of `image` with the minutiae drawn on it.
+
+    records are (x, y, angle, quality, type) tuples. scale defaults to
+    glyph_scale() for the image size; supersample > 1 antialiases glyph edges
+    by testing supersample x supersample positions per pixel.
+    """
+    result = np.array(image.convert("RGB"), dtype=np.float32)
+    height, width = result.shape[:2]
+    if not records:
+        return Image.fromarray(result.astype(np.uint8))
+    if scale is None:
+        scale = glyph_scale(width, height)
+
+    xs = np.rint([r[0] for r in records]).astype(np.int64)
+    ys = np.rint([r[1] for r in records]).astype(np.int64)
+    palette = {}
+    colors = np.array(
+        [
+            palette.setdefault(r[4], ImageColor.getrgb(type_color(r[4])))
+            for r in records
+        ],
+        dtype=np.float32,
+    )
+
+    # Sprite 0 is the disc, the others are the orientation lines of each angle
+    angles, line_sprite = np.unique(
+        np.rint([r[2] for r in records]).astype(np.int64) % 360, return_inverse=True
+    )
+    line_length = GLYPH_LINE_LENGTH * scale
+    sprites = [_sprite(GLYPH_RADIUS * scale, 0.0, 0.0, supersample)]
+    for angle in np.radians(angles):
+        sprites.append(
+            _sprite(
+                GLYPH_LINE_WIDTH * scale / 2,
+                line_length * np.cos(angle),
+                -line_length * np.sin(angle),  # Inverted y-axis
+                supersample,
+            )
+        )
+    sprite_dx = np.concatenate([s[0] for s in sprites])
+    sprite_dy = np.concatenate([s[1] for s in sprites])
+    sprite_coverage = np.concatenate([s[2] for s in sprites])
+    sprite_size = np.array([len(s[0]) for s in sprites])
+    sprite_start = np.cumsum(sprite_size) - sprite_size
+
+    # Draw order matches the interactive canvas: each minutia's disc, then its line
+    stamp_x = np.repeat(xs, 2)
+    stamp_y = np.repeat(ys, 2)
+    stamp_sprite = np.column_stack(
+        (np.zeros(len(records), dtype=np.int64), line_sprite.ravel() + 1)
+    ).ravel()
+
+    # Each pixel takes the colour of the last glyph drawn over it and the
+    # strongest coverage among all glyphs touching it
+    alpha = np.zeros(width * height, dtype=np.float32)
+    top = np.full(width * height, -1, dtype=np.int64)
+    stamp_end = np.cumsum(sprite_size[stamp_sprite])
+    bounds = np.searchsorted(
+        stamp_end, np.arange(STAMP_BUDGET, stamp_end[-1], STAMP_BUDGET), side="right"
+    )
+    for first, last in zip(
+        np.concatenate(([0], bounds)), np.concatenate((bounds, [len(stamp_sprite)]))
+    ):
+        if first == last:
+            continue
+        batch = np.arange(first, last)
+        counts = sprite_size[stamp_sprite[batch]]
+        stamp = np.repeat(batch, counts)
+        entry = (
+            np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+            + np.repeat(sprite_start[stamp_sprite[batch]], counts)
+        )
+        px = stamp_x[stamp] + sprite_dx[entry]
+        py = stamp_y[stamp] + sprite_dy[entry]
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        pixels = (py * width + px)[inside]
+        np.maximum.at(alpha, pixels, sprite_coverage[entry][inside])
+        top[pixels] = stamp[inside]  # Stamps are in draw order, the last write wins
+
+    touched = np.flatnonzero(top >= 0)
+    a = alpha[touched][:, None]
+    flat = result.reshape(-1, 3)
+    flat[touched] = flat[touched] * (1 - a) + colors[top[touched] // 2] * a
+    return Image.fromarray(
+        np.clip(flat.reshape(height, width, 3) + 0.5, 0, 255).astype(np.uint8)
+    )
+
+
+# --- Dataset export ---
+
+TILE_SIZE = (360, 360)
+CAPTION_HEIGHT = 20
+
+
+def export_overlay(image_path, annotation_path, out_path, supersample=2):
+    """Renders one dataset image. Runs inside a worker process.
+
+    Returns (image path, minutiae count, review tile) where the tile is a
+    (size, RGB bytes) pair small enough to send back to the parent.
+    """
+    records = read_template(annotation_path) if annotation_path else []
+    with open_image(image_path) as image:
+        rendered = render_overlay(image, records, supersample=supersample)
+    rendered.save(out_path)
+    rendered.thumbnail(TILE_SIZE)
+    return image_path, len(records), (rendered.size, rendered.tobytes())
+
+
+def export_jobs(image_paths, out_dir):
+    """Returns (image, annotation, output) paths for the annotated images."""
+    jobs = []
+    for image_path in image_paths:
+        annotation_path = find_annotation(image_path)
+        if annotation_path is None:
+            continue
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        jobs.append(
+            (image_path, annotation_path, os.path.join(out_dir, stem + "_overlay.png"))
+        )
+    return jobs
+
+
+def build_review_sheets(results, out_dir, columns=4, rows=3):
+    """Lays out export_overlay results as captioned contact sheets."""
+    results = sorted(results, key=lambda result: result[0])
+    cell_w = TILE_SIZE[0] + 10
+    cell_h = TILE_SIZE[1] + CAPTION_HEIGHT + 10
+    per_sheet = columns * rows
+    sheet_paths = []
+    for first in range(0, len(results), per_sheet):
+        batch = results[first : first + per_sheet]
+        sheet = Image.new("RGB", (columns * cell_w, rows * cell_h), "white")
+        draw = ImageDraw.Draw(sheet)
+        for i, (image_path, count, (size, data)) in enumerate(batch):
+            x = (i % columns) * cell_w + 5
+            y = (i // columns) * cell_h + 5
+            tile = Image.frombytes("RGB", size, data)
+            sheet.paste(tile, (x + (TILE_SIZE[0] - size[0]) // 2, y))
+            draw.text(
+                (x, y + TILE_SIZE[1] + 4),
+                f"{os.path.basename(image_path)}  ({count} minutiae)",
+                fill="black",
+            )
+        path = os.path.join(out_dir, f"review_sheet_{first // per_sheet + 1:03d}.png")
+        sheet.save(path)
+        sheet_paths.append(path)
+    return sheet_paths
+
+
+def export_dataset(folder, out_dir, workers=None, supersample=2):
+    """Renders overlays for every annotated image of a folder in a process pool."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = export_jobs(scan_folder(folder), out_dir)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_overlay, *job, supersample=supersample)
+            for job in jobs
+        ]
+        results = [future.result() for future in futures]
+    return build_review_sheets(results, out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render annotated overlays and review sheets for a dataset."
+    )
+    parser.add_argument("folder", help="Folder with images and .txt/.iso annotations")
+    parser.add_argument("out_dir", help="Folder for overlays and review sheets")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--supersample", type=int, default=2)
+    args = parser.parse_args()
+    sheets = export_dataset(args.folder, args.out_dir, args.workers, args.supersample)
+    print(f"Wrote {len(sheets)} review sheet(s) to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""External minutiae extractors and matchers, run as isolated plugins.
+
+A plugin is a Python file defining an extractor, a matcher or both:
+
+    def extract(pixels):
+        return {"x": xs, "y": ys, "angle": angles, "type": types, "quality": qs}
+
+    def match(probe, candidate):
+        return score
+
+`pixels` is a read-only (height, width) uint8 array of the grey levels of
+the image. It views shared memory: the decoded image is copied once into a
+multiprocessing.shared_memory block that the plugin process maps, so large
+scans are never pickled. Minutiae use the columns of the columnar export:
+x, y and angle in degrees, type as ISO code and quality as ISO value, 0
+meaning not set. An extractor may return lists or arrays of any integer
+type; a matcher gets two templates as such columns and returns a float,
+higher meaning more similar.
+
+Every call starts a fresh process, so a plugin that crashes, hangs past its
+timeout or leaks memory only takes its own process down and the caller gets
+a PluginError. Plugins are looked up in PLUGIN_DIR:
+
+    python plugins.py extract extractors/mindtct.py scan.png --output scan.txt
+    python plugins.py match extractors/bozorth.py a.txt b.txt
+"""
+
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from annotations import iso_quality, iso_type_code, iso_type_name
+from annotations import read_template, write_minutiae_txt
+from columnar import COLUMNS
+from images import open_image
+
+PLUGIN_DIR = os.environ.get(
+    "FINGERPRINT_PLUGIN_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "extractors"),
+)
+PLUGIN_TIMEOUT = 120  # Seconds a plugin may take for one call
+POLL_INTERVAL = 0.1  # Seconds between timeout and cancellation checks
+EXIT_TIMEOUT = 1.0  # Seconds a plugin may take to exit after its result
+# The columns of the columnar export, without the image id
+RESULT_COLUMNS = {name: dtype for name, dtype in COLUMNS.items() if name != "image_id"}
+
+
+class PluginError(Exception):
+    """A plugin failed, crashed, timed out or returned an invalid result."""
+
+
+def find_plugins(folder=PLUGIN_DIR):
+    """Returns the sorted paths of the plugin files of a folder."""
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.endswith(".py") and not name.startswith("_")
+    )
+
+
+def plugin_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_plugin(path):
+    spec = importlib.util.spec_from_file_location(f"plugin_{plugin_name(path)}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def result_columns(result, width, height):
+    """Checks the result of an extractor and returns it as {column: array}."""
+    try:
+        columns = {name: np.asarray(result[name]) for name in RESULT_COLUMNS}
+    except (KeyError, TypeError):
+        raise PluginError(
+            f"extract must return the columns {', '.join(RESULT_COLUMNS)}"
+        )
+    lengths = {values.shape for values in columns.values()}
+    if len(lengths) > 1 or any(values.ndim != 1 for values in columns.values()):
+        raise PluginError("Result columns must be 1-D and of equal length")
+    for name, values in columns.items():
+        if values.size and not np.issubdtype(values.dtype, np.integer):
+            raise PluginError(f"Column {name} must hold integers")
+        columns[name] = values.astype(np.int64)
+    x, y = columns["x"], columns["y"]
+    if ((x < 0) | (x >= width) | (y < 0) | (y >= height)).any():
+        raise PluginError("Minutiae outside the image")
+    if ((columns["type"] < 0) | (columns["type"] > 2)).any():
+        raise PluginError("Types must be ISO codes 0 to 2")
+    if ((columns["quality"] < 0) | (columns["quality"] > 100)).any():
+        raise PluginError("Qualities must be ISO values 0 to 100")
+    columns["angle"] %= 360
+    return {
+        name: np.ascontiguousarray(columns[name], dtype)
+        for name, dtype in RESULT_COLUMNS.items()
+    }
+
+
+def record_columns(records):
+    """Returns {column: array} of (x, y, angle, quality, type) records."""
+    rows = [
+        (x, y, angle % 360, iso_type_code(m_type), iso_quality(q))
+        for x, y, angle, q, m_type in records
+    ]
+    table = np.array(rows, dtype=np.int64).reshape(-1, len(RESULT_COLUMNS))
+    return {
+        name: np.ascontiguousarray(table[:, k], dtype)
+        for k, (name, dtype) in enumerate(RESULT_COLUMNS.items())
+    }
+
+
+def column_records(columns):
+    """Returns the (x, y, angle, quality, type) records of result columns."""
+    return [
+        (x, y, angle, quality if quality else "not set", iso_type_name(m_type))
+        for x, y, angle, m_type, quality in zip(
+            *(columns[name].tolist() for name in RESULT_COLUMNS)
+        )
+    ]
+
+
+# --- Plugin processes ---
+
+
+def _send_result(conn, call):
+    try:
+        result = ("ok", call())
+    except BaseException:
+        result = ("error", traceback.format_exc())
+    conn.send(result)
+    conn.close()
+
+
+def _extract_process(path, shm_name, shape, conn):
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    def extract():
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        pixels.flags.writeable = False
+        return result_columns(load_plugin(path).extract(pixels), shape[1], shape[0])
+
+    try:
+        _send_result(conn, extract)
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # The plugin kept a view of the pixels; exiting unmaps them
+
+
+def _match_process(path, probe, candidate, conn):
+    _send_result(conn, lambda: float(load_plugin(path).match(probe, candidate)))
+
+
+def _run_process(target, args, path, timeout, check):
+    """Runs target(*args, conn) in a new process and returns what it sends."""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=target, args=args + (sender,), daemon=True)
+    process.start()
+    # The plugin process holds the only sender, so its exit ends the pipe
+    sender.close()
+    name = plugin_name(path)
+    status = None
+    try:
+        deadline = time.monotonic() + timeout
+        while not receiver.poll(POLL_INTERVAL):
+            if check is not None:
+                check()
+            if time.monotonic() > deadline:
+                raise PluginError(f"{name} timed out after {timeout} s")
+        try:
+            status, result = receiver.recv()
+        except EOFError:
+            process.join(EXIT_TIMEOUT)
+            raise PluginError(f"{name} crashed with exit code {process.exitcode}")
+    finally:
+        if status is not None:
+            process.join(EXIT_TIMEOUT)  # Let a plugin that answered exit cleanly
+        if process.is_alive():
+            process.kill()
+            process.join()
+        receiver.close()
+    if status != "ok":
+        raise PluginError(f"{name} failed:\n{result}")
+    return result
+
+
+def run_extractor(path, image, timeout=PLUGIN_TIMEOUT, check=None):
+    """Runs the extractor of a plugin on a PIL image. Returns {column: array}.
+
+    check() is called while the plugin runs and may raise, e.g. JobCancelled,
+    to stop it.
+    """
+    pixels = np.asarray(image.convert("L"))
+    shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    try:
+        shared = np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)
+        shared[:] = pixels
+        del shared  # An exported buffer would keep the block from closing
+        return _run_process(
+            _extract_process, (path, shm.name, pixels.shape), path, timeout, check
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def run_matcher(path, probe, candidate, timeout=PLUGIN_TIMEOUT, check=None):
+    """Compares two lists of records with the matcher of a plugin. Returns its score."""
+    args = (path, record_columns(probe), record_columns(candidate))
+    return _run_process(_match_process, args, path, timeout, check)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run an extractor or matcher plugin in an isolated process."
+    )
+    parser.add_argument("--timeout", type=float, default=PLUGIN_TIMEOUT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract = commands.add_parser("extract", help="Extract the minutiae of an image")
+    extract.add_argument("plugin", help="Plugin file defining extract(pixels)")
+    extract.add_argument("image")
+    extract.add_argument("--output", help="Write the minutiae to this .txt file")
+    match = commands.add_parser("match", help="Compare two templates")
+    match.add_argument("plugin", help="Plugin file defining match(probe, candidate)")
+    match.add_argument("probe", help="TXT or ISO template")
+    match.add_argument("candidate", help="TXT or ISO template")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "extract":
+            with open_image(args.image) as image:
+                columns = run_extractor(args.plugin, image, args.timeout)
+            records = column_records(columns)
+            if args.output:
+                write_minutiae_txt(args.output, records)
+            print(f"{plugin_name(args.plugin)} found {len(records)} minutiae")
+        else:
+            score = run_matcher(
+                args.plugin,
+                read_template(args.probe),
+                read_template(args.candidate),
+                args.timeout,
+            )
+            print(f"{plugin_name(args.plugin)} score {score:.4f}")
+    except PluginError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
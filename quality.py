@@ -0,0 +1,187 @@
+"""Local fingerprint quality per block and per capture.
+
+Three cues are combined per block, each scaled to 0 ... 1: orientation
+certainty (coherence of the gradient field), ridge clarity (how far the
+spectral peak of the ridges stands out from the rest of the spectrum) and
+frequency consistency (how well the ridge spacing agrees with the blocks
+around it). Their geometric mean is the block quality, so one bad cue is
+enough to mark a region unreliable. Background blocks get 0.
+
+Run as a script it scores every image of a folder in parallel, worst first,
+to triage captures. Results share the disk cache with the application.
+"""
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cache import cache_path, content_hash_index, file_hash
+from enhance import BLOCK_SIZE, _smooth3, foreground_mask, normalize
+from enhance import orientation_field, pad_to_blocks, spectral_peaks
+from thumbnails import scan_folder
+from images import open_image
+
+QUALITY_VERSION = 1  # Bump when the output changes to invalidate cached results
+
+# Spectral peak to mean power ratios of pure noise and of clean ridges
+NOISE_RATIO = 15.0
+CLEAR_RATIO = 80.0
+FREQUENCY_TOLERANCE = 0.25  # Relative deviation from the neighbours scoring 0
+
+# Dropdown values given to new minutiae, from quality 0 up to 1
+QUALITY_LEVELS = ("poor", "fair", "good", "very good", "excellent")
+HEATMAP_ALPHA = 96
+
+
+def quality_map(image):
+    """Returns per-block (quality in 0 ... 1, foreground mask) of a PIL image."""
+    gray = pad_to_blocks(np.asarray(image.convert("L"), dtype=np.float64))
+    norm = normalize(gray)
+    mask = foreground_mask(gray)
+
+    _, certainty = orientation_field(norm)
+    frequency, ratio = spectral_peaks(norm)
+    clarity = np.log(np.maximum(ratio, 1e-12) / NOISE_RATIO) / np.log(
+        CLEAR_RATIO / NOISE_RATIO
+    )
+
+    # Mean frequency of the foreground blocks around every block
+    weight = _smooth3(mask.astype(np.float64))
+    local = _smooth3(np.where(mask, frequency, 0.0)) / np.maximum(weight, 1.0)
+    deviation = np.abs(frequency - local) / np.maximum(local, 1e-12)
+    consistency = 1 - deviation / FREQUENCY_TOLERANCE
+
+    cues = np.clip(np.stack((certainty, clarity, consistency)), 0.0, 1.0)
+    quality = np.cbrt(cues.prod(axis=0))
+    return np.where(mask, quality, 0.0), mask
+
+
+def capture_score(quality, mask):
+    """Returns (mean foreground quality, foreground fraction) of a capture."""
+    if not mask.any():
+        return 0.0, 0.0
+    return float(quality[mask].mean()), float(mask.mean())
+
+
+def quality_label(value):
+    """Maps a quality in 0 ... 1 to one of the QUALITY_LEVELS."""
+    index = min(int(value * len(QUALITY_LEVELS)), len(QUALITY_LEVELS) - 1)
+    return QUALITY_LEVELS[max(index, 0)]
+
+
+def quality_at(quality, x, y, block=BLOCK_SIZE):
+    """Returns the block quality at an image pixel, or None outside the map."""
+    row, col = int(y) // block, int(x) // block
+    if 0 <= row < quality.shape[0] and 0 <= col < quality.shape[1]:
+        return float(quality[row, col])
+    return None
+
+
+def heatmap(quality, mask):
+    """Returns an RGBA image with one pixel per block, red (poor) to green (good).
+
+    Background blocks are transparent.
+    """
+    rgba = np.zeros(quality.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.rint(255 * np.clip(2 - 2 * quality, 0, 1))
+    rgba[..., 1] = np.rint(255 * np.clip(2 * quality, 0, 1))
+    rgba[..., 3] = np.where(mask, HEATMAP_ALPHA, 0)
+    return Image.fromarray(rgba, "RGBA")
+
+
+# --- Disk cache ---
+
+
+def quality_path(digest):
+    return cache_path("quality", digest[:2], f"{digest}_v{QUALITY_VERSION}.npz")
+
+
+def read_quality(path):
+    """Returns (quality, mask) stored by quality_file."""
+    with np.load(path) as data:
+        return data["quality"].astype(np.float64), data["mask"]
+
+
+def quality_file(src):
+    """Computes the quality map of an image file unless it is cached.
+
+    Runs inside a worker process. Returns (src, file size, mtime_ns, hash,
+    quality path, (score, foreground fraction)).
+    """
+    st = os.stat(src)
+    digest = file_hash(src)
+    dest = quality_path(digest)
+    if os.path.exists(dest):
+        quality, mask = read_quality(dest)
+    else:
+        with open_image(src) as image:
+            quality, mask = quality_map(image)
+        tmp_path = f"{dest}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, quality=quality.astype(np.float32), mask=mask)
+        os.replace(tmp_path, dest)
+    return src, st.st_size, st.st_mtime_ns, digest, dest, capture_score(quality, mask)
+
+
+class QualityCache:
+    """Quality maps on disk, keyed by the content hash of the image."""
+
+    def __init__(self):
+        self.hash_index = content_hash_index()
+
+    def lookup(self, image_path):
+        """Returns the cached quality file of an image, or None. Never reads the image."""
+        try:
+            found = self.hash_index.cached(image_path)
+        except OSError:
+            return None
+        if found and os.path.exists(quality_path(found[0])):
+            return quality_path(found[0])
+        return None
+
+    def generate(self, image_path, executor):
+        return executor.submit(quality_file, image_path)
+
+    def finished(self, result):
+        """Records a quality_file result and returns the quality path."""
+        src, size, mtime_ns, digest, dest, _ = result
+        self.hash_index.record(src, size, mtime_ns, digest)
+        return dest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the quality of captures.")
+    parser.add_argument("folder", help="Folder with fingerprint images")
+    parser.add_argument("--csv", help="Write the scores to this file")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    cache = QualityCache()
+    image_paths = scan_folder(args.folder)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(quality_file, image_paths, chunksize=8))
+    for result in results:
+        cache.finished(result)
+    cache.hash_index.save()
+
+    # Worst captures first
+    rows = sorted(
+        (score, area, os.path.basename(result[0]))
+        for result in results
+        for score, area in [result[5]]
+    )
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["image", "quality", "foreground"])
+            for score, area, name in rows:
+                writer.writerow([name, f"{score:.4f}", f"{area:.4f}"])
+    for score, area, name in rows:
+        print(f"{score:.3f}  {quality_label(score):<9}  {area:5.1%}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Recording and replay of the canvas input of annotation sessions.
+
+While recording, the events reaching the canvas handlers (clicks, drags,
+angle drags, zooms and shift-selects) are logged with their time, their
+widget coordinates and the scroll position of the canvas. The session file
+also holds the state the session started from: the image, its markup, the
+zoom level and the editor mode. Replaying loads that state into a
+FingerprintApp and feeds the events back to the same handlers, at the
+recorded pace or as fast as possible, timing every handler together with
+the canvas redraw it causes. The report lists latency percentiles per
+handler, so a slow real session can be rerun after every change:
+
+    python recording.py session.json --speed max --output latency.json
+
+The handlers draw on a Tk canvas, so replay needs a display; the recorder
+itself and the report do not import tkinter.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from images import open_image
+
+SESSION_VERSION = 1
+# Handlers whose events are recorded: the canvas mouse handlers, the zoom
+# handlers and the shift-select handlers
+RECORDED_HANDLERS = (
+    "on_canvas_click",
+    "on_canvas_drag",
+    "on_canvas_drag_angle",
+    "on_canvas_release",
+    "zoom",
+    "zoom_in",
+    "zoom_out",
+    "on_shift_press",
+    "on_shift_release",
+    "on_shift_click",
+    "on_shift_drag",
+    "on_shift_release_drag",
+)
+PERCENTILES = (50, 90, 99)
+
+
+class EventRecorder:
+    """Logs the events passed through its wrapped handlers.
+
+    `header` is the starting state stored with the session; `view` returns
+    the scroll position of the canvas as (x, y) fractions.
+    """
+
+    def __init__(self, header, view):
+        self.header = header
+        self.view = view
+        self.events = []
+        self.start = time.perf_counter()
+
+    def wrap(self, name, handler):
+        def record(event):
+            state = getattr(event, "state", 0)
+            self.events.append(
+                {
+                    "t": round(time.perf_counter() - self.start, 6),
+                    "handler": name,
+                    "x": getattr(event, "x", 0),
+                    "y": getattr(event, "y", 0),
+                    "delta": getattr(event, "delta", 0),
+                    "state": state if isinstance(state, int) else 0,
+                    "view": self.view(),
+                }
+            )
+            return handler(event)
+
+        return record
+
+    def session(self):
+        return {"version": SESSION_VERSION, **self.header, "events": self.events}
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.session(), f)
+        os.replace(tmp_path, path)
+
+
+def load_session(path):
+    with open(path) as f:
+        session = json.load(f)
+    if session.get("version") != SESSION_VERSION:
+        raise ValueError("Session was recorded by another version")
+    # Replay calls the handlers by name; accept no other methods
+    for record in session["events"]:
+        if record["handler"] not in RECORDED_HANDLERS:
+            raise ValueError(f"Unknown handler in session: {record['handler']}")
+    return session
+
+
+def replay_events(app, events, speed=None, flush=None):
+    """Feeds recorded events to the handlers of app. Returns {handler: [ms]}.
+
+    With speed None events follow each other as fast as possible, otherwise
+    at speed times the recorded pace. flush() runs after every handler and
+    is timed with it, so the latency includes the redraw it causes.
+    """
+    latencies = {}
+    start = time.perf_counter()
+    for record in events:
+        if speed:
+            delay = record["t"] / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        # Scrolling is not recorded as an event; restore it before each one
+        app.canvas.xview_moveto(record["view"][0])
+        app.canvas.yview_moveto(record["view"][1])
+        event = SimpleNamespace(
+            x=record["x"],
+            y=record["y"],
+            delta=record["delta"],
+            state=record["state"],
+            widget=app.canvas,
+        )
+        handler = getattr(app, record["handler"])
+        t0 = time.perf_counter()
+        handler(event)
+        if flush is not None:
+            flush()
+        elapsed = (time.perf_counter() - t0) * 1000
+        latencies.setdefault(record["handler"], []).append(elapsed)
+    return latencies
+
+
+def percentile(sorted_values, p):
+    """Linearly interpolated percentile of a sorted, non-empty list."""
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def latency_report(latencies):
+    """Returns {handler: {"count", "p50", "p90", "p99", "max"}} in ms."""
+    report = {}
+    for name, values in latencies.items():
+        values = sorted(values)
+        report[name] = {
+            "count": len(values),
+            **{f"p{p}": percentile(values, p) for p in PERCENTILES},
+            "max": values[-1],
+        }
+    return report
+
+
+def restore_session(app, session, image_path=None):
+    """Loads the starting state of a session into a FingerprintApp."""
+    image = open_image(image_path or session["image"])
+    image.load()
+    app.reset_minutiae()
+    app.image_path = image_path or session["image"]
+    app.original_image = image
+    app.image = image.copy()
+    app.zoom_level = session["zoom"]
+    app.editor_mode_var.set(session["editor_mode"])
+    app.toggle_editor_mode()
+    app.display_image()
+    for x, y, angle, quality, m_type in session["minutiae"]:
+        app.add_minutiae(x, y, angle, quality, m_type)
+    if session["singular_points"] is not None:
+        app.singular_points = [tuple(point) for point in session["singular_points"]]
+        app.draw_singular_points()
+    app.update_minutiae_listbox()
+    app.redraw_minutiae()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded annotation session and report handler latency."
+    )
+    parser.add_argument("session", help="Session file recorded by the application")
+    parser.add_argument(
+        "--speed",
+        default="max",
+        help="'max' for as fast as possible, or a multiple of the recorded pace",
+    )
+    parser.add_argument("--image", help="Image to use instead of the recorded path")
+    parser.add_argument("--output", help="Write the latency report to this JSON file")
+    args = parser.parse_args()
+
+    session = load_session(args.session)
+    speed = None if args.speed == "max" else float(args.speed)
+    try:
+        import tkinter as tk
+
+        root = tk.Tk()
+    except Exception as e:  # No tkinter or no display
+        sys.exit(f"Replay needs a display: {e}".splitlines()[0])
+    from fingeprint import FingerprintApp
+
+    app = FingerprintApp(root, restore=False)
+    try:
+        restore_session(app, session, args.image)
+        root.update()
+        latencies = replay_events(app, session["events"], speed, root.update)
+    finally:
+        app.on_close()
+
+    report = latency_report(latencies)
+    for name, stats in sorted(report.items()):
+        print(
+            f"{name:<24} {stats['count']:6d}  p50 {stats['p50']:8.2f}  "
+            f"p90 {stats['p90']:8.2f}  p99 {stats['p99']:8.2f}  "
+            f"max {stats['max']:8.2f} ms"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""Local HTTP/JSON service for template conversion, overlays, extraction and matching.
+
+Every operation runs in a bounded process pool. At most `max_pending`
+worker tasks may be queued or running at once; a request that would exceed
+this gets 503 with a Retry-After header, so pipelines back off instead of
+piling up work the pool cannot keep up with. A batch that could never fit
+gets 413. A task holds its slot until it ends, even if its request timed
+out. A pool broken by a dying worker is replaced, and the requests that
+had tasks in it get 500. POST /batch takes a list of
+operations and sends them to the workers in chunks of BATCH_CHUNK, one task
+per chunk, which saves the per task overhead when many small requests such
+as template comparisons are made at once.
+
+Images and ISO templates travel base64 encoded inside the JSON bodies;
+minutiae are {"x", "y", "angle", "quality", "type"} objects. Run as a
+script it serves on localhost. Nothing here imports tkinter.
+
+    POST /parse-iso       {"iso"}  -> {"width", "height", "minutiae", "cores",
+                                        "deltas", "ridge_counts"}
+    POST /encode-iso      {"width", "height", "minutiae"[, "cores", "deltas",
+                           "image"]}  -> {"iso"}
+    POST /render-overlay  {"image", "minutiae"[, "supersample"]}  -> {"image"} (PNG)
+    POST /extract         {"image"}  -> {"minutiae"}
+    POST /compare         {"a", "b"}  -> {"score", "pairs", "rotation", "translation"}
+    POST /batch           {"requests": [{"op", ...}]}  -> {"results": [{"result"} or {"error"}]}
+    GET  /health          -> {"pending", "max_pending", "workers"}
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from annotations import CORE, DELTA, RIDGE_COUNT_AREA
+from annotations import parse_extended_data, parse_ridge_counts
+from extraction import extract
+from images import open_image
+from markup import Markup
+from matching import match
+from orientation import ridge_structure
+from overlay import render_overlay
+
+DEFAULT_PORT = 8765
+MAX_PENDING = 64  # Worker tasks queued or running before requests are refused
+BATCH_CHUNK = 16  # Operations of a batch sent to a worker as one task
+MAX_BATCH = 1000
+MAX_BODY = 64 << 20  # Bytes of a request body
+REQUEST_TIMEOUT = 300  # Seconds a request waits for all of its operations
+RETRY_AFTER = 1  # Seconds suggested to refused clients
+
+
+class RequestError(ValueError):
+    """A malformed request, answered with 400."""
+
+
+# --- Operations, run inside worker processes ---
+
+
+def _decode(params, key):
+    try:
+        return base64.b64decode(params[key], validate=True)
+    except KeyError:
+        raise RequestError(f"Missing field: {key}")
+    except (TypeError, ValueError):
+        raise RequestError(f"Field is not base64: {key}")
+
+
+def _image(params):
+    try:
+        image = open_image(io.BytesIO(_decode(params, "image")))
+        image.load()
+    except OSError as e:
+        raise RequestError(f"Unreadable image: {e}")
+    return image
+
+
+def _records(params, key):
+    """Returns (x, y, angle, quality, type) records of a list of minutia objects."""
+    try:
+        return [
+            (
+                int(m["x"]),
+                int(m["y"]),
+                int(m["angle"]) % 360,
+                m.get("quality", "not set"),
+                m.get("type", "ending"),
+            )
+            for m in params[key]
+        ]
+    except KeyError as e:
+        raise RequestError(f"Missing field: {e.args[0]}")
+    except (TypeError, ValueError, AttributeError):
+        raise RequestError(f"Malformed minutiae: {key}")
+
+
+def _minutiae_json(records):
+    return [
+        {"x": x, "y": y, "angle": angle, "quality": quality, "type": m_type}
+        for x, y, angle, quality, m_type in records
+    ]
+
+
+def parse_iso(params):
+    data = _decode(params, "iso")
+    try:
+        markup = Markup.from_iso19794(data)
+        areas = parse_extended_data(data)
+    except (IndexError, ValueError):
+        raise RequestError("Malformed ISO template")
+    counts = areas.get(RIDGE_COUNT_AREA)
+    return {
+        "width": markup.width,
+        "height": markup.height,
+        "minutiae": _minutiae_json(markup.minutiae),
+        "cores": markup.cores(),
+        "deltas": markup.deltas(),
+        "ridge_counts": parse_ridge_counts(counts) if counts else [],
+    }
+
+
+def encode_iso(params):
+    """Ridge counts are only written if the image is sent along."""
+    try:
+        width, height = int(params["width"]), int(params["height"])
+        singular_points = None
+        if "cores" in params or "deltas" in params:
+            singular_points = [
+                (int(x), int(y), CORE) for x, y in params.get("cores", ())
+            ] + [(int(x), int(y), DELTA) for x, y in params.get("deltas", ())]
+    except KeyError as e:
+        raise RequestError(f"Missing field: {e.args[0]}")
+    except (TypeError, ValueError):
+        raise RequestError("Malformed size, cores or deltas")
+    markup = Markup(width, height, _records(params, "minutiae"), singular_points)
+    structure = ridge_structure(_image(params)) if "image" in params else None
+    try:
+        data = markup.to_iso19794(structure)
+    except (OverflowError, ValueError):
+        raise RequestError("Values out of range for an ISO template")
+    return {"iso": base64.b64encode(data).decode("ascii")}
+
+
+def render(params):
+    supersample = min(max(int(params.get("supersample", 2)), 1), 4)
+    image = render_overlay(
+        _image(params), _records(params, "minutiae"), None, supersample
+    )
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return {"image": base64.b64encode(out.getvalue()).decode("ascii")}
+
+
+def extract_minutiae(params):
+    return {"minutiae": _minutiae_json(extract(_image(params)))}
+
+
+def compare_templates(params):
+    result = match(_records(params, "a"), _records(params, "b"))
+    return {
+        "score": result.score,
+        "pairs": [list(pair) for pair in result.pairs],
+        "rotation": result.rotation,
+        "translation": list(result.translation),
+    }
+
+
+OPERATIONS = {
+    "parse-iso": parse_iso,
+    "encode-iso": encode_iso,
+    "render-overlay": render,
+    "extract": extract_minutiae,
+    "compare": compare_templates,
+}
+
+
+def run_operations(requests):
+    """Runs [(operation, params)] in a worker. Returns [(ok, result or message)].
+
+    Malformed requests fail on their own without failing the rest of a batch.
+    """
+    results = []
+    for name, params in requests:
+        try:
+            results.append((True, OPERATIONS[name](params)))
+        except RequestError as e:
+            results.append((False, str(e)))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+# --- Server ---
+
+
+class Overloaded(Exception):
+    """More operations were requested than the pool accepts right now."""
+
+
+class TooLarge(Exception):
+    """A batch needs more tasks than the pool ever accepts at once."""
+
+
+class AnnotationService:
+    """Process pool with a limit on the tasks queued or running."""
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        # Start the workers now, before the request threads exist
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        executor.submit(os.getpid).result()
+        return executor
+
+    def release(self, count):
+        with self.lock:
+            self.pending -= count
+
+    def restart(self, broken):
+        """Replaces a broken pool, once, whichever request notices it first."""
+        with self.lock:
+            if self.executor is broken:
+                self.executor = self.start_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, requests):
+        """Runs [(operation, params)] in the pool and returns their results in order.
+
+        Raises TooLarge if their tasks can never fit within max_pending,
+        Overloaded if they do not fit right now, FutureTimeoutError after
+        REQUEST_TIMEOUT and BrokenProcessPool if a worker died.
+        """
+        chunks = [
+            requests[i : i + BATCH_CHUNK] for i in range(0, len(requests), BATCH_CHUNK)
+        ]
+        if len(chunks) > self.max_pending:
+            raise TooLarge()
+        with self.lock:
+            if self.pending + len(chunks) > self.max_pending:
+                raise Overloaded()
+            self.pending += len(chunks)
+            executor = self.executor
+        deadline = time.monotonic() + REQUEST_TIMEOUT
+        futures = []
+        try:
+            for chunk in chunks:
+                future = executor.submit(run_operations, chunk)
+                # The slot is freed when the task ends, not when the request does
+                future.add_done_callback(lambda _: self.release(1))
+                futures.append(future)
+            return [
+                r
+                for future in futures
+                for r in future.result(max(deadline - time.monotonic(), 0))
+            ]
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()  # Chunks that have not started free their slots
+            raise
+        except BrokenProcessPool:
+            self.restart(executor)
+            raise
+        finally:
+            # Chunks that could not be submitted never hold a slot
+            if len(futures) < len(chunks):
+                self.release(len(chunks) - len(futures))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": "Not found"})
+        service = self.server.service
+        self.send_json(
+            200,
+            {
+                "pending": service.pending,
+                "max_pending": service.max_pending,
+                "workers": service.workers,
+            },
+        )
+
+    def do_POST(self):
+        name = self.path.lstrip("/")
+        if name != "batch" and name not in OPERATIONS:
+            return self.send_json(404, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self.send_json(400, {"error": "Invalid Content-Length"})
+        if length > MAX_BODY:
+            self.close_connection = True
+            return self.send_json(413, {"error": "Request body too large"})
+        try:
+            params = json.loads(self.rfile.read(length))
+            if not isinstance(params, dict):
+                raise ValueError()
+        except ValueError:
+            return self.send_json(400, {"error": "Body is not a JSON object"})
+
+        if name == "batch":
+            requests = params.get("requests")
+            if not isinstance(requests, list) or len(requests) > MAX_BATCH:
+                return self.send_json(
+                    400, {"error": f"requests must be a list of at most {MAX_BATCH}"}
+                )
+            if not all(
+                isinstance(r, dict) and r.get("op") in OPERATIONS for r in requests
+            ):
+                return self.send_json(400, {"error": "Unknown or missing op"})
+            requests = [(r["op"], r) for r in requests]
+        else:
+            requests = [(name, params)]
+
+        try:
+            results = self.server.service.run(requests)
+        except Overloaded:
+            self.send_response(503)
+            self.send_header("Retry-After", str(RETRY_AFTER))
+            return self.send_body({"error": "Too many pending requests"})
+        except TooLarge:
+            return self.send_json(
+                413, {"error": "Batch needs more tasks than the service accepts"}
+            )
+        except FutureTimeoutError:
+            return self.send_json(504, {"error": "Timed out"})
+        except BrokenProcessPool:
+            return self.send_json(
+                500, {"error": "A worker process died; the pool was restarted"}
+            )
+
+        if name == "batch":
+            return self.send_json(
+                200,
+                {
+                    "results": [
+                        {"result": value} if ok else {"error": value}
+                        for ok, value in results
+                    ]
+                },
+            )
+        ok, value = results[0]
+        if ok:
+            return self.send_json(200, value)
+        self.send_json(400, {"error": value})
+
+    def send_json(self, status, payload):
+        self.send_response(status)
+        self.send_body(payload)
+
+    def send_body(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Pipelines poll /health often; keep the console quiet
+
+
+def make_server(
+    host="127.0.0.1", port=DEFAULT_PORT, workers=None, max_pending=MAX_PENDING
+):
+    """Returns a ThreadingHTTPServer with its AnnotationService; port 0 picks a free port."""
+    service = AnnotationService(workers, max_pending)
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the annotation tools over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.workers, args.max_pending)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} with {server.service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
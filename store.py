@@ -0,0 +1,333 @@
+"""Optional SQLite store for the annotations of a whole dataset.
+
+The markups of many images live in one database file, so the dataset can be
+queried as a whole, e.g. every bifurcation with a quality below 40 in some
+region of the images. The database runs in WAL mode, so readers are not
+blocked while a background writer stores a markup. Minutiae are indexed by
+image, by type and quality, and by spatial bin of BIN_SIZE pixels, so a
+region query only visits the bins it overlaps. Imports insert in bulk, one
+transaction per chunk of images. Background threads take their connections
+from a small pool. Run as a script it imports dataset folders and queries
+the store.
+"""
+
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from annotations import find_annotation, iso_quality
+from images import open_image
+from markup import Markup
+from thumbnails import scan_folder
+
+SCHEMA_VERSION = 1
+BIN_SIZE = 16  # Pixels per side of a spatial bin of the region index
+BIN_SHIFT = 16  # Bits of the column in a bin key; wider than any ISO coordinate
+MAX_REGION_BINS = 1024  # Larger regions are filtered on the pixels alone
+POOL_SIZE = 4  # Connections kept open for background threads
+IMPORT_CHUNK = 500  # Images stored per transaction by an import
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    has_singular INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS minutiae (
+    image_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    angle INTEGER NOT NULL,
+    quality INTEGER NOT NULL,
+    quality_label TEXT,
+    type TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    PRIMARY KEY (image_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS minutiae_type_quality ON minutiae (type, quality);
+CREATE INDEX IF NOT EXISTS minutiae_bin ON minutiae (bin, type, quality, x, y);
+CREATE TABLE IF NOT EXISTS singular_points (
+    image_id INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    kind INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS singular_image ON singular_points (image_id);
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable enough with WAL, much faster
+    return conn
+
+
+class ConnectionPool:
+    """Hands out at most `size` connections, one per thread at a time."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                self.created += create
+            # Wait for a connection to come back once all have been created
+            conn = connect(self.path) if create else self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def bin_key(x, y):
+    return (y // BIN_SIZE) << BIN_SHIFT | (x // BIN_SIZE)
+
+
+def region_bins(x0, y0, x1, y1):
+    """Returns the bin keys overlapping a region, or None if there are too many."""
+    cols = range(max(x0, 0) // BIN_SIZE, max(x1, 0) // BIN_SIZE + 1)
+    rows = range(max(y0, 0) // BIN_SIZE, max(y1, 0) // BIN_SIZE + 1)
+    if len(cols) * len(rows) > MAX_REGION_BINS:
+        return None
+    return [row << BIN_SHIFT | col for row in rows for col in cols]
+
+
+def _minutia_rows(image_id, markup):
+    rows = []
+    for position, (x, y, angle, quality, m_type) in enumerate(markup.minutiae):
+        label = quality if isinstance(quality, str) else None
+        rows.append(
+            (
+                image_id,
+                position,
+                x,
+                y,
+                angle,
+                iso_quality(quality),
+                label,
+                m_type,
+                bin_key(x, y),
+            )
+        )
+    return rows
+
+
+class AnnotationStore:
+    """Markups of a dataset in one SQLite database, keyed by absolute image path."""
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, SCHEMA_VERSION):
+                raise ValueError("Annotation database was made by another version")
+            with conn:
+                conn.executescript(SCHEMA)
+                conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        self.pool.close()
+
+    def put(self, image_path, markup):
+        self.put_many([(image_path, markup)])
+
+    def put_many(self, items):
+        """Stores [(image path, Markup)] in one transaction, replacing older markups."""
+        with self.pool.connection() as conn, conn:
+            minutia_rows, singular_rows = [], []
+            for image_path, markup in items:
+                image_id = conn.execute(
+                    "INSERT INTO images (path, width, height, has_singular)"
+                    " VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET"
+                    " width = excluded.width, height = excluded.height,"
+                    " has_singular = excluded.has_singular RETURNING id",
+                    (
+                        os.path.abspath(image_path),
+                        markup.width,
+                        markup.height,
+                        markup.singular_points is not None,
+                    ),
+                ).fetchone()[0]
+                conn.execute("DELETE FROM minutiae WHERE image_id = ?", (image_id,))
+                conn.execute(
+                    "DELETE FROM singular_points WHERE image_id = ?", (image_id,)
+                )
+                minutia_rows += _minutia_rows(image_id, markup)
+                singular_rows += [
+                    (image_id, x, y, kind)
+                    for x, y, kind in markup.singular_points or ()
+                ]
+            conn.executemany(
+                "INSERT INTO minutiae VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                minutia_rows,
+            )
+            conn.executemany(
+                "INSERT INTO singular_points VALUES (?, ?, ?, ?)", singular_rows
+            )
+
+    def get(self, image_path):
+        """Returns the stored Markup of an image, or None."""
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT id, width, height, has_singular FROM images WHERE path = ?",
+                (os.path.abspath(image_path),),
+            ).fetchone()
+            if row is None:
+                return None
+            image_id, width, height, has_singular = row
+            minutiae = [
+                (x, y, angle, label or (quality if quality else "not set"), m_type)
+                for x, y, angle, quality, label, m_type in conn.execute(
+                    "SELECT x, y, angle, quality, quality_label, type FROM minutiae"
+                    " WHERE image_id = ? ORDER BY position",
+                    (image_id,),
+                )
+            ]
+            singular_points = None
+            if has_singular:
+                singular_points = conn.execute(
+                    "SELECT x, y, kind FROM singular_points WHERE image_id = ?"
+                    " ORDER BY rowid",
+                    (image_id,),
+                ).fetchall()
+        return Markup(width, height, minutiae, singular_points)
+
+    def image_paths(self):
+        with self.pool.connection() as conn:
+            return [
+                row[0] for row in conn.execute("SELECT path FROM images ORDER BY path")
+            ]
+
+    def _where(self, m_type, min_quality, max_quality, region):
+        clauses, params = [], []
+        if m_type is not None:
+            clauses.append("m.type = ?")
+            params.append(m_type)
+        if min_quality is not None:
+            clauses.append("m.quality >= ?")
+            params.append(min_quality)
+        if max_quality is not None:
+            clauses.append("m.quality <= ?")
+            params.append(max_quality)
+        if region is not None:
+            # The bins select candidates through the index, the pixels refine them
+            x0, y0, x1, y1 = region
+            bins = region_bins(x0, y0, x1, y1)
+            if bins is not None:
+                clauses.append(f"m.bin IN ({', '.join('?' * len(bins))})")
+                params += bins
+            clauses.append("m.x BETWEEN ? AND ? AND m.y BETWEEN ? AND ?")
+            params += [x0, x1, y0, y1]
+        return " AND ".join(clauses) or "1", params
+
+    def query(
+        self, m_type=None, min_quality=None, max_quality=None, region=None, limit=None
+    ):
+        """Returns (image path, x, y, angle, quality, type) of the matching minutiae.
+
+        Qualities are compared as ISO values, 0 meaning not set; region is
+        (x0, y0, x1, y1) in pixels, bounds included.
+        """
+        where, params = self._where(m_type, min_quality, max_quality, region)
+        sql = (
+            "SELECT i.path, m.x, m.y, m.angle, m.quality, m.type"
+            f" FROM minutiae m JOIN images i ON i.id = m.image_id WHERE {where}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def count(self, m_type=None, min_quality=None, max_quality=None, region=None):
+        where, params = self._where(m_type, min_quality, max_quality, region)
+        with self.pool.connection() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM minutiae m WHERE {where}", params
+            ).fetchone()[0]
+
+
+def read_markup(image_path):
+    """Reads the markup stored next to an image. Runs inside a worker process.
+
+    Returns (image path, Markup), or (image path, None) without a readable markup.
+    """
+    path = find_annotation(image_path)
+    if path is None:
+        return image_path, None
+    try:
+        with open_image(image_path) as image:
+            width, height = image.size  # Only the header is read
+        return image_path, Markup.load(path, width, height)
+    except (OSError, ValueError, IndexError):
+        return image_path, None
+
+
+def import_dataset(store, folder, workers=None):
+    """Stores the markups of every image of a folder. Returns the number stored."""
+    image_paths = scan_folder(folder)
+    stored = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        items = []
+        for image_path, markup in executor.map(read_markup, image_paths, chunksize=32):
+            if markup is not None:
+                items.append((image_path, markup))
+            if len(items) >= IMPORT_CHUNK:
+                store.put_many(items)
+                stored += len(items)
+                items = []
+        store.put_many(items)
+    return stored + len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import and query an annotation database."
+    )
+    parser.add_argument("database", help="SQLite file, created if missing")
+    parser.add_argument("--import", dest="folders", nargs="*", default=[])
+    parser.add_argument("--type", choices=["ending", "bifurcation", "other"])
+    parser.add_argument("--min-quality", type=int)
+    parser.add_argument("--max-quality", type=int)
+    parser.add_argument("--region", type=int, nargs=4, metavar=("X0", "Y0", "X1", "Y1"))
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    store = AnnotationStore(args.database)
+    for folder in args.folders:
+        print(f"{folder}: stored {import_dataset(store, folder, args.workers)} markups")
+    criteria = (args.type, args.min_quality, args.max_quality, args.region)
+    print(f"{store.count(*criteria)} matching minutiae")
+    for path, x, y, angle, quality, m_type in store.query(*criteria, args.limit):
+        print(f"{m_type:<12} {x:5d} {y:5d} {angle:4d} {quality:4d}  {path}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Tests of the agreement between two markups."""
+
+from agreement import compare
+
+REFERENCE = [(10, 10, 0, 50, "ending"), (60, 60, 90, 50, "ending")]
+
+
+def test_types_missing_from_a_markup_have_no_ratio():
+    other = [(11, 10, 5, 50, "ending"), (200, 200, 0, 50, "bifurcation")]
+    agreement = compare(REFERENCE, other)
+    assert agreement.recall("ending") == 0.5
+    assert agreement.precision("ending") == 1.0
+    assert agreement.recall("bifurcation") is None
+    assert agreement.precision("bifurcation") == 0.0
+    assert agreement.recall("other") is None
+    assert agreement.precision("other") is None
+    # The aggregate counts the minutiae of every type
+    assert agreement.precision() == 0.5
+    assert agreement.recall() == 0.5
+    assert "bifurcation: precision 0.000, recall n/a" in agreement.report()
+
+
+def test_empty_markups_have_no_ratio():
+    agreement = compare([], [])
+    assert agreement.precision() is None
+    assert agreement.recall() is None
+    assert "Precision: n/a  Recall: n/a" in agreement.report()
@@ -0,0 +1,28 @@
+"""Tests of the automatic minutiae extraction."""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from enhance import BLOCK_SIZE
+from extraction import BORDER_BLOCKS, extract
+
+
+def noisy_ridges(width, height, seed=0):
+    """Ridges whose phase wanders enough to end and fork all over the image."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float64)
+    phase = np.cumsum(rng.normal(0, 0.15, (height, width)), axis=1)
+    phase += np.cumsum(rng.normal(0, 0.15, (height, width)), axis=0)
+    ridges = 128 + 100 * np.sin(2 * np.pi * (xx + yy) / 9 + phase)
+    return Image.fromarray(np.clip(ridges, 0, 255).astype(np.uint8), "L")
+
+
+@pytest.mark.parametrize("width, height", [(97, 130), (161, 200), (200, 161)])
+def test_border_margin_is_the_same_on_every_side(width, height):
+    records = extract(noisy_ridges(width, height))
+    assert records
+    margin = BORDER_BLOCKS * BLOCK_SIZE
+    for x, y, _, _, _ in records:
+        assert margin <= x < width - margin
+        assert margin <= y < height - margin
@@ -0,0 +1,64 @@
+"""Tests of keeping the gallery index up to date with its templates."""
+
+import os
+
+import numpy as np
+import pytest
+
+import gallery
+from annotations import write_minutiae_txt
+from benchmarks import synthetic_template
+from gallery import GalleryIndex, refresh_index, refresh_jobs
+
+
+def index_folder(index, folder):
+    paths, stats, jobs = refresh_jobs(index, folder)
+    results = [gallery.index_chunk(*job) for job in jobs]
+    return refresh_index(index, paths, stats, jobs, results), jobs
+
+
+def assert_same_index(a, b):
+    assert a.paths == b.paths
+    for name in ("keys", "offsets", "sizes"):
+        assert np.array_equal(getattr(a, name), getattr(b, name))
+    # Ids of one key may come in any order
+    for i in range(len(a.keys)):
+        span = slice(a.offsets[i], a.offsets[i + 1])
+        assert sorted(a.ids[span]) == sorted(b.ids[span])
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(gallery, "CHUNK_SIZE", 4)
+    for k in range(10):
+        write_minutiae_txt(
+            tmp_path / f"t{k}.txt", synthetic_template(20, 400, 400, seed=k)
+        )
+    return tmp_path
+
+
+def test_in_place_edit_reindexes_its_chunk(folder):
+    index, jobs = index_folder(None, folder)
+    assert len(jobs) == 3
+    index.save(folder / "index.npz")
+    index = GalleryIndex.load(folder / "index.npz")
+
+    path = folder / "t5.txt"
+    folder_mtime_ns = os.stat(folder).st_mtime_ns
+    write_minutiae_txt(path, synthetic_template(30, 400, 400, seed=99))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    os.utime(folder, ns=(0, folder_mtime_ns))  # The folder looks unchanged
+
+    updated, jobs = index_folder(index, folder)
+    assert [first for _, first in jobs] == [4]
+    assert_same_index(updated, index_folder(None, folder)[0])
+    assert index_folder(updated, folder)[1] == []
+
+
+def test_added_template_rebuilds(folder):
+    index, _ = index_folder(None, folder)
+    write_minutiae_txt(folder / "a.txt", synthetic_template(20, 400, 400, seed=50))
+    updated, jobs = index_folder(index, folder)
+    assert len(jobs) == 3
+    assert updated.paths[0].endswith("a.txt")
+    assert_same_index(updated, index_folder(None, folder)[0])
@@ -0,0 +1,138 @@
+"""Tests of the HTTP service against a server on localhost."""
+
+import base64
+import http.client
+import json
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+import service
+from service import BATCH_CHUNK, make_server
+
+MAX_PENDING = 4
+MINUTIAE = [
+    {"x": 10, "y": 20, "angle": 30, "quality": 60, "type": "ending"},
+    {"x": 40, "y": 50, "angle": 300, "quality": "not set", "type": "bifurcation"},
+]
+
+
+def crash_worker(params):
+    os._exit(1)
+
+
+@pytest.fixture(scope="module")
+def server():
+    # Forked workers inherit the operation, the request handler accepts it
+    service.OPERATIONS["crash"] = crash_worker
+    server = make_server(port=0, workers=2, max_pending=MAX_PENDING)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.service.shutdown()
+    del service.OPERATIONS["crash"]
+
+
+def request(server, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection(*server.server_address[:2], timeout=60)
+    try:
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_health(server):
+    status, _, body = request(server, "GET", "/health")
+    assert status == 200
+    assert body == {"pending": 0, "max_pending": MAX_PENDING, "workers": 2}
+
+
+def test_encode_parse_round_trip(server):
+    status, _, encoded = request(
+        server,
+        "POST",
+        "/encode-iso",
+        {"width": 100, "height": 120, "minutiae": MINUTIAE, "cores": [[50, 60]]},
+    )
+    assert status == 200
+    base64.b64decode(encoded["iso"], validate=True)
+
+    status, _, parsed = request(server, "POST", "/parse-iso", encoded)
+    assert status == 200
+    assert (parsed["width"], parsed["height"]) == (100, 120)
+    assert [(m["x"], m["y"], m["type"]) for m in parsed["minutiae"]] == [
+        (10, 20, "ending"),
+        (40, 50, "bifurcation"),
+    ]
+    assert parsed["cores"] == [[50, 60]]
+    assert parsed["deltas"] == []
+
+
+def test_batch_keeps_order_and_isolates_errors(server):
+    compare = {"op": "compare", "a": MINUTIAE, "b": MINUTIAE}
+    requests = [compare] * (BATCH_CHUNK + 1) + [{"op": "parse-iso", "iso": "!"}]
+    status, _, body = request(server, "POST", "/batch", {"requests": requests})
+    assert status == 200
+    results = body["results"]
+    assert len(results) == len(requests)
+    assert all("score" in r["result"] for r in results[:-1])
+    assert results[-1] == {"error": "Field is not base64: iso"}
+
+
+@pytest.mark.parametrize(
+    "body, headers",
+    [
+        (b"not json", {}),
+        (b"[1, 2]", {}),
+        (b"{}", {"Content-Length": "-1"}),
+        (b"{}", {"Content-Length": "two"}),
+    ],
+)
+def test_malformed_requests_get_400(server, body, headers):
+    status, _, payload = request(server, "POST", "/parse-iso", body, headers)
+    assert status == 400
+    assert "error" in payload
+
+
+def test_batch_larger_than_the_pool_gets_413(server):
+    requests = [{"op": "compare", "a": [], "b": []}] * (BATCH_CHUNK * MAX_PENDING + 1)
+    status, headers, _ = request(server, "POST", "/batch", {"requests": requests})
+    assert status == 413
+    assert "Retry-After" not in headers
+
+
+def test_full_pool_gets_503(server):
+    with server.service.lock:
+        server.service.pending += MAX_PENDING
+    try:
+        status, headers, _ = request(
+            server, "POST", "/compare", {"a": MINUTIAE, "b": MINUTIAE}
+        )
+    finally:
+        server.service.release(MAX_PENDING)
+    assert status == 503
+    assert headers["Retry-After"] == str(service.RETRY_AFTER)
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="Workers only inherit the crashing operation when forked",
+)
+def test_dead_worker_gets_500_and_restarts_the_pool(server):
+    status, _, _ = request(server, "POST", "/batch", {"requests": [{"op": "crash"}]})
+    assert status == 500
+    status, _, body = request(
+        server, "POST", "/compare", {"a": MINUTIAE, "b": MINUTIAE}
+    )
+    assert status == 200
+    assert "score" in body
+    status, _, health = request(server, "GET", "/health")
+    assert health["pending"] == 0
@@ -0,0 +1,55 @@
+"""Tests of the WSQ decoder against images decoded by the NBIS reference.
+
+The fixtures are synthetic ridge images encoded with the NBIS encoder, at
+0.75 and 2.25 bits per pixel, and the PNG of what the NBIS decoder makes
+of them. The decoder must reproduce NBIS exactly.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from wsq_decoder import WsqError, decode, read_size
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FIXTURES = ["ridges_64x65", "ridges_97x130"]
+
+
+def fixture(name, extension):
+    return os.path.join(DATA, f"{name}.{extension}")
+
+
+def reference(name):
+    with Image.open(fixture(name, "png")) as image:
+        return np.asarray(image.convert("L"))
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_decode_matches_nbis(name):
+    with open(fixture(name, "wsq"), "rb") as f:
+        pixels = decode(f.read())
+    expected = reference(name)
+    assert pixels.dtype == np.uint8
+    assert pixels.shape == expected.shape
+    assert np.array_equal(pixels, expected)
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_pil_plugin_matches_nbis(name):
+    with Image.open(fixture(name, "wsq")) as image:
+        assert image.format == "WSQ"
+        assert np.array_equal(np.asarray(image.convert("L")), reference(name))
+
+
+def test_read_size():
+    with open(fixture("ridges_97x130", "wsq"), "rb") as f:
+        assert read_size(f.read()) == (97, 130)
+
+
+def test_truncated_data_raises():
+    with open(fixture("ridges_64x65", "wsq"), "rb") as f:
+        data = f.read()
+    with pytest.raises(WsqError):
+        decode(data[: len(data) // 2])
@@ -0,0 +1,86 @@
+import os
+
+from cache import cache_path, content_hash_index, file_hash
+from images import open_image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".wsq")
+THUMBNAIL_SIZE = (96, 96)
+
+
+def scan_folder(folder):
+    """Returns the sorted paths of all images in a folder."""
+    return sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def thumbnail_path(digest, mtime_ns, size=THUMBNAIL_SIZE):
+    name = f"{digest}_{mtime_ns}_{size[0]}x{size[1]}.png"
+    return cache_path("thumbnails", digest[:2], name)
+
+
+def build_thumbnail(src, size=THUMBNAIL_SIZE):
+    """Hashes an image and renders its thumbnail unless one is already cached.
+
+    Runs inside a worker process. Returns (src, file size, mtime_ns, hash,
+    thumbnail path) so the caller can update its hash index.
+    """
+    st = os.stat(src)
+    digest = file_hash(src)
+    dest = thumbnail_path(digest, st.st_mtime_ns, size)
+    if not os.path.exists(dest):
+        with open_image(src) as image:
+            image.draft("L", size)  # Lets JPEG decode at reduced scale
+            image.thumbnail(size)
+            if image.mode not in ("L", "RGB"):
+                image = image.convert("RGB")
+            tmp_path = f"{dest}.{os.getpid()}.tmp.png"
+            image.save(tmp_path)
+        os.replace(tmp_path, dest)
+    return src, st.st_size, st.st_mtime_ns, digest, dest
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache keyed by file content hash and mtime.
+
+    Files whose size and mtime match the hash index are resolved without
+    reading or decoding them; everything else goes to a worker pool.
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE):
+        self.size = size
+        self.hash_index = content_hash_index()
+
+    def split(self, image_paths):
+        """Returns ({image: thumbnail} already cached, [images] needing a worker)."""
+        cached, missing = {}, []
+        for image_path in image_paths:
+            try:
+                found = self.hash_index.cached(image_path)
+            except OSError:
+                continue
+            if found:
+                thumb = thumbnail_path(found[0], found[1], self.size)
+                if os.path.exists(thumb):
+                    cached[image_path] = thumb
+                    continue
+            missing.append(image_path)
+        return cached, missing
+
+    def generate(self, image_paths, executor):
+        """Submits thumbnail generation to an executor. Returns {future: image path}."""
+        return {
+            executor.submit(build_thumbnail, image_path, self.size): image_path
+            for image_path in image_paths
+        }
+
+    def finished(self, result):
+        """Records a build_thumbnail result and returns the thumbnail path."""
+        src, size, mtime_ns, digest, dest = result
+        self.hash_index.record(src, size, mtime_ns, digest)
+        return dest
+
+    def save(self):
+        self.hash_index.save()
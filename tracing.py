@@ -0,0 +1,147 @@
+"""Lightweight span tracing of the hot paths of the application.
+
+Spans are kept in a ring buffer of the last BUFFER_SIZE events and can be
+exported as Chrome trace event JSON, to be opened in chrome://tracing or
+Perfetto. Tracing is off by default: a `traced` function then only tests one
+module flag before calling through, and `span` hands out a shared no-op
+context manager. Worker processes keep their own buffers, which are not
+collected.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+BUFFER_SIZE = 100_000  # Spans kept; older ones are dropped
+
+enabled = False
+# (name, category, start ns, duration ns, thread, args) of the recorded spans
+_events = deque(maxlen=BUFFER_SIZE)
+_latest = {}  # Span name -> duration in ns of its last occurrence
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def record(name, category, start_ns, duration_ns, args=None):
+    _events.append((name, category, start_ns, duration_ns, threading.get_ident(), args))
+    _latest[name] = duration_ns
+
+
+class _Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(
+            self.name,
+            self.category,
+            self.start,
+            time.perf_counter_ns() - self.start,
+            self.args,
+        )
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, category="app", **args):
+    """Returns a context manager recording a span, a no-op while disabled."""
+    if not enabled:
+        return _NO_SPAN
+    return _Span(name, category, args or None)
+
+
+def traced(name=None, category="app"):
+    """Decorates a function to record a span for every call while enabled."""
+
+    def decorate(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(span_name, category, start, time.perf_counter_ns() - start)
+
+        return wrapper
+
+    return decorate
+
+
+def latest(name):
+    """Returns the duration in ms of the last span with this name, or None."""
+    duration = _latest.get(name)
+    return None if duration is None else duration / 1e6
+
+
+def clear():
+    _events.clear()
+    _latest.clear()
+
+
+def summary():
+    """Returns {name: (count, mean ms, max ms)} of the buffered spans."""
+    stats = {}
+    for name, _, _, duration, _, _ in list(_events):
+        count, total, peak = stats.get(name, (0, 0, 0))
+        stats[name] = (count + 1, total + duration, max(peak, duration))
+    return {
+        name: (count, total / count / 1e6, peak / 1e6)
+        for name, (count, total, peak) in stats.items()
+    }
+
+
+def chrome_trace():
+    """Returns the buffered spans as a Chrome trace event document."""
+    pid = os.getpid()
+    return {
+        "traceEvents": [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",  # Complete event: start and duration
+                "ts": start / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": thread,
+                **({"args": args} if args else {}),
+            }
+            for name, category, start, duration, thread, args in list(_events)
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def export_chrome_trace(path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(chrome_trace(), f)
+    os.replace(tmp_path, path)
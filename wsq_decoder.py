@@ -0,0 +1,769 @@
+"""Decoder for FBI WSQ (Wavelet Scalar Quantization) fingerprint images.
+
+Follows the reference NBIS decoder: Huffman decoding of the quantized
+subbands, dequantization and the inverse wavelet transform. The wavelet
+synthesis is vectorized by turning the reference scanline filter into a
+gather of (source index, weight) terms that is applied to every row or
+column at once. Importing this module registers WSQ with PIL, so
+`Image.open` reads .wsq files; the application opens images through
+images.open_image, which imports it when needed.
+"""
+
+import numpy as np
+from PIL import Image, ImageFile
+
+# WSQ markers
+SOI = 0xFFA0
+EOI = 0xFFA1
+SOF = 0xFFA2
+SOB = 0xFFA3
+DTT = 0xFFA4
+DQT = 0xFFA5
+DHT = 0xFFA6
+DRT = 0xFFA7
+COM = 0xFFA8
+
+NUM_SUBBANDS = 60  # Subbands 60-63 are never coded
+f32 = np.float32
+
+
+class WsqError(ValueError):
+    pass
+
+
+def _scaled(value, scale):
+    # Mirrors the reference decoder, which divides a float by 10 `scale` times
+    result = f32(value)
+    for _ in range(scale):
+        result = f32(float(result) / 10.0)
+    return result
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise WsqError("Unexpected end of WSQ data")
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def ushort(self):
+        return (self.byte() << 8) | self.byte()
+
+    def uint(self):
+        return (self.ushort() << 16) | self.ushort()
+
+    def marker(self):
+        marker = self.ushort()
+        if marker >> 8 != 0xFF:
+            raise WsqError(f"Expected a WSQ marker at byte {self.pos - 2}")
+        return marker
+
+    def entropy_segment(self):
+        """Returns the unstuffed entropy-coded bytes up to the next marker."""
+        data = self.data
+        end = data.find(b"\xff", self.pos)
+        while end != -1 and end + 1 < len(data) and data[end + 1] == 0x00:
+            end = data.find(b"\xff", end + 2)
+        if end == -1:
+            end = len(data)
+        segment = data[self.pos : end].replace(b"\xff\x00", b"\xff")
+        self.pos = end
+        return segment
+
+
+class _Tables:
+    def __init__(self):
+        self.lofilt = None
+        self.hifilt = None
+        self.bin_center = None
+        self.q_bin = None
+        self.z_bin = None
+        self.huffman = {}  # table id -> (huffbits, huffvalues)
+
+    def read(self, marker, reader):
+        size = reader.ushort()
+        end = reader.pos + size - 2
+        if marker == DTT:
+            self.read_transform_table(reader)
+        elif marker == DQT:
+            self.read_quantization_table(reader)
+        elif marker == DHT:
+            while reader.pos < end:
+                table_id = reader.byte()
+                huffbits = [reader.byte() for _ in range(16)]
+                huffvalues = [reader.byte() for _ in range(sum(huffbits))]
+                self.huffman[table_id] = (huffbits, huffvalues)
+        elif marker not in (COM, DRT):
+            raise WsqError(f"Unexpected WSQ marker {marker:#06x}")
+        reader.pos = end
+
+    def read_transform_table(self, reader):
+        hisz = reader.byte()
+        losz = reader.byte()
+        hifilt = [f32(0)] * hisz
+        lofilt = [f32(0)] * losz
+
+        # Only half of each symmetric filter is stored; the lowpass analysis
+        # coefficients define the highpass synthesis filter and vice versa
+        a_size = (hisz + 1) // 2 - 1 if hisz % 2 else hisz // 2 - 1
+        for cnt in range(a_size + 1):
+            sign, scale, value = reader.byte(), reader.byte(), reader.uint()
+            coef = _scaled(value, scale) * (-1 if sign else 1)
+            if hisz % 2:
+                hifilt[cnt + a_size] = f32((-1) ** cnt * coef)
+                if cnt > 0:
+                    hifilt[a_size - cnt] = hifilt[cnt + a_size]
+            else:
+                hifilt[cnt + a_size + 1] = f32((-1) ** cnt * coef)
+                hifilt[a_size - cnt] = -hifilt[cnt + a_size + 1]
+
+        a_size = (losz + 1) // 2 - 1 if losz % 2 else losz // 2 - 1
+        for cnt in range(a_size + 1):
+            sign, scale, value = reader.byte(), reader.byte(), reader.uint()
+            coef = _scaled(value, scale) * (-1 if sign else 1)
+            if losz % 2:
+                lofilt[cnt + a_size] = f32((-1) ** cnt * coef)
+                if cnt > 0:
+                    lofilt[a_size - cnt] = lofilt[cnt + a_size]
+            else:
+                lofilt[cnt + a_size + 1] = f32((-1) ** (cnt + 1) * coef)
+                lofilt[a_size - cnt] = lofilt[cnt + a_size + 1]
+
+        self.hifilt = hifilt
+        self.lofilt = lofilt
+
+    def read_quantization_table(self, reader):
+        scale, value = reader.byte(), reader.ushort()
+        self.bin_center = _scaled(value, scale)
+        q_bin, z_bin = [], []
+        for _ in range(64):
+            scale, value = reader.byte(), reader.ushort()
+            q_bin.append(_scaled(value, scale))
+            scale, value = reader.byte(), reader.ushort()
+            z_bin.append(_scaled(value, scale))
+        self.q_bin = q_bin
+        self.z_bin = z_bin
+
+
+def _read_frame_header(reader):
+    reader.ushort()  # Header size
+    reader.byte()  # Black
+    reader.byte()  # White
+    height = reader.ushort()
+    width = reader.ushort()
+    scale = reader.byte()
+    m_shift = _scaled(reader.ushort(), scale)
+    scale = reader.byte()
+    r_scale = _scaled(reader.ushort(), scale)
+    reader.byte()  # Encoder id
+    reader.ushort()  # Software implementation
+    return width, height, m_shift, r_scale
+
+
+def read_size(data):
+    """Returns (width, height) from the frame header of a WSQ file."""
+    reader = _Reader(data)
+    if reader.marker() != SOI:
+        raise WsqError("Not a WSQ file")
+    marker = reader.marker()
+    while marker != SOF:
+        size = reader.ushort()
+        reader.pos += size - 2
+        marker = reader.marker()
+    width, height, _, _ = _read_frame_header(reader)
+    return width, height
+
+
+# --- Subband geometry (ports of the reference w_tree / q_tree builders) ---
+
+
+def _w_tree4(w_tree, p1, p2, lenx, leny, x, y, stop1):
+    w_tree[p1].update(x=x, y=y, lenx=lenx, leny=leny)
+    w_tree[p2]["x"] = x
+    w_tree[p2 + 2]["x"] = x
+    w_tree[p2]["y"] = y
+    w_tree[p2 + 1]["y"] = y
+    if lenx % 2 == 0:
+        w_tree[p2]["lenx"] = lenx // 2
+        w_tree[p2 + 1]["lenx"] = w_tree[p2]["lenx"]
+    elif p1 == 4:
+        w_tree[p2]["lenx"] = (lenx - 1) // 2
+        w_tree[p2 + 1]["lenx"] = w_tree[p2]["lenx"] + 1
+    else:
+        w_tree[p2]["lenx"] = (lenx + 1) // 2
+        w_tree[p2 + 1]["lenx"] = w_tree[p2]["lenx"] - 1
+    w_tree[p2 + 1]["x"] = w_tree[p2]["lenx"] + x
+    if not stop1:
+        w_tree[p2 + 3]["lenx"] = w_tree[p2 + 1]["lenx"]
+        w_tree[p2 + 3]["x"] = w_tree[p2 + 1]["x"]
+    w_tree[p2 + 2]["lenx"] = w_tree[p2]["lenx"]
+
+    if leny % 2 == 0:
+        w_tree[p2]["leny"] = leny // 2
+        w_tree[p2 + 2]["leny"] = w_tree[p2]["leny"]
+    elif p1 == 5:
+        w_tree[p2]["leny"] = (leny - 1) // 2
+        w_tree[p2 + 2]["leny"] = w_tree[p2]["leny"] + 1
+    else:
+        w_tree[p2]["leny"] = (leny + 1) // 2
+        w_tree[p2 + 2]["leny"] = w_tree[p2]["leny"] - 1
+    w_tree[p2 + 2]["y"] = w_tree[p2]["leny"] + y
+    if not stop1:
+        w_tree[p2 + 3]["leny"] = w_tree[p2 + 2]["leny"]
+        w_tree[p2 + 3]["y"] = w_tree[p2 + 2]["y"]
+    w_tree[p2 + 1]["leny"] = w_tree[p2]["leny"]
+
+
+def build_w_tree(width, height):
+    w_tree = [dict(x=0, y=0, lenx=0, leny=0, inv_rw=0, inv_cl=0) for _ in range(20)]
+    for node in (2, 4, 7, 9, 11, 13, 16, 18):
+        w_tree[node]["inv_rw"] = 1
+    for node in (3, 5, 8, 9, 12, 13, 17, 18):
+        w_tree[node]["inv_cl"] = 1
+
+    _w_tree4(w_tree, 0, 1, width, height, 0, 0, 1)
+    if w_tree[1]["lenx"] % 2 == 0:
+        lenx = lenx2 = w_tree[1]["lenx"] // 2
+    else:
+        lenx = (w_tree[1]["lenx"] + 1) // 2
+        lenx2 = lenx - 1
+    if w_tree[1]["leny"] % 2 == 0:
+        leny = leny2 = w_tree[1]["leny"] // 2
+    else:
+        leny = (w_tree[1]["leny"] + 1) // 2
+        leny2 = leny - 1
+    _w_tree4(w_tree, 4, 6, lenx2, leny, lenx, 0, 0)
+    _w_tree4(w_tree, 5, 10, lenx, leny2, 0, leny, 0)
+    _w_tree4(w_tree, 14, 15, lenx, leny, 0, 0, 0)
+    w_tree[19].update(
+        x=0,
+        y=0,
+        lenx=(w_tree[15]["lenx"] + 1) // 2,
+        leny=(w_tree[15]["leny"] + 1) // 2,
+    )
+    return w_tree
+
+
+def _q_tree4(q_tree, p, lenx, leny, x, y):
+    q_tree[p]["x"] = x
+    q_tree[p + 2]["x"] = x
+    q_tree[p]["y"] = y
+    q_tree[p + 1]["y"] = y
+    if lenx % 2 == 0:
+        half = lenx // 2
+        for i in range(4):
+            q_tree[p + i]["lenx"] = half
+    else:
+        q_tree[p]["lenx"] = (lenx + 1) // 2
+        q_tree[p + 1]["lenx"] = q_tree[p]["lenx"] - 1
+        q_tree[p + 2]["lenx"] = q_tree[p]["lenx"]
+        q_tree[p + 3]["lenx"] = q_tree[p + 1]["lenx"]
+    q_tree[p + 1]["x"] = x + q_tree[p]["lenx"]
+    q_tree[p + 3]["x"] = q_tree[p + 1]["x"]
+    if leny % 2 == 0:
+        half = leny // 2
+        for i in range(4):
+            q_tree[p + i]["leny"] = half
+    else:
+        q_tree[p]["leny"] = (leny + 1) // 2
+        q_tree[p + 1]["leny"] = q_tree[p]["leny"]
+        q_tree[p + 2]["leny"] = q_tree[p]["leny"] - 1
+        q_tree[p + 3]["leny"] = q_tree[p + 2]["leny"]
+    q_tree[p + 2]["y"] = y + q_tree[p]["leny"]
+    q_tree[p + 3]["y"] = q_tree[p + 2]["y"]
+
+
+def _q_tree16(q_tree, p, lenx, leny, x, y, rw, cl):
+    if lenx % 2 == 0:
+        tempx = temp2x = lenx // 2
+    elif cl:
+        temp2x = (lenx + 1) // 2
+        tempx = temp2x - 1
+    else:
+        tempx = (lenx + 1) // 2
+        temp2x = tempx - 1
+    if leny % 2 == 0:
+        tempy = temp2y = leny // 2
+    elif rw:
+        temp2y = (leny + 1) // 2
+        tempy = temp2y - 1
+    else:
+        tempy = (leny + 1) // 2
+        temp2y = tempy - 1
+
+    # Top-left quarter
+    _q_tree4(q_tree, p, tempx, tempy, x, y)
+
+    # Top-right quarter
+    q_tree[p + 4]["x"] = x + tempx
+    q_tree[p + 6]["x"] = q_tree[p + 4]["x"]
+    q_tree[p + 4]["y"] = y
+    q_tree[p + 5]["y"] = y
+    q_tree[p + 6]["y"] = q_tree[p + 2]["y"]
+    q_tree[p + 7]["y"] = q_tree[p + 2]["y"]
+    q_tree[p + 4]["leny"] = q_tree[p]["leny"]
+    q_tree[p + 5]["leny"] = q_tree[p]["leny"]
+    q_tree[p + 6]["leny"] = q_tree[p + 2]["leny"]
+    q_tree[p + 7]["leny"] = q_tree[p + 2]["leny"]
+    if temp2x % 2 == 0:
+        half = temp2x // 2
+        for i in range(4, 8):
+            q_tree[p + i]["lenx"] = half
+    else:
+        q_tree[p + 5]["lenx"] = (temp2x + 1) // 2
+        q_tree[p + 4]["lenx"] = q_tree[p + 5]["lenx"] - 1
+        q_tree[p + 6]["lenx"] = q_tree[p + 4]["lenx"]
+        q_tree[p + 7]["lenx"] = q_tree[p + 5]["lenx"]
+    q_tree[p + 5]["x"] = q_tree[p + 4]["x"] + q_tree[p + 4]["lenx"]
+    q_tree[p + 7]["x"] = q_tree[p + 5]["x"]
+
+    # Bottom-left quarter
+    q_tree[p + 8]["x"] = x
+    q_tree[p + 9]["x"] = q_tree[p + 1]["x"]
+    q_tree[p + 10]["x"] = x
+    q_tree[p + 11]["x"] = q_tree[p + 1]["x"]
+    q_tree[p + 8]["y"] = y + tempy
+    q_tree[p + 9]["y"] = q_tree[p + 8]["y"]
+    q_tree[p + 8]["lenx"] = q_tree[p]["lenx"]
+    q_tree[p + 9]["lenx"] = q_tree[p + 1]["lenx"]
+    q_tree[p + 10]["lenx"] = q_tree[p]["lenx"]
+    q_tree[p + 11]["lenx"] = q_tree[p + 1]["lenx"]
+    if temp2y % 2 == 0:
+        half = temp2y // 2
+        for i in range(8, 12):
+            q_tree[p + i]["leny"] = half
+    else:
+        q_tree[p + 10]["leny"] = (temp2y + 1) // 2
+        q_tree[p + 11]["leny"] = q_tree[p + 10]["leny"]
+        q_tree[p + 8]["leny"] = q_tree[p + 10]["leny"] - 1
+        q_tree[p + 9]["leny"] = q_tree[p + 8]["leny"]
+    q_tree[p + 10]["y"] = q_tree[p + 8]["y"] + q_tree[p + 8]["leny"]
+    q_tree[p + 11]["y"] = q_tree[p + 10]["y"]
+
+    # Bottom-right quarter
+    for i, (sx, sy) in enumerate(((4, 8), (5, 8), (4, 10), (5, 10))):
+        q_tree[p + 12 + i].update(
+            x=q_tree[p + sx]["x"],
+            y=q_tree[p + sy]["y"],
+            lenx=q_tree[p + sx]["lenx"],
+            leny=q_tree[p + sy]["leny"],
+        )
+
+
+def build_q_tree(w_tree):
+    q_tree = [dict(x=0, y=0, lenx=0, leny=0) for _ in range(64)]
+
+    def node(n):
+        return w_tree[n]["lenx"], w_tree[n]["leny"], w_tree[n]["x"], w_tree[n]["y"]
+
+    # The order matters: later calls overwrite shared subband slots
+    _q_tree16(q_tree, 3, *node(14), 0, 0)
+    _q_tree16(q_tree, 19, *node(4), 0, 1)
+    _q_tree16(q_tree, 48, *node(0), 0, 0)
+    _q_tree16(q_tree, 35, *node(5), 1, 0)
+    _q_tree4(q_tree, 0, *node(19))
+    return q_tree
+
+
+# --- Huffman decoding ---
+
+
+def _huffman_lookup(huffbits, huffvalues):
+    """Builds 16-bit lookahead tables mapping a bit window to (symbol, length)."""
+    symbols = np.zeros(1 << 16, dtype=np.int32)
+    lengths = np.zeros(1 << 16, dtype=np.int32)
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        shift = 16 - length
+        for _ in range(huffbits[length - 1]):
+            symbols[code << shift : (code + 1) << shift] = huffvalues[k]
+            lengths[code << shift : (code + 1) << shift] = length
+            code += 1
+            k += 1
+        code <<= 1
+    return symbols.tolist(), lengths.tolist()
+
+
+def _decode_block(segment, symbols, lengths):
+    """Decodes one entropy-coded block.
+
+    Returns (coefficient count, positions of non-zero coefficients, values).
+    Zero runs are skipped rather than materialized.
+    """
+    buf = np.frombuffer(segment + b"\x00\x00\x00\x00", dtype=np.uint8).astype(np.uint32)
+    # words[i] holds the 32 bits starting at byte i, so any 16-bit code plus
+    # up to 16 extra bits can be read with a single shift and mask
+    words = ((buf[:-3] << 24) | (buf[1:-2] << 16) | (buf[2:-1] << 8) | buf[3:]).tolist()
+    total = len(segment) * 8
+
+    pos = 0
+    ip = 0
+    positions = []
+    values = []
+    while pos < total:
+        peek = (words[pos >> 3] >> (16 - (pos & 7))) & 0xFFFF
+        n = lengths[peek]
+        if n == 0 or pos + n > total:
+            break  # Only padding bits are left
+        pos += n
+        symbol = symbols[peek]
+
+        if 0 < symbol <= 100:
+            ip += symbol  # Zero run
+        elif 106 < symbol < 0xFF:
+            positions.append(ip)
+            values.append(symbol - 180)
+            ip += 1
+        elif 101 <= symbol <= 106:
+            nbits = 8 if symbol in (101, 102, 105) else 16
+            if pos + nbits > total:
+                raise WsqError("Truncated WSQ block")
+            extra = (words[pos >> 3] >> (32 - (pos & 7) - nbits)) & ((1 << nbits) - 1)
+            pos += nbits
+            if symbol in (105, 106):
+                ip += extra  # Long zero run
+            else:
+                positions.append(ip)
+                values.append(extra if symbol in (101, 103) else -extra)
+                ip += 1
+        else:
+            raise WsqError(f"Invalid WSQ Huffman symbol {symbol}")
+    return ip, positions, values
+
+
+# --- Wavelet synthesis ---
+
+
+def _synthesis_terms(len2, lo, hi, inv):
+    """Port of the reference join_lets for a single scanline of length len2.
+
+    Instead of filtering floats it records, for every output sample, the
+    ordered list of (input index, weight) terms that the reference code sums,
+    so the same arithmetic can be applied to all scanlines with NumPy.
+    """
+    lsz, hsz = len(lo), len(hi)
+    da_ev = len2 % 2
+    fi_ev = lsz % 2
+    if da_ev:
+        llen = (len2 + 1) // 2
+        hlen = llen - 1
+    else:
+        llen = len2 // 2
+        hlen = llen
+
+    if fi_ev:
+        asym = False
+        ssfac = 1.0
+        ofhre = 0
+        loc = (lsz - 1) // 4
+        hoc = (hsz + 1) // 4 - 1
+        lotap = ((lsz - 1) // 2) % 2
+        hotap = ((hsz + 1) // 2) % 2
+        if da_ev:
+            olle, olre, ohle, ohre = 0, 0, 1, 1
+        else:
+            olle, olre, ohle, ohre = 0, 1, 1, 0
+    else:
+        asym = True
+        ssfac = -1.0
+        ofhre = 2
+        loc = lsz // 4 - 1
+        hoc = hsz // 4 - 1
+        lotap = (lsz // 2) % 2
+        hotap = (hsz // 2) % 2
+        if da_ev:
+            olle, olre, ohle, ohre = 1, 0, 1, 1
+        else:
+            olle, olre, ohle, ohre = 1, 1, 1, 1
+        if loc == -1:
+            loc = 0
+            olle = 0
+        if hoc == -1:
+            hoc = 0
+            ohle = 0
+        hi = [-h for h in hi]
+
+    out = [[] for _ in range(max(len2, 2))]
+    limg = himg = 0
+    if inv:
+        hipass = 0
+        lopass = hlen
+    else:
+        lopass = 0
+        hipass = llen
+
+    lp0 = lopass
+    lp1 = lp0 + llen - 1
+    lspx = lp0 + loc
+    lspxstr = -1
+    lstap = lotap
+    lle2, lre2 = olle, olre
+
+    hp0 = hipass
+    hp1 = hp0 + hlen - 1
+    hspx = hp0 + hoc
+    hspxstr = -1
+    hstap = hotap
+    hle2, hre2 = ohle, ohre
+    osfac = ssfac
+    fhre = 0
+
+    def lowpass(tap):
+        lle, lre = lle2, lre2
+        lpx, lpxstr = lspx, lspxstr
+        terms = [(lpx, lo[tap])]
+        for i in range(tap + 2, lsz, 2):
+            if lpx == lp0:
+                if lle:
+                    lpxstr = 0
+                    lle = 0
+                else:
+                    lpxstr = 1
+            if lpx == lp1:
+                if lre:
+                    lpxstr = 0
+                    lre = 0
+                else:
+                    lpxstr = -1
+            lpx += lpxstr
+            terms.append((lpx, lo[i]))
+        return terms
+
+    def highpass(tap, fhre):
+        hle, hre = hle2, hre2
+        hpx, hpxstr = hspx, hspxstr
+        sfac = osfac
+        terms = []
+        for i in range(tap, hsz, 2):
+            if hpx == hp0:
+                if hle:
+                    hpxstr = 0
+                    hle = 0
+                else:
+                    hpxstr = 1
+                    sfac = 1.0
+            if hpx == hp1:
+                if hre:
+                    hpxstr = 0
+                    hre = 0
+                    if asym and da_ev:
+                        hre = 1
+                        fhre -= 1
+                        sfac = float(fhre)
+                        if sfac == 0.0:
+                            hre = 0
+                else:
+                    hpxstr = -1
+                    if asym:
+                        sfac = -1.0
+            terms.append((hpx, f32(hi[i] * sfac)))
+            hpx += hpxstr
+        return terms
+
+    for _ in range(hlen):
+        for tap in range(lstap, -1, -1):
+            out[limg] = lowpass(tap)  # Lowpass output overwrites the sample
+            limg += 1
+        if lspx == lp0:
+            if lle2:
+                lspxstr = 0
+                lle2 = 0
+            else:
+                lspxstr = 1
+        lspx += lspxstr
+        lstap = 1
+
+        for tap in range(hstap, -1, -1):
+            out[himg] += highpass(tap, ofhre)
+            himg += 1
+        if hspx == hp0:
+            if hle2:
+                hspxstr = 0
+                hle2 = 0
+            else:
+                hspxstr = 1
+                osfac = 1.0
+        hspx += hspxstr
+        hstap = 1
+
+    if da_ev:
+        lstap = 1 if lotap else 0
+    else:
+        lstap = 2 if lotap else 1
+    for tap in range(1, lstap - 1, -1):
+        out[limg] = lowpass(tap)
+        limg += 1
+
+    if da_ev:
+        hstap = 1 if hotap else 0
+        if hsz == 2:
+            hspx -= hspxstr
+            fhre = 1
+    else:
+        hstap = 2 if hotap else 1
+    for tap in range(1, hstap - 1, -1):
+        out[himg] += highpass(tap, fhre if hsz == 2 else ofhre)
+        himg += 1
+
+    # Pack into dense (len2, K) index and weight arrays; padding adds 0 * x
+    out = out[:len2]
+    width = max(len(terms) for terms in out)
+    src = np.zeros((len2, width), dtype=np.intp)
+    weights = np.zeros((len2, width), dtype=f32)
+    for j, terms in enumerate(out):
+        for k, (index, weight) in enumerate(terms):
+            src[j, k] = index
+            weights[j, k] = weight
+    return src, weights
+
+
+def _synthesize(block, axis, terms):
+    src, weights = terms
+    if axis == 0:
+        out = block[src[:, 0], :] * weights[:, 0, None]
+        for k in range(1, src.shape[1]):
+            out += block[src[:, k], :] * weights[:, k, None]
+    else:
+        out = block[:, src[:, 0]] * weights[None, :, 0]
+        for k in range(1, src.shape[1]):
+            out += block[:, src[:, k]] * weights[None, :, k]
+    return out
+
+
+def _reconstruct(fdata, w_tree, lofilt, hifilt):
+    cache = {}
+
+    def terms(length, inv):
+        if (length, inv) not in cache:
+            cache[length, inv] = _synthesis_terms(length, lofilt, hifilt, inv)
+        return cache[length, inv]
+
+    for node in reversed(w_tree):
+        x, y, lenx, leny = node["x"], node["y"], node["lenx"], node["leny"]
+        region = fdata[y : y + leny, x : x + lenx]
+        columns = _synthesize(region, 0, terms(leny, node["inv_cl"]))
+        fdata[y : y + leny, x : x + lenx] = _synthesize(
+            columns, 1, terms(lenx, node["inv_rw"])
+        )
+
+
+# --- Decoder ---
+
+
+def decode(data):
+    """Decodes a WSQ file held in memory into a uint8 array of shape (height, width)."""
+    data = bytes(data)
+    reader = _Reader(data)
+    if reader.marker() != SOI:
+        raise WsqError("Not a WSQ file")
+
+    tables = _Tables()
+    marker = reader.marker()
+    while marker != SOF:
+        tables.read(marker, reader)
+        marker = reader.marker()
+    width, height, m_shift, r_scale = _read_frame_header(reader)
+
+    # Entropy-coded blocks, possibly interleaved with more tables
+    blocks = []
+    marker = reader.marker() if reader.pos < len(data) else EOI
+    while marker != EOI:
+        if marker == SOB:
+            reader.ushort()  # Header size
+            table_id = reader.byte()
+            if table_id not in tables.huffman:
+                raise WsqError(f"Huffman table {table_id} is not defined")
+            symbols, lengths = _huffman_lookup(*tables.huffman[table_id])
+            blocks.append(_decode_block(reader.entropy_segment(), symbols, lengths))
+        else:
+            tables.read(marker, reader)
+        marker = reader.marker() if reader.pos < len(data) else EOI
+
+    if tables.q_bin is None or tables.lofilt is None:
+        raise WsqError("WSQ quantization or transform table missing")
+
+    # Concatenate the sparse block outputs into the quantized coefficient stream
+    total = sum(count for count, _, _ in blocks)
+    qdata = np.zeros(total, dtype=np.int32)
+    offset = 0
+    for count, positions, values in blocks:
+        if positions:
+            qdata[offset + np.asarray(positions)] = values
+        offset += count
+
+    # Dequantize each coded subband into its place in the coefficient image
+    w_tree = build_w_tree(width, height)
+    q_tree = build_q_tree(w_tree)
+    fdata = np.zeros((height, width), dtype=f32)
+    C = tables.bin_center
+    k = 0
+    for cnt in range(NUM_SUBBANDS):
+        q_bin = tables.q_bin[cnt]
+        if q_bin == 0.0:
+            continue
+        sub = q_tree[cnt]
+        n = sub["lenx"] * sub["leny"]
+        if k + n > total:
+            raise WsqError("WSQ data holds fewer coefficients than expected")
+        s = qdata[k : k + n].reshape(sub["leny"], sub["lenx"]).astype(f32)
+        k += n
+        half_z = float(tables.z_bin[cnt]) / 2.0
+        positive = (q_bin * (s - C)).astype(np.float64) + half_z
+        negative = (q_bin * (s + C)).astype(np.float64) - half_z
+        fdata[sub["y"] : sub["y"] + sub["leny"], sub["x"] : sub["x"] + sub["lenx"]] = (
+            np.where(s > 0, positive, np.where(s < 0, negative, 0.0)).astype(f32)
+        )
+
+    _reconstruct(fdata, w_tree, tables.lofilt, tables.hifilt)
+
+    pixels = fdata * r_scale + m_shift + f32(0.5)
+    return np.clip(np.floor(pixels), 0, 255).astype(np.uint8)
+
+
+# --- PIL integration ---
+
+
+def _accept(prefix):
+    return prefix[:2] == b"\xff\xa0"
+
+
+class WsqImageFile(ImageFile.ImageFile):
+    format = "WSQ"
+    format_description = "FBI Wavelet Scalar Quantization"
+
+    def _open(self):
+        header = self.fp.read()
+        try:
+            width, height = read_size(header)
+        except WsqError as e:
+            raise SyntaxError(str(e))
+        self._mode = "L"
+        self._size = (width, height)
+        self.tile = [ImageFile._Tile("wsq", (0, 0, width, height), 0, None)]
+
+
+class WsqDecoder(ImageFile.PyDecoder):
+    _pulls_fd = True
+
+    def decode(self, buffer):
+        self.fd.seek(0)
+        pixels = decode(self.fd.read())
+        self.set_as_raw(pixels.tobytes())
+        return -1, 0
+
+
+def register():
+    """Registers the WSQ format with PIL; repeated calls do nothing."""
+    if WsqImageFile.format in Image.OPEN:
+        return
+    Image.register_open(WsqImageFile.format, WsqImageFile, _accept)
+    Image.register_extension(WsqImageFile.format, ".wsq")
+    Image.register_decoder("wsq", WsqDecoder)
+
+
+register()